@@ -2,4 +2,16 @@ from django.apps import AppConfig
 
 
 class ControlConfig(AppConfig):
-    name = 'control'
+    name = 'controls'
+
+    def ready(self):
+        # Keep the full-text search index current.
+        from django.db.models.signals import post_save, post_delete
+        from . import search
+        from .models import Element, Statement
+        from .oscal import catalog_loaded
+        post_save.connect(search.element_saved, sender=Element, dispatch_uid="controls.search.element_saved")
+        post_delete.connect(search.element_deleted, sender=Element, dispatch_uid="controls.search.element_deleted")
+        post_save.connect(search.statement_saved, sender=Statement, dispatch_uid="controls.search.statement_saved")
+        post_delete.connect(search.statement_deleted, sender=Statement, dispatch_uid="controls.search.statement_deleted")
+        catalog_loaded.connect(search.catalog_loaded, dispatch_uid="controls.search.catalog_loaded")
@@ -0,0 +1,72 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from controls.models import Baselines, ElementControl, System
+
+class Command(BaseCommand):
+    help = 'Assigns a baseline of selected controls to many systems at once, or reports how systems differ from a baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('baselines_key', type=str, help="The baselines key, e.g. NIST_SP-800-53_rev4.")
+        parser.add_argument('baseline_name', type=str, help="The baseline name, e.g. moderate.")
+        parser.add_argument('systems', nargs="*", type=int, help="The IDs of controls.System instances. Defaults to all systems.")
+        parser.add_argument('--replace', action="store_true", help="Also remove selected controls from the same catalog that are not in the baseline.")
+        parser.add_argument('--dry-run', action="store_true", help="Only report the controls that would be added and removed.")
+
+    def handle(self, *args, **options):
+        baselines_key = options["baselines_key"]
+        baseline_name = options["baseline_name"]
+        if Baselines().get_baseline_controls(baselines_key, baseline_name) is False:
+            raise CommandError("Baseline {} {} does not exist.".format(baselines_key, baseline_name))
+
+        systems = System.objects.select_related('root_element').order_by('id')
+        if options["systems"]:
+            systems = systems.filter(id__in=options["systems"])
+        systems = list(systems)
+
+        # Fetch the currently selected controls of every system in one query.
+        selected_controls = defaultdict(set)
+        for element_id, oscal_ctl_id in ElementControl.objects\
+                .filter(element__in=[system.root_element for system in systems], oscal_catalog_key=baselines_key)\
+                .values_list('element_id', 'oscal_ctl_id'):
+            selected_controls[element_id].add(oscal_ctl_id)
+
+        deltas = []
+        for system in systems:
+            delta = system.root_element.baseline_controls_delta(baselines_key, baseline_name,
+                selected_controls=selected_controls[system.root_element.id])
+            deltas.append((system, delta))
+            print("{}: {} control(s) to add, {} control(s) {}".format(
+                system,
+                len(delta["add"]),
+                len(delta["remove"]),
+                "to remove" if options["replace"] else "not in baseline"))
+            if options["verbosity"] > 1:
+                for oscal_ctl_id in delta["add"]:
+                    print("  +", oscal_ctl_id)
+                for oscal_ctl_id in delta["remove"]:
+                    print("  -", oscal_ctl_id)
+
+        if options["dry_run"]:
+            return
+
+        self.apply_deltas(baselines_key, deltas, options["replace"])
+        print("Assigned baseline {} {} to {} system(s).".format(baselines_key, baseline_name, len(deltas)))
+
+    @transaction.atomic
+    def apply_deltas(self, baselines_key, deltas, replace):
+        # Insert the missing controls of all systems with a single bulk insert.
+        ElementControl.objects.bulk_create([
+            ElementControl(element=system.root_element, oscal_ctl_id=oscal_ctl_id, oscal_catalog_key=baselines_key)
+            for system, delta in deltas
+            for oscal_ctl_id in delta["add"]
+        ], batch_size=1000, ignore_conflicts=True)
+
+        if replace:
+            # Delete extra controls with one statement per system.
+            for system, delta in deltas:
+                if delta["remove"]:
+                    ElementControl.objects.filter(element=system.root_element, oscal_catalog_key=baselines_key,
+                                                  oscal_ctl_id__in=delta["remove"]).delete()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from controls.models import SearchDocument
+from controls.search import rebuild_index
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index over components, statements and catalog controls.'
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        print("Indexed {} documents.".format(SearchDocument.objects.count()))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from controls.models import Statement
+
+class Command(BaseCommand):
+    help = 'Reports control implementation statements that differ from their prototypes and optionally copies the prototypes to them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('elements', nargs="*", type=int, help="The IDs of the controls.Element instances producing the prototypes. Defaults to all elements.")
+        parser.add_argument('--propagate', action="store_true", help="Copy each prototype's body to its out-of-date instances in all systems.")
+
+    def handle(self, *args, **options):
+        out_of_sync = Statement.objects.out_of_sync()
+        if options["elements"]:
+            out_of_sync = out_of_sync.filter(prototype__producer_element__in=options["elements"])
+
+        # Count out-of-date instances per prototype in one query.
+        counts = out_of_sync.order_by().values('prototype_id').annotate(count=Count('id'))
+        counts = { row['prototype_id']: row['count'] for row in counts }
+        prototypes = Statement.objects.filter(id__in=counts).select_related('producer_element').order_by('producer_element__name', 'sid', 'pid')
+        for prototype in prototypes:
+            print("{} {} {}: {} out-of-date instance(s)".format(
+                prototype.producer_element.name if prototype.producer_element else "(no component)",
+                prototype.sid, prototype.pid or "", counts[prototype.id]))
+
+        if not options["propagate"]:
+            return
+
+        count = prototypes.propagate_prototypes()
+        print("Updated {} statement(s) from {} prototype(s).".format(count, len(counts)))
@@ -0,0 +1,111 @@
+# Generated by Django 3.0.11 on 2026-10-18 21:21
+
+from django.db import migrations, models
+
+# Create the database-specific full-text index over SearchDocument. On
+# PostgreSQL a trigger keeps a weighted tsvector column current and a GIN
+# index covers it. On SQLite an external-content FTS5 table is kept in sync
+# with triggers. Other databases fall back to unindexed LIKE queries.
+
+POSTGRESQL_FORWARD = [
+    "ALTER TABLE controls_searchdocument ADD COLUMN search_vector tsvector",
+    """CREATE FUNCTION controls_searchdocument_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.body, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER controls_searchdocument_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON controls_searchdocument
+    FOR EACH ROW EXECUTE PROCEDURE controls_searchdocument_search_vector()""",
+    "CREATE INDEX controls_searchdocument_search_vector_idx ON controls_searchdocument USING GIN (search_vector)",
+]
+
+POSTGRESQL_REVERSE = [
+    "DROP TRIGGER IF EXISTS controls_searchdocument_search_vector_trigger ON controls_searchdocument",
+    "DROP FUNCTION IF EXISTS controls_searchdocument_search_vector()",
+]
+
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE controls_searchdocument_fts USING fts5(
+        title, body,
+        content='controls_searchdocument', content_rowid='id',
+        tokenize='porter unicode61', prefix='2 3')""",
+    """CREATE TRIGGER controls_searchdocument_fts_insert AFTER INSERT ON controls_searchdocument BEGIN
+        INSERT INTO controls_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER controls_searchdocument_fts_delete AFTER DELETE ON controls_searchdocument BEGIN
+        INSERT INTO controls_searchdocument_fts(controls_searchdocument_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER controls_searchdocument_fts_update AFTER UPDATE ON controls_searchdocument BEGIN
+        INSERT INTO controls_searchdocument_fts(controls_searchdocument_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO controls_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS controls_searchdocument_fts_insert",
+    "DROP TRIGGER IF EXISTS controls_searchdocument_fts_delete",
+    "DROP TRIGGER IF EXISTS controls_searchdocument_fts_update",
+    "DROP TABLE IF EXISTS controls_searchdocument_fts",
+]
+
+def run_statements(schema_editor, statements_by_vendor):
+    for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+def create_fulltext_index(apps, schema_editor):
+    run_statements(schema_editor, { "postgresql": POSTGRESQL_FORWARD, "sqlite": SQLITE_FORWARD })
+
+def drop_fulltext_index(apps, schema_editor):
+    run_statements(schema_editor, { "postgresql": POSTGRESQL_REVERSE, "sqlite": SQLITE_REVERSE })
+
+def index_existing_objects(apps, schema_editor):
+    # We can't import the models directly as they may be a newer
+    # version than this migration expects. We use the historical versions.
+    # Catalog controls are indexed when each catalog is first loaded.
+    Element = apps.get_model('controls', 'Element')
+    Statement = apps.get_model('controls', 'Statement')
+    SearchDocument = apps.get_model('controls', 'SearchDocument')
+    SearchDocument.objects.bulk_create([
+        SearchDocument(doc_type="element", object_id=str(e.id), subtype=e.element_type,
+                       title=e.name or "", body=" ".join(filter(None, [e.full_name, e.description])))
+        for e in Element.objects.all().iterator()
+    ], batch_size=500)
+    SearchDocument.objects.bulk_create([
+        SearchDocument(doc_type="statement", object_id=str(smt.id), subtype=smt.statement_type,
+                       catalog_key=smt.sid_class, scope_element_id=smt.consumer_element_id,
+                       title=" ".join(filter(None, [smt.sid, smt.pid])), body=smt.body or "")
+        for smt in Statement.objects.all().iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0033_auto_20201129_1913'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_type', models.CharField(help_text="The kind of object indexed: 'element', 'statement' or 'control'.", max_length=20)),
+                ('object_id', models.CharField(help_text="The id of the indexed Element or Statement, or '<catalog key>:<OSCAL control id>' for a catalog control.", max_length=100)),
+                ('subtype', models.CharField(blank=True, help_text='The element_type of an Element or the statement_type of a Statement.', max_length=150, null=True)),
+                ('catalog_key', models.CharField(blank=True, help_text='The catalog key of a Statement or catalog control.', max_length=100, null=True)),
+                ('scope_element_id', models.IntegerField(blank=True, db_index=True, help_text='The id of the consumer Element of a Statement, used to restrict results to a system.', null=True)),
+                ('title', models.TextField(blank=True, help_text='Heavily weighted text, e.g. an Element name or control title.')),
+                ('body', models.TextField(blank=True, help_text='Text, e.g. a statement body or control prose.')),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('doc_type', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(index_existing_objects, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.0.11 on 2026-10-18 21:26
+
+from django.db import migrations, models
+
+
+def set_body_hashes(apps, schema_editor):
+    import xxhash
+    Statement = apps.get_model('controls', 'Statement')
+    batch = []
+    for smt in Statement.objects.only('id', 'body').iterator():
+        smt.body_hash = xxhash.xxh64((smt.body or "").encode("utf8")).hexdigest()
+        batch.append(smt)
+        if len(batch) == 500:
+            Statement.objects.bulk_update(batch, ['body_hash'])
+            batch = []
+    Statement.objects.bulk_update(batch, ['body_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0034_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statement',
+            name='body_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='Hash of the statement body, used to compare statements with their prototypes.', max_length=32, null=True),
+        ),
+        migrations.RunPython(set_body_hashes, migrations.RunPython.noop),
+    ]
@@ -8,6 +8,7 @@ from guardian.shortcuts import (assign_perm, get_objects_for_user,
 from .oscal import Catalogs, Catalog
 import uuid
 import tools.diff_match_patch.python3 as dmp_module
+from siteapp import profiling
 from copy import deepcopy
 from django.db import transaction
 
@@ -17,11 +18,53 @@ class SystemException(Exception):
     """Class for raising custom exceptions with Systems"""
     pass
 
+# Diffs between a statement and its prototype are cached by the pair of body
+# hashes, so unchanged pairs are never diffed twice.
+STATEMENT_DIFF_CACHE_TIMEOUT = 60*60*24 # 1 day
+
+def statement_body_hash(body):
+    """Return the hash stored in Statement.body_hash for a statement body."""
+    import xxhash
+    return xxhash.xxh64((body or "").encode("utf8")).hexdigest()
+
+class StatementQuerySet(models.QuerySet):
+    def with_prototypes(self):
+        """Fetch prototypes in the same query so that the sync and diff
+        properties of each statement do not query for its prototype."""
+        return self.select_related('prototype')
+
+    def out_of_sync(self):
+        """Statements whose body differs from their prototype's body."""
+        return self.filter(prototype__isnull=False).exclude(body_hash=models.F('prototype__body_hash'))
+
+    def in_sync(self):
+        """Statements whose body matches their prototype's body."""
+        return self.filter(prototype__isnull=False, body_hash=models.F('prototype__body_hash'))
+
+    def propagate_prototypes(self):
+        """Copy the body of each prototype in this queryset to all of its
+        out-of-date instances, across all systems. Returns the number of
+        instances updated."""
+        from django.utils import timezone
+        from . import search
+        count = 0
+        with transaction.atomic():
+            for prototype in self.select_related(None).only('id', 'body', 'body_hash'):
+                instance_ids = list(prototype.instances.exclude(body_hash=prototype.body_hash).values_list('id', flat=True))
+                if not instance_ids:
+                    continue
+                count += Statement.objects.filter(id__in=instance_ids).update(
+                    body=prototype.body, body_hash=prototype.body_hash, updated=timezone.now())
+                # update() bypasses the signals that maintain the search index.
+                search.index_statements(Statement.objects.filter(id__in=instance_ids))
+        return count
+
 class Statement(models.Model):
     sid = models.CharField(max_length=100, help_text="Statement identifier such as OSCAL formatted Control ID", unique=False, blank=True, null=True)
     sid_class = models.CharField(max_length=200, help_text="Statement identifier 'class' such as 'NIST_SP-800-53_rev4' or other OSCAL catalog name Control ID.", unique=False, blank=True, null=True)
     pid = models.CharField(max_length=20, help_text="Statement part identifier such as 'h' or 'h.1' or other part key", unique=False, blank=True, null=True)
     body = models.TextField(help_text="The statement itself", unique=False, blank=True, null=True)
+    body_hash = models.CharField(max_length=32, help_text="Hash of the statement body, used to compare statements with their prototypes.", blank=True, null=True, db_index=True)
     statement_type = models.CharField(max_length=150, help_text="Statement type.", unique=False, blank=True, null=True)
     remarks = models.TextField(help_text="Remarks about the statement.", unique=False, blank=True, null=True)
     status = models.CharField(max_length=100, help_text="The status of the statement.", unique=False, blank=True, null=True)
@@ -36,6 +79,8 @@ class Statement(models.Model):
     mentioned_elements = models.ManyToManyField('Element', related_name='statements_mentioning', blank=True, help_text="All elements mentioned in a statement; elements with a first degree relationship to the statement.")
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, help_text="A UUID (a unique identifier) for this Statement.")
 
+    objects = StatementQuerySet.as_manager()
+
     class Meta:
         indexes = [models.Index(fields=['producer_element'], name='producer_element_idx'),]
         permissions = [('can_grant_smt_owner_permission', 'Grant a user statement owner permission'),]
@@ -48,6 +93,13 @@ class Statement(models.Model):
         # For debugging.
         return "'%s %s %s %s id=%d'" % (self.statement_type, self.sid, self.pid, self.sid_class, self.id)
 
+    def save(self, *args, **kwargs):
+        # Keep the body hash current so sync status can be computed in the database.
+        self.body_hash = statement_body_hash(self.body)
+        if kwargs.get('update_fields') is not None and 'body' in kwargs['update_fields']:
+            kwargs['update_fields'] = list(kwargs['update_fields']) + ['body_hash']
+        super(Statement, self).save(*args, **kwargs)
+
     @cached_property
     def producer_element_name(self):
         return self.producer_element.name
@@ -65,9 +117,8 @@ class Statement(models.Model):
         """Return the control content from the catalog"""
         # Get instance of the control catalog
         catalog = Catalog.GetInstance(catalog_key=self.sid_class)
-        catalog_control_dict = catalog.get_flattened_controls_all_as_dict()
-        # Look up control by ID
-        return catalog_control_dict[self.sid]
+        # Look up control by ID in the catalog's precomputed flattened controls
+        return catalog.flattened_controls_all_as_dict[self.sid]
 
     def create_prototype(self):
         """Creates a prototype statement from an existing statement and prototype object"""
@@ -117,10 +168,27 @@ class Statement(models.Model):
     def prototype_synched(self):
         """Return True if statement of type `control_implementation` and its prototype"""
 
-        if self.body == self.prototype.body:
-            return True
-        else:
-            return False
+        # Compare the stored hashes. Use StatementQuerySet.with_prototypes()
+        # when listing statements to avoid a query for each prototype.
+        return self.body_hash == self.prototype.body_hash
+
+    def propagate_to_instances(self):
+        """Copy the body of this prototype statement to its out-of-date instances.
+        Returns the number of instances updated."""
+        return Statement.objects.filter(id=self.id).propagate_prototypes()
+
+    def _cached_prototype_diff(self, kind, compute):
+        """Return compute(dmp, diff) for the diff of the prototype body to this
+        statement's body, cached by the two body hashes."""
+        from django.core.cache import cache
+        cache_key = "statement_diff:{}:{}:{}".format(kind, self.prototype.body_hash, self.body_hash)
+        value = cache.get(cache_key)
+        profiling.count("statement_diff_cache." + ("miss" if value is None else "hit"))
+        if value is None:
+            dmp = dmp_module.diff_match_patch()
+            value = compute(dmp, dmp.diff_main(self.prototype.body, self.body))
+            cache.set(cache_key, value, STATEMENT_DIFF_CACHE_TIMEOUT)
+        return value
 
     @property
     def diff_prototype_main(self):
@@ -132,9 +200,7 @@ class Statement(models.Model):
         if self.prototype is None:
             # TODO: Should we return None or raise error because statement does not have a prototype?
             return None
-        dmp = dmp_module.diff_match_patch()
-        diff = dmp.diff_main(self.prototype.body, self.body)
-        return diff
+        return self._cached_prototype_diff("main", lambda dmp, diff: diff)
 
     @property
     def diff_prototype_prettyHtml(self):
@@ -146,9 +212,7 @@ class Statement(models.Model):
         if self.prototype is None:
             # TODO: Should we return None or raise error because statement does not have a prototype?
             return None
-        dmp = dmp_module.diff_match_patch()
-        diff = dmp.diff_main(self.prototype.body, self.body)
-        return dmp.diff_prettyHtml(diff)
+        return self._cached_prototype_diff("html", lambda dmp, diff: dmp.diff_prettyHtml(diff))
 
     # TODO:c
     #   - On Save be sure to replace any '\r\n' with '\n' added by round-tripping with excel
@@ -200,27 +264,61 @@ class Element(models.Model):
         except:
             return False
 
-    def assign_baseline_controls(self, user, baselines_key, baseline_name):
-        """Assign set of controls from baseline to an element"""
+    def assign_baseline_controls(self, user, baselines_key, baseline_name, replace=False):
+        """Assign set of controls from baseline to an element
+
+        Only the controls not already selected are inserted, in bulk. If
+        replace is True, selected controls from the same catalog that are
+        not in the baseline are removed in the same transaction."""
 
         # Usage
             # s = System.objects.get(pk=20)
-            # s.root_element.assign_baseline_controls('NIST_SP-800-53_rev4', 'low')
+            # s.root_element.assign_baseline_controls(user, 'NIST_SP-800-53_rev4', 'low')
 
         can_assign_controls = user.has_perm('change_element', self)
         # Does user have edit permissions on system?
         if  can_assign_controls:
-            from controls.models import Baselines
-            bs = Baselines()
-            controls = bs.get_baseline_controls(baselines_key, baseline_name)
-            for oscal_ctl_id in controls:
-                ec = ElementControl(element=self, oscal_ctl_id=oscal_ctl_id, oscal_catalog_key=baselines_key)
-                ec.save()
+            delta = self.baseline_controls_delta(baselines_key, baseline_name)
+            if delta is False:
+                return False
+            self.apply_baseline_controls_delta(baselines_key, delta, replace=replace)
             return True
         else:
             # print("User does not have permission to assign selected controls to element's system.")
             return False
 
+    def baseline_controls_delta(self, baselines_key, baseline_name, selected_controls=None):
+        """Return a dict with the sorted lists of oscal_ctl_ids to 'add' to and 'remove'
+        from this element's selected controls for it to match a baseline, or False if
+        the baseline does not exist.
+
+        selected_controls optionally provides the element's currently selected
+        oscal_ctl_ids for the catalog, to avoid a query when diffing many elements."""
+        baseline_controls = Baselines().get_baseline_controls(baselines_key, baseline_name)
+        if baseline_controls is False:
+            return False
+        if selected_controls is None:
+            selected_controls = self.controls.filter(oscal_catalog_key=baselines_key)\
+                .values_list('oscal_ctl_id', flat=True)
+        baseline_controls = set(baseline_controls)
+        selected_controls = set(selected_controls)
+        return {
+            "add": sorted(baseline_controls - selected_controls),
+            "remove": sorted(selected_controls - baseline_controls),
+        }
+
+    @transaction.atomic
+    def apply_baseline_controls_delta(self, baselines_key, delta, replace=False):
+        """Apply a delta computed by baseline_controls_delta to this element."""
+        # ignore_conflicts makes this safe if a control was selected concurrently
+        # between computing the delta and applying it.
+        ElementControl.objects.bulk_create([
+            ElementControl(element=self, oscal_ctl_id=oscal_ctl_id, oscal_catalog_key=baselines_key)
+            for oscal_ctl_id in delta["add"]
+        ], ignore_conflicts=True)
+        if replace and delta["remove"]:
+            self.controls.filter(oscal_catalog_key=baselines_key, oscal_ctl_id__in=delta["remove"]).delete()
+
     def statements(self, statement_type):
         """Return on the statements of statement_type produced by this element"""
         smts = Statement.objects.filter(producer_element = self, statement_type = statement_type)
@@ -526,6 +624,10 @@ class ElementCommonControl(models.Model):
 
 class Baselines (object):
     """Represent list of baselines"""
+
+    # Parsed baselines files by baselines key, shared by all instances.
+    _cached_json = {}
+
     def __init__(self):
         global BASELINE_PATH
         self.file_path = BASELINE_PATH
@@ -557,6 +659,10 @@ class Baselines (object):
 
     def _load_json(self, baselines_key):
         """Read baseline file - JSON"""
+        # Baseline files never change while the process is running, so keep
+        # the parsed file in memory indefinitely, like Catalog.GetInstance.
+        if baselines_key in Baselines._cached_json:
+            return Baselines._cached_json[baselines_key]
         # TODO Escape baselines_key
         self.data_file = baselines_key + "_baselines.json"
         data_file = os.path.join(self.file_path, self.data_file)
@@ -568,6 +674,7 @@ class Baselines (object):
         try:
             with open(data_file, 'r') as json_file:
                 data = json.load(json_file)
+            Baselines._cached_json[baselines_key] = data
             return data
         except:
             print("ERROR: {} could not be read or could not be read as json".format(data_file))
@@ -580,8 +687,9 @@ class Baselines (object):
         else:
             print("Requested baselines_key not found in baselines_key data file")
             return False
-        if baseline_name in data.keys():
-            return data[baseline_name]['controls']
+        if data and baseline_name in data.keys():
+            # Return a copy so callers cannot modify the cached data.
+            return list(data[baseline_name]['controls'])
         else:
             print("Requested baseline name not found in baselines_key data file")
             return False
@@ -624,3 +732,27 @@ class Poam(models.Model):
 
     # TODO:
     #   - On Save be sure to replace any '\r\n' with '\n' added by round-tripping with excel
+
+class SearchDocument(models.Model):
+    """A denormalized copy of the searchable text of an Element, Statement or
+    catalog control. The full-text index over it is maintained by the
+    database: a tsvector column and GIN index on PostgreSQL, or an FTS5
+    virtual table on SQLite. See controls/search.py."""
+    doc_type = models.CharField(max_length=20, help_text="The kind of object indexed: 'element', 'statement' or 'control'.")
+    object_id = models.CharField(max_length=100, help_text="The id of the indexed Element or Statement, or '<catalog key>:<OSCAL control id>' for a catalog control.")
+    subtype = models.CharField(max_length=150, blank=True, null=True, help_text="The element_type of an Element or the statement_type of a Statement.")
+    catalog_key = models.CharField(max_length=100, blank=True, null=True, help_text="The catalog key of a Statement or catalog control.")
+    scope_element_id = models.IntegerField(blank=True, null=True, db_index=True, help_text="The id of the consumer Element of a Statement, used to restrict results to a system.")
+    title = models.TextField(blank=True, help_text="Heavily weighted text, e.g. an Element name or control title.")
+    body = models.TextField(blank=True, help_text="Text, e.g. a statement body or control prose.")
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [('doc_type', 'object_id')]
+
+    def __str__(self):
+        return "'%s %s id=%d'" % (self.doc_type, self.object_id, self.id)
+
+    def __repr__(self):
+        # For debugging.
+        return "'%s %s id=%d'" % (self.doc_type, self.object_id, self.id)
@@ -4,9 +4,17 @@ import yaml
 import re
 from pathlib import Path
 
+from django.dispatch import Signal
+from siteapp import profiling
+
 CATALOG_PATH = os.path.join(os.path.dirname(__file__),'data','catalogs')
 
 
+# Sent with the new Catalog instance the first time a catalog is loaded by
+# Catalog.GetInstance (without organization-defined parameter values).
+catalog_loaded = Signal()
+
+
 class Catalogs (object):
     """Represent list of catalogs"""
 
@@ -74,8 +82,14 @@ class Catalog (object):
             catalog_instance_key += '_' + str(parameter_values_hash)
             
         if not hasattr(Catalog, catalog_instance_key):
-            new_catalog = Catalog(catalog_key=catalog_key, parameter_values=parameter_values)
+            profiling.count("catalog_cache.miss")
+            with profiling.timer("catalog_load"):
+                new_catalog = Catalog(catalog_key=catalog_key, parameter_values=parameter_values)
             setattr(Catalog, catalog_instance_key, new_catalog)
+            if not parameter_values:
+                catalog_loaded.send(sender=Catalog, catalog=new_catalog)
+        else:
+            profiling.count("catalog_cache.hit")
         return getattr(Catalog, catalog_instance_key)
 
     def __init__(self, catalog_key=Catalogs.NIST_SP_800_53_rev4, parameter_values=dict()):
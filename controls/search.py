@@ -0,0 +1,304 @@
+# Full-text search over components, statements and catalog controls
+#
+# The searchable text of every Element, Statement and catalog control is
+# copied into a SearchDocument row. The database maintains the full-text
+# index over those rows (see migration 0034_searchdocument):
+#
+# * PostgreSQL: a weighted tsvector column, kept current by a trigger and
+#   covered by a GIN index. Queries use to_tsquery and ts_rank.
+# * SQLite: an external-content FTS5 table kept in sync by triggers, with
+#   prefix indexes for autocomplete. Queries use MATCH and bm25.
+# * Anything else: unindexed icontains queries.
+#
+# SearchDocuments are kept current by the signal receivers at the bottom of
+# this module, which ControlConfig.ready() connects. QuerySet.update() and
+# bulk_create() bypass signals, so code paths that use them should reindex
+# explicitly, or run `manage.py rebuild_search_index`.
+
+import re
+
+from django.db import connection, transaction, DatabaseError
+
+from .models import SearchDocument
+
+DOC_TYPES = ("element", "statement", "control")
+
+# Relative weights of the title and body columns in SQLite bm25 rankings.
+# PostgreSQL gets the same effect from the 'A' and 'B' tsvector weights.
+FTS5_TITLE_WEIGHT = 10.0
+FTS5_BODY_WEIGHT = 1.0
+
+
+# Documents.
+
+def element_document(element):
+    return dict(
+        subtype=element.element_type,
+        title=element.name or "",
+        body=" ".join(filter(None, [element.full_name, element.description])),
+    )
+
+def statement_document(smt):
+    return dict(
+        subtype=smt.statement_type,
+        catalog_key=smt.sid_class,
+        scope_element_id=smt.consumer_element_id,
+        title=" ".join(filter(None, [smt.sid, smt.pid])),
+        body=smt.body or "",
+    )
+
+def catalog_control_object_id(catalog_key, control_id):
+    return "{}:{}".format(catalog_key, control_id)
+
+def index_element(element):
+    SearchDocument.objects.update_or_create(doc_type="element", object_id=str(element.id),
+                                            defaults=element_document(element))
+
+def index_elements(elements):
+    """Reindex many elements at once, e.g. after a bulk_create()."""
+    elements = list(elements)
+    with transaction.atomic():
+        SearchDocument.objects.filter(doc_type="element", object_id__in=[str(e.id) for e in elements]).delete()
+        SearchDocument.objects.bulk_create([
+            SearchDocument(doc_type="element", object_id=str(e.id), **element_document(e))
+            for e in elements
+        ], batch_size=500)
+
+def index_statement(smt):
+    SearchDocument.objects.update_or_create(doc_type="statement", object_id=str(smt.id),
+                                            defaults=statement_document(smt))
+
+def index_statements(smts):
+    """Reindex many statements at once, e.g. after a QuerySet.update()."""
+    smts = list(smts)
+    with transaction.atomic():
+        SearchDocument.objects.filter(doc_type="statement", object_id__in=[str(smt.id) for smt in smts]).delete()
+        SearchDocument.objects.bulk_create([
+            SearchDocument(doc_type="statement", object_id=str(smt.id), **statement_document(smt))
+            for smt in smts
+        ], batch_size=500)
+
+def unindex(doc_type, object_id):
+    SearchDocument.objects.filter(doc_type=doc_type, object_id=str(object_id)).delete()
+
+def index_catalog(catalog, force=False):
+    """Index the controls of a loaded controls.oscal.Catalog. Unless force is
+    True, nothing is done if the catalog already appears to be indexed."""
+    if catalog.status != "ok":
+        return
+    controls = catalog.flattened_controls_all_as_dict
+    existing = SearchDocument.objects.filter(doc_type="control", catalog_key=catalog.catalog_key)
+    if not force and existing.count() == len(controls):
+        return
+    with transaction.atomic():
+        existing.delete()
+        SearchDocument.objects.bulk_create([
+            SearchDocument(
+                doc_type="control",
+                object_id=catalog_control_object_id(catalog.catalog_key, cl_dict['id']),
+                catalog_key=catalog.catalog_key,
+                title="{} {}".format(cl_dict['id_display'], cl_dict['title']),
+                body=cl_dict['description'] or "",
+            )
+            for cl_dict in controls.values()
+        ], batch_size=500)
+
+def rebuild_index():
+    """Recreate every SearchDocument from the current database and catalogs."""
+    from .models import Element, Statement
+    from .oscal import Catalogs, Catalog
+    with transaction.atomic():
+        SearchDocument.objects.filter(doc_type__in=("element", "statement")).delete()
+        SearchDocument.objects.bulk_create([
+            SearchDocument(doc_type="element", object_id=str(e.id), **element_document(e))
+            for e in Element.objects.all().iterator()
+        ], batch_size=500)
+        SearchDocument.objects.bulk_create([
+            SearchDocument(doc_type="statement", object_id=str(smt.id), **statement_document(smt))
+            for smt in Statement.objects.all().iterator()
+        ], batch_size=500)
+        for catalog_key in Catalogs()._list_catalog_keys():
+            index_catalog(Catalog.GetInstance(catalog_key=catalog_key), force=True)
+
+
+# Queries.
+
+class SearchResults(object):
+    """One page of ranked SearchDocuments."""
+    def __init__(self, results, total, page, page_size):
+        self.results = results
+        self.total = total
+        self.page = page
+        self.page_size = page_size
+
+    @property
+    def num_pages(self):
+        return max(1, (self.total + self.page_size - 1) // self.page_size)
+
+    @property
+    def has_next(self):
+        return self.page < self.num_pages
+
+    def as_json(self):
+        return {
+            "results": [
+                { "doc_type": doc.doc_type, "object_id": doc.object_id, "subtype": doc.subtype,
+                  "catalog_key": doc.catalog_key, "title": doc.title, "body": doc.body }
+                for doc in self.results
+            ],
+            "total": self.total,
+            "page": self.page,
+            "num_pages": self.num_pages,
+        }
+
+def search(text, doc_types=None, subtype=None, scope_element_ids=None, element_types=None, page=1, page_size=20):
+    """Return a SearchResults page of the documents best matching all of the
+    words in text.
+
+    doc_types limits results to some of DOC_TYPES. subtype limits results to
+    an element_type or statement_type. If scope_element_ids is not None, only
+    documents not tied to a consumer element, or tied to one of the given
+    elements, are returned -- e.g. statements of a system plus prototypes.
+    If element_types is not None, element documents are limited to those
+    element_types, e.g. to keep systems' root elements out of results."""
+    page = max(1, int(page))
+    ids, total = _query(text, False, doc_types, subtype, scope_element_ids, element_types, page_size, (page-1)*page_size)
+    return SearchResults(_in_order(ids), total, page, page_size)
+
+def autocomplete(text, doc_types=None, subtype=None, scope_element_ids=None, element_types=None, limit=20):
+    """Return a list of the documents whose titles best match text, treating
+    its last word as a prefix."""
+    ids, _ = _query(text, True, doc_types, subtype, scope_element_ids, element_types, limit, 0, count=False)
+    return _in_order(ids)
+
+def _in_order(ids):
+    docs = SearchDocument.objects.in_bulk(ids)
+    return [docs[doc_id] for doc_id in ids if doc_id in docs]
+
+def _words(text):
+    return re.findall(r"\w+", text or "")
+
+def _backend():
+    if connection.vendor == "postgresql":
+        return "postgresql"
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='controls_searchdocument_fts'")
+            if cursor.fetchone():
+                return "fts5"
+    return "like"
+
+def _query(text, prefix, doc_types, subtype, scope_element_ids, element_types, limit, offset, count=True):
+    words = _words(text)
+    if not words:
+        return [], 0
+
+    backend = _backend()
+    if backend == "like":
+        return _query_like(words, prefix, doc_types, subtype, scope_element_ids, element_types, limit, offset, count)
+
+    # Build the filters on the SearchDocument table, aliased 'd'.
+    where = []
+    params = []
+    if doc_types:
+        where.append("d.doc_type IN (" + ", ".join(["%s"] * len(doc_types)) + ")")
+        params.extend(doc_types)
+    if subtype:
+        where.append("d.subtype = %s")
+        params.append(subtype)
+    if scope_element_ids is not None:
+        scope_element_ids = list(scope_element_ids)
+        if scope_element_ids:
+            where.append("(d.scope_element_id IS NULL OR d.scope_element_id IN (" + ", ".join(["%s"] * len(scope_element_ids)) + "))")
+            params.extend(scope_element_ids)
+        else:
+            where.append("d.scope_element_id IS NULL")
+    if element_types is not None:
+        where.append("(d.doc_type <> 'element' OR d.subtype IN (" + ", ".join(["%s"] * len(element_types)) + "))")
+        params.extend(element_types)
+
+    if backend == "postgresql":
+        # Words only contain \w characters so they are safe in tsquery syntax.
+        # For autocomplete, match only the title ('A' weight) and treat the
+        # last word as a prefix.
+        if prefix:
+            terms = [w + ":A" for w in words[:-1]] + [words[-1] + ":*A"]
+        else:
+            terms = words
+        match_params = [" & ".join(terms)]
+        from_sql = "controls_searchdocument d, to_tsquery('english', %s) query"
+        where.insert(0, "d.search_vector @@ query")
+        rank_sql = "ts_rank(d.search_vector, query) DESC"
+    else:
+        # Quote each word as an FTS5 string so it is never parsed as syntax.
+        terms = ['"' + w + '"' for w in words]
+        if prefix:
+            terms[-1] += "*"
+            match = "title : (" + " AND ".join(terms) + ")"
+        else:
+            match = " AND ".join(terms)
+        match_params = [match]
+        from_sql = "controls_searchdocument_fts JOIN controls_searchdocument d ON d.id = controls_searchdocument_fts.rowid"
+        where.insert(0, "controls_searchdocument_fts MATCH %s")
+        rank_sql = "bm25(controls_searchdocument_fts, {}, {})".format(FTS5_TITLE_WEIGHT, FTS5_BODY_WEIGHT)
+
+    where_sql = " AND ".join(where)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT d.id FROM {} WHERE {} ORDER BY {}, d.title LIMIT %s OFFSET %s".format(from_sql, where_sql, rank_sql),
+            match_params + params + [limit, offset])
+        ids = [row[0] for row in cursor.fetchall()]
+        total = None
+        if count:
+            if offset == 0 and len(ids) < limit:
+                total = len(ids)
+            else:
+                cursor.execute("SELECT COUNT(*) FROM {} WHERE {}".format(from_sql, where_sql), match_params + params)
+                total = cursor.fetchone()[0]
+    return ids, total
+
+def _query_like(words, prefix, doc_types, subtype, scope_element_ids, element_types, limit, offset, count):
+    from django.db.models import Q
+    qs = SearchDocument.objects.all()
+    if doc_types:
+        qs = qs.filter(doc_type__in=doc_types)
+    if subtype:
+        qs = qs.filter(subtype=subtype)
+    if scope_element_ids is not None:
+        qs = qs.filter(Q(scope_element_id__isnull=True) | Q(scope_element_id__in=list(scope_element_ids)))
+    if element_types is not None:
+        qs = qs.exclude(Q(doc_type="element") & ~Q(subtype__in=list(element_types)))
+    for word in words:
+        if prefix:
+            qs = qs.filter(title__icontains=word)
+        else:
+            qs = qs.filter(Q(title__icontains=word) | Q(body__icontains=word))
+    qs = qs.order_by('title', 'id')
+    ids = list(qs.values_list('id', flat=True)[offset:offset+limit])
+    return ids, (qs.count() if count else None)
+
+
+# Signal receivers, connected in ControlsConfig.ready().
+
+def element_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_element(instance)
+
+def element_deleted(sender, instance, **kwargs):
+    unindex("element", instance.id)
+
+def statement_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_statement(instance)
+
+def statement_deleted(sender, instance, **kwargs):
+    unindex("statement", instance.id)
+
+def catalog_loaded(sender, catalog, **kwargs):
+    # Catalogs are loaded lazily and may be loaded outside of a request or
+    # before the search tables exist, so never let indexing break loading.
+    try:
+        with transaction.atomic():
+            index_catalog(catalog)
+    except DatabaseError:
+        pass
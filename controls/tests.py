@@ -385,6 +385,38 @@ class StatementUnitTests(TestCase):
         self.assertFalse(smt.prototype_synched)
         self.assertEqual(smt.diff_prototype_main, [(0, 'This is a test statement.'), (-1, '\nModified statememt')])
 
+    def test_prototype_sync_and_propagate(self):
+        # Create a prototype with instances in two systems
+        e1 = Element.objects.create(name="System A", element_type="system")
+        e2 = Element.objects.create(name="System B", element_type="system")
+        prototype = Statement.objects.create(
+            sid = "au.3",
+            sid_class = "NIST_SP-800-53_rev4",
+            body = "This is a test statement.",
+            statement_type = "control_implementation_prototype",
+        )
+        smt1 = prototype.create_instance_from_prototype(e1.id)
+        smt2 = prototype.create_instance_from_prototype(e2.id)
+        self.assertEqual(smt1.body_hash, prototype.body_hash)
+        self.assertEqual(Statement.objects.out_of_sync().count(), 0)
+
+        # Change the prototype and check sync status in the database
+        prototype.body = "This is an updated test statement."
+        prototype.save()
+        self.assertEqual(set(Statement.objects.out_of_sync()), {smt1, smt2})
+        with self.assertNumQueries(1):
+            smts = list(Statement.objects.filter(consumer_element=e1).with_prototypes())
+            self.assertFalse(smts[0].prototype_synched)
+            self.assertIn("updated", smts[0].diff_prototype_prettyHtml)
+
+        # Propagate the prototype to all instances
+        self.assertEqual(prototype.propagate_to_instances(), 2)
+        self.assertEqual(Statement.objects.out_of_sync().count(), 0)
+        smt2.refresh_from_db()
+        self.assertEqual(smt2.body, "This is an updated test statement.")
+        self.assertTrue(smt2.prototype_synched)
+        self.assertEqual(prototype.propagate_to_instances(), 0)
+
 class ElementUnitTests(TestCase):
     ## Simply dummy test ##
     def test_tests(self):
@@ -486,6 +518,47 @@ class SystemUnitTests(TestCase):
         self.assertIn('delete_system', perms)
         self.assertIn('view_system', perms)
 
+class BaselineUnitTests(TestCase):
+    """Class for assigning baselines Unit Tests"""
+
+    def setUp(self):
+        self.e = Element.objects.create(name="Baseline System", full_name="Baseline System", element_type="system")
+        self.s = System.objects.create(root_element=self.e)
+        self.u = User.objects.create(username="baseline_user", email="baseline_user@example.com")
+        self.s.assign_owner_permissions(self.u)
+        self.e.assign_owner_permissions(self.u)
+        self.baseline = Baselines().get_baseline_controls('NIST_SP-800-53_rev4', 'low')
+
+    def test_assign_baseline_controls(self):
+        self.assertTrue(self.e.assign_baseline_controls(self.u, 'NIST_SP-800-53_rev4', 'low'))
+        self.assertEqual(sorted(self.e.selected_controls_oscal_ctl_ids), sorted(self.baseline))
+        # Assigning again does not fail on the unique constraint or duplicate controls.
+        self.assertTrue(self.e.assign_baseline_controls(self.u, 'NIST_SP-800-53_rev4', 'low'))
+        self.assertEqual(self.e.controls.count(), len(self.baseline))
+
+    def test_assign_baseline_controls_replace(self):
+        ElementControl.objects.create(element=self.e, oscal_ctl_id="zz-1", oscal_catalog_key='NIST_SP-800-53_rev4')
+        ElementControl.objects.create(element=self.e, oscal_ctl_id="3.1.1", oscal_catalog_key='NIST_SP-800-171_rev1')
+        delta = self.e.baseline_controls_delta('NIST_SP-800-53_rev4', 'low')
+        self.assertEqual(delta["remove"], ["zz-1"])
+        self.assertEqual(len(delta["add"]), len(self.baseline))
+        self.e.assign_baseline_controls(self.u, 'NIST_SP-800-53_rev4', 'low')
+        self.assertIn("zz-1", self.e.selected_controls_oscal_ctl_ids)
+        self.e.assign_baseline_controls(self.u, 'NIST_SP-800-53_rev4', 'low', replace=True)
+        self.assertNotIn("zz-1", self.e.selected_controls_oscal_ctl_ids)
+        # Controls from other catalogs are left alone.
+        self.assertIn("3.1.1", self.e.selected_controls_oscal_ctl_ids)
+
+    def test_assign_baseline_command(self):
+        from django.core.management import call_command
+        e2 = Element.objects.create(name="Baseline System 2", full_name="Baseline System 2", element_type="system")
+        s2 = System.objects.create(root_element=e2)
+        call_command('assign_baseline', 'NIST_SP-800-53_rev4', 'low', str(self.s.id), str(s2.id), '--dry-run')
+        self.assertEqual(ElementControl.objects.count(), 0)
+        call_command('assign_baseline', 'NIST_SP-800-53_rev4', 'low', str(self.s.id), str(s2.id))
+        self.assertEqual(self.e.controls.count(), len(self.baseline))
+        self.assertEqual(e2.controls.count(), len(self.baseline))
+
 class PoamUnitTests(TestCase):
     """Class for Poam Unit Tests"""
 
@@ -526,6 +599,102 @@ class PoamUnitTests(TestCase):
         # poam.delete()
         # self.assertTrue(poam.uuid is None)
 
+    def _create_system_with_poams(self, count):
+        e = Element.objects.create(name="POA&M Export System", full_name="POA&M Export System", element_type="system")
+        s = System.objects.create(root_element=e)
+        u = User.objects.create(username="poam_exporter", email="poam_exporter@example.com")
+        s.assign_owner_permissions(u)
+        for i in range(count):
+            smt = Statement.objects.create(body="Weakness {}".format(i), statement_type="POAM", status="Open",
+                                           consumer_element=e)
+            Poam.objects.create(statement=smt, poam_id=i + 1, weakness_name="Weakness name {}".format(i))
+        return s, u
+
+    def test_poam_export_csv(self):
+        from django.test import RequestFactory
+        from .views import poam_export_csv
+        s, u = self._create_system_with_poams(3)
+        request = RequestFactory().get("/")
+        request.user = u
+        resp = poam_export_csv(request, str(s.id))
+        self.assertTrue(resp.streaming)
+        lines = b"".join(resp.streaming_content).decode("utf8").splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith("POA&M ID,"))
+        self.assertTrue(lines[0].endswith(",URL"))
+        self.assertTrue(lines[1].startswith("V-1,,Weakness name 0,"))
+
+    def test_poam_export_xlsx(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        from django.test import RequestFactory
+        from .views import poam_export_xlsx
+        s, u = self._create_system_with_poams(3)
+        request = RequestFactory().get("/")
+        request.user = u
+        resp = poam_export_xlsx(request, str(s.id))
+        ws = load_workbook(BytesIO(b"".join(resp.streaming_content)))["POA&Ms"]
+        self.assertEqual(ws.max_row, 4)
+        self.assertEqual(ws["A1"].value, "POA&M ID")
+        self.assertEqual(ws["A1"].style, "export_header")
+        self.assertEqual(ws["A4"].value, "V-3")
+        self.assertEqual(ws["E4"].value, "Weakness 2")
+
+    def test_controls_selected_export_xacta_xlsx(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        from django.test import RequestFactory
+        from .views import controls_selected_export_xacta_xslx
+        s, u = self._create_system_with_poams(0)
+        for ctl_id in ("3.1.1", "3.1.2"):
+            ElementControl.objects.create(element=s.root_element, oscal_ctl_id=ctl_id,
+                                          oscal_catalog_key=Catalogs.NIST_SP_800_171_rev1)
+        Statement.objects.create(sid="3.1.2", sid_class=Catalogs.NIST_SP_800_171_rev1, body="Implemented.",
+                                 statement_type="control_implementation", consumer_element=s.root_element)
+        request = RequestFactory().get("/")
+        request.user = u
+        resp = controls_selected_export_xacta_xslx(request, str(s.id))
+        ws = load_workbook(BytesIO(b"".join(resp.streaming_content)))["Controls_Implementation"]
+        self.assertEqual(ws.max_row, 3)
+        self.assertEqual(ws["Q1"].value, "History")
+        self.assertEqual(ws["A3"].value, "3.1.2")
+        self.assertEqual(ws["C3"].value, "Implemented.")
+
+class SystemExportUnitTests(TestCase):
+    """Class for system export Unit Tests"""
+
+    def test_export_system_opencontrol(self):
+        import zipfile
+        from io import BytesIO
+        import rtyaml
+        from django.test import RequestFactory
+        from .views import export_system_opencontrol
+
+        e = Element.objects.create(name="OpenControl System", full_name="OpenControl System", element_type="system")
+        s = System.objects.create(root_element=e)
+        u = User.objects.create(username="opencontrol_exporter", email="opencontrol_exporter@example.com")
+        s.assign_owner_permissions(u)
+        for name in ("Component A", "Component B"):
+            component = Element.objects.create(name=name, full_name=name, element_type="system_element")
+            for sid in ("3.1.1", "3.1.2"):
+                Statement.objects.create(sid=sid, sid_class=Catalogs.NIST_SP_800_171_rev1, body=name + " " + sid,
+                                         statement_type="control_implementation",
+                                         producer_element=component, consumer_element=e)
+
+        request = RequestFactory().get("/")
+        request.user = u
+        resp = export_system_opencontrol(request, str(s.id))
+        zf = zipfile.ZipFile(BytesIO(b"".join(resp.streaming_content)))
+        names = zf.namelist()
+        self.assertIn("opencontrol.yaml", names)
+        self.assertIn("standards/NIST-SP-800-53-rev4.yaml", names)
+        self.assertIn("components/Component_A.yaml", names)
+        self.assertIn("components/Component_B.yaml", names)
+        component = rtyaml.load(zf.read("components/Component_B.yaml"))
+        self.assertEqual(component["name"], "Component B")
+        self.assertEqual([smt["control_key"] for smt in component["satisfies"]], ["3.1.1", "3.1.2"])
+        self.assertEqual(component["satisfies"][0]["narrative"][0]["text"], "Component B 3.1.1")
+
 class ControlComponentTests(OrganizationSiteFunctionalTests):
 
     def create_test_statement(self, sid, sid_class, body, statement_type, status):
@@ -701,3 +870,95 @@ class ControlComponentTests(OrganizationSiteFunctionalTests):
         statement_title_list = self.browser.find_elements_by_css_selector("span#producer_element-panel_num-title")
         assert len(statement_title_list) == 7
 
+
+class SearchUnitTests(TestCase):
+    """Class for full-text search Unit Tests"""
+
+    def setUp(self):
+        self.system_element = Element.objects.create(name="Search System", full_name="Search System", element_type="system")
+        self.system = System.objects.create(root_element=self.system_element)
+        self.other_system_element = Element.objects.create(name="Other System", full_name="Other System", element_type="system")
+        self.component = Element.objects.create(name="Apache Web Server", full_name="Apache HTTP Server",
+                                                description="Serves the application", element_type="system_element")
+        Element.objects.create(name="Postgres Database", full_name="PostgreSQL", element_type="system_element")
+        self.smt = Statement.objects.create(sid="ac-2", sid_class="NIST_SP-800-53_rev4", statement_type="control_implementation",
+                                            body="Accounts are reviewed quarterly by the security officer.",
+                                            producer_element=self.component, consumer_element=self.system_element)
+        Statement.objects.create(sid="ac-3", sid_class="NIST_SP-800-53_rev4", statement_type="control_implementation",
+                                 body="Accounts are locked after three failed logins.",
+                                 producer_element=self.component, consumer_element=self.other_system_element)
+
+    def test_autocomplete_elements(self):
+        from .search import autocomplete
+        results = autocomplete("apa", doc_types=["element"], subtype="system_element")
+        self.assertEqual([doc.title for doc in results], ["Apache Web Server"])
+        self.assertEqual(results[0].object_id, str(self.component.id))
+        self.assertEqual(autocomplete("web serv", doc_types=["element"])[0].title, "Apache Web Server")
+        self.assertEqual(autocomplete("", doc_types=["element"]), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        from .search import autocomplete
+        self.component.name = "Nginx Web Server"
+        self.component.save()
+        self.assertEqual(autocomplete("apache", doc_types=["element"]), [])
+        self.assertEqual(autocomplete("nginx", doc_types=["element"])[0].title, "Nginx Web Server")
+        self.component.delete()
+        self.assertEqual(autocomplete("nginx", doc_types=["element"]), [])
+
+    def test_search_statements(self):
+        from .search import search
+        results = search("accounts", doc_types=["statement"])
+        self.assertEqual(results.total, 2)
+        results = search("accounts", doc_types=["statement"], scope_element_ids=[self.system_element.id])
+        self.assertEqual(results.total, 1)
+        self.assertEqual(results.results[0].object_id, str(self.smt.id))
+        self.assertEqual(search("reviewed quarterly", doc_types=["statement"]).results[0].object_id, str(self.smt.id))
+        self.smt.delete()
+        self.assertEqual(search("quarterly").total, 0)
+
+    def test_search_pagination(self):
+        from .search import search
+        for i in range(5):
+            Element.objects.create(name="Firewall {}".format(i), description="Network firewall", element_type="system_element")
+        page1 = search("firewall", doc_types=["element"], page=1, page_size=2)
+        page3 = search("firewall", doc_types=["element"], page=3, page_size=2)
+        self.assertEqual(page1.total, 5)
+        self.assertEqual(page1.num_pages, 3)
+        self.assertTrue(page1.has_next)
+        self.assertEqual(len(page3.results), 1)
+        self.assertFalse(page3.has_next)
+
+    def test_search_catalog_controls(self):
+        from .search import search, index_catalog
+        index_catalog(Catalog.GetInstance(Catalogs.NIST_SP_800_171_rev1))
+        results = search("authorized users", doc_types=["control"])
+        self.assertTrue(results.total > 0)
+        self.assertTrue(all(doc.catalog_key == Catalogs.NIST_SP_800_171_rev1 for doc in results.results))
+
+    def test_search_view_scopes_statements(self):
+        import json
+        from django.test import RequestFactory
+        from .views import search_controls
+        u = User.objects.create(username="search_user", email="search_user@example.com")
+        self.system.assign_owner_permissions(u)
+        request = RequestFactory().get("/", {"q": "accounts", "type": "statement"})
+        request.user = u
+        self.assertEqual(json.loads(search_controls(request).content)["total"], 0)
+        request = RequestFactory().get("/", {"q": "accounts", "type": "statement", "system_id": self.system.id})
+        request.user = u
+        data = json.loads(search_controls(request).content)
+        self.assertEqual([r["object_id"] for r in data["results"]], [str(self.smt.id)])
+
+    def test_search_view_hides_system_elements(self):
+        import json
+        from django.test import RequestFactory
+        from .views import search_controls
+        u = User.objects.create(username="search_user", email="search_user@example.com")
+        for params in ({"q": "system"}, {"q": "system", "type": "element"}, {"q": "sys", "autocomplete": "1"}):
+            request = RequestFactory().get("/", params)
+            request.user = u
+            self.assertEqual(json.loads(search_controls(request).content)["results"], [])
+        request = RequestFactory().get("/", {"q": "server", "type": "element"})
+        request.user = u
+        data = json.loads(search_controls(request).content)
+        self.assertEqual([r["object_id"] for r in data["results"]], [str(self.component.id)])
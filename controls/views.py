@@ -4,7 +4,6 @@ from datetime import datetime, timezone
 from pathlib import PurePath
 
 import rtyaml
-import shutil
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -22,6 +21,7 @@ from siteapp.forms import ProjectForm
 from system_settings.models import SystemSettings
 from .forms import ImportOSCALComponentForm
 from .forms import StatementPoamForm, PoamForm, ElementForm
+from . import search
 from .models import *
 from .utilities import *
 
@@ -507,7 +507,7 @@ def system_element(request, system_id, element_id):
 
         # Retrieve impl_smts produced by element and consumed by system
         # Get the impl_smts contributed by this component to system
-        impl_smts = element.statements_produced.filter(consumer_element=system.root_element)
+        impl_smts = element.statements_produced.filter(consumer_element=system.root_element).with_prototypes()
 
         # Retrieve used catalog_key
         catalog_key = impl_smts[0].sid_class
@@ -663,301 +663,60 @@ def controls_selected_export_xacta_xslx(request, system_id):
     system = System.objects.get(id=system_id)
     # Retrieve related selected controls if user has permission on system
     if request.user.has_perm('view_system', system):
-        # Retrieve primary system Project
-        # Temporarily assume only one project and get first project
-        project = system.projects.all()[0]
-        controls = system.root_element.controls.all()
-
-        # Retrieve any related Implementation Statements
-        impl_smts = system.root_element.statements_consumed.all()
-        impl_smts_by_sid = {}
-        for smt in impl_smts:
-            if smt.sid in impl_smts_by_sid:
-                impl_smts_by_sid[smt.sid].append(smt)
-            else:
-                impl_smts_by_sid[smt.sid] = [smt]
-
-        for control in controls:
-            if control.oscal_ctl_id in impl_smts_by_sid:
-                setattr(control, 'impl_smts', impl_smts_by_sid[control.oscal_ctl_id])
-            else:
-                setattr(control, 'impl_smts', None)
-
-        from openpyxl import Workbook
-        from openpyxl.styles import Border, Side, PatternFill, Font, GradientFill, Alignment
-        from tempfile import NamedTemporaryFile
-
-        wb = Workbook()
-        ws = wb.active
-        # create alignment style
-        wrap_alignment = Alignment(wrap_text=True)
-        ws.title = "Controls_Implementation"
-
-        # Add in field name row
-        # Paragraph/ReqID
-        c = ws.cell(row=1, column=1, value="Paragraph/ReqID")
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(left=Side(border_style="thin", color="444444"), right=Side(border_style="thin", color="444444"),
-                          bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Stated Requirement (Control statement/Requirement)
-        c = ws.cell(row=1, column=2, value="Title")
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        ws.column_dimensions['B'].width = 30
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Private Implementation
-        c = ws.cell(row=1, column=3, value="Private Implementation")
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        ws.column_dimensions['C'].width = 80
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Public Implementation
-        c = ws.cell(row=1, column=4, value="Public Implementation")
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        ws.column_dimensions['D'].width = 80
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Notes
-        c = ws.cell(row=1, column=5, value="Notes")
-        ws.column_dimensions['E'].width = 60
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Status ["Implemented", "Planned"]
-        c = ws.cell(row=1, column=6, value="Status")
-        ws.column_dimensions['F'].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Expected Completion (expected implementation)
-        c = ws.cell(row=1, column=7, value="Expected Completion")
-        ws.column_dimensions['G'].width = 20
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Class ["Management", "Operational", "Technical",
-        c = ws.cell(row=1, column=8, value="Class")
-        ws.column_dimensions['H'].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Priority ["p0", "P1", "P2", "P3"]
-        c = ws.cell(row=1, column=9, value="Priority")
-        ws.column_dimensions['I'].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Responsible Entities
-        c = ws.cell(row=1, column=10, value="Responsible Entities")
-        ws.column_dimensions['J'].width = 20
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Control Owner(s)
-        c = ws.cell(row=1, column=11, value="Control Owner(s)")
-        ws.column_dimensions['K'].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Type ["System-Specific", "Hybrid", "Inherited", "Common", "blank"]
-        c = ws.cell(row=1, column=12, value="Type")
-        ws.column_dimensions['L'].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Inherited From
-        c = ws.cell(row=1, column=13, value="Inherited From")
-        ws.column_dimensions['M'].width = 20
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Provide As ["Do Not Share", "blank"]
-        c = ws.cell(row=1, column=14, value="Provide As")
-        ws.column_dimensions['N'].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Evaluation Status ["Evaluated", "Expired", "Not Evaluated", "Unknown", "blank"]
-        c = ws.cell(row=1, column=15, value="Evaluation Status")
-        ws.column_dimensions['O'].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # Control Origination
-        c = ws.cell(row=1, column=16, value="Control Origination")
-        ws.column_dimensions['P'].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        # History
-        c = ws.cell(row=1, column=17, value="History")
-        ws.column_dimensions['Q'].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(right=Side(border_style="thin", color="444444"), bottom=Side(border_style="thin", color="444444"),
-                          outline=Side(border_style="thin", color="444444"))
-
-        for row in range(2, len(controls) + 1):
-            control = controls[row - 2]
-
-            # Paragraph/ReqID
-            c = ws.cell(row=row, column=1, value=control.get_flattened_oscal_control_as_dict()['id_display'].upper())
-            c.fill = PatternFill("solid", fgColor="FFFF99")
-            c.alignment = Alignment(vertical='top', wrapText=True)
-            c.border = Border(left=Side(border_style="thin", color="444444"),
-                              right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Title
-            c = ws.cell(row=row, column=2, value=control.get_flattened_oscal_control_as_dict()['title'])
-            c.fill = PatternFill("solid", fgColor="FFFF99")
-            c.alignment = Alignment(vertical='top', wrapText=True)
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Private Implementation
-            smt_combined = ""
-            if control.impl_smts:
-                for smt in control.impl_smts:
-                    smt_combined += smt.body
-            c = ws.cell(row=row, column=3, value=smt_combined)
-            c.alignment = Alignment(vertical='top', wrapText=True)
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Public Implementation
-            c.alignment = Alignment(vertical='top', wrapText=True)
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Notes
-            c = ws.cell(row=1, column=5, value="Notes")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Status ["Implemented", "Planned"]
-            c = ws.cell(row=1, column=6, value="Status")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
+        from .exports import xlsx_response
+
+        # Combine any related Implementation Statements by control id in one query,
+        # keeping only the statement bodies rather than full Statement instances.
+        impl_smts_by_sid = defaultdict(str)
+        for sid, body in system.root_element.statements_consumed.values_list('sid', 'body'):
+            impl_smts_by_sid[sid] += body or ""
+
+        columns = [
+            {'name': "Paragraph/ReqID", 'width': None, 'style': "export_cell_highlight"},
+            # Stated Requirement (Control statement/Requirement)
+            {'name': "Title", 'width': 30, 'style': "export_cell_highlight"},
+            {'name': "Private Implementation", 'width': 80},
+            {'name': "Public Implementation", 'width': 80},
+            {'name': "Notes", 'width': 60},
+            # ["Implemented", "Planned"]
+            {'name': "Status", 'width': 15},
             # Expected Completion (expected implementation)
-            c = ws.cell(row=1, column=7, value="Expected Completion")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Class ["Management", "Operational", "Technical",
-            c = ws.cell(row=1, column=8, value="Class")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Priority ["p0", "P1", "P2", "P3"]
-            c = ws.cell(row=1, column=9, value="Priority")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Responsible Entities
-            c = ws.cell(row=1, column=10, value="Responsible Entities")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Control Owner(s)
-            c = ws.cell(row=1, column=11, value="Control Owner(s)")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Type ["System-Specific", "Hybrid", "Inherited", "Common", "blank"]
-            c = ws.cell(row=1, column=12, value="Type")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Inherited From
-            c = ws.cell(row=1, column=13, value="Inherited From")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Provide As ["Do Not Share", "blank"]
-            c = ws.cell(row=1, column=14, value="Provide As")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Evaluation Status ["Evaluated", "Expired", "Not Evaluated", "Unknown", "blank"]
-            c = ws.cell(row=1, column=15, value="Evaluation Status")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # Control Origination
-            c = ws.cell(row=1, column=16, value="Control Origination")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-            # History
-            c = ws.cell(row=1, column=17, value="History")
-            c.border = Border(right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-
-        with NamedTemporaryFile() as tmp:
-            wb.save(tmp.name)
-            tmp.seek(0)
-            stream = tmp.read()
-            blob = stream
-
-        mime_type = "application/octet-stream"
+            {'name': "Expected Completion", 'width': 20},
+            # ["Management", "Operational", "Technical"]
+            {'name': "Class", 'width': 15},
+            # ["p0", "P1", "P2", "P3"]
+            {'name': "Priority", 'width': 15},
+            {'name': "Responsible Entities", 'width': 20},
+            {'name': "Control Owner(s)", 'width': 15},
+            # ["System-Specific", "Hybrid", "Inherited", "Common", "blank"]
+            {'name': "Type", 'width': 15},
+            {'name': "Inherited From", 'width': 20},
+            # ["Do Not Share", "blank"]
+            {'name': "Provide As", 'width': 15},
+            # ["Evaluated", "Expired", "Not Evaluated", "Unknown", "blank"]
+            {'name': "Evaluation Status", 'width': 15},
+            {'name': "Control Origination", 'width': 15},
+            {'name': "History", 'width': 15},
+        ]
+        empty_columns = [None] * (len(columns) - 3)
+
+        def rows():
+            # Use each catalog's precomputed flattened controls rather than
+            # searching and flattening the catalog once per control.
+            flattened_controls = {}
+            for oscal_ctl_id, oscal_catalog_key in system.root_element.controls.values_list('oscal_ctl_id', 'oscal_catalog_key').iterator():
+                if oscal_catalog_key not in flattened_controls:
+                    flattened_controls[oscal_catalog_key] = Catalog.GetInstance(catalog_key=oscal_catalog_key).flattened_controls_all_as_dict
+                cl_dict = flattened_controls[oscal_catalog_key].get(oscal_ctl_id) or {}
+                yield [
+                    cl_dict.get('id_display', oscal_ctl_id).upper(),
+                    cl_dict.get('title'),
+                    impl_smts_by_sid.get(oscal_ctl_id, ""),
+                ] + empty_columns
+
         filename = "{}_control_implementations-{}.xlsx".format(system.root_element.name.replace(" ", "_"),
                                                                datetime.now().strftime("%Y-%m-%d-%H-%M"))
-
-        resp = HttpResponse(blob, mime_type)
-        resp['Content-Disposition'] = 'inline; filename=' + filename
-        return resp
+        return xlsx_response(filename, "Controls_Implementation", columns, rows())
     else:
         # User does not have permission to this system
         raise Http404
@@ -1009,7 +768,7 @@ def editor(request, system_id, catalog_key, cl_id):
         # Get and return the control
 
         # Retrieve any related Implementation Statements filtering by control and system.root_element
-        impl_smts = Statement.objects.filter(sid=cl_id, consumer_element=system.root_element).order_by('pid')
+        impl_smts = Statement.objects.filter(sid=cl_id, consumer_element=system.root_element).with_prototypes().order_by('pid')
 
         # Build OSCAL
         # Example: https://github.com/usnistgov/OSCAL/blob/master/content/ssp-example/json/ssp-example.json
@@ -1353,10 +1112,10 @@ def update_smt_prototype(request):
 
         try:
             proto_statement = Statement.objects.get(pk=statement.prototype_id)
-            proto_statement.prototype.body = statement.body
-            proto_statement.prototype.save()
+            proto_statement.body = statement.body
+            proto_statement.save()
             statement_status = "ok"
-            statement_msg = f"Update to statement prototype {proto_statement.prototype_id} succeeded."
+            statement_msg = f"Update to statement prototype {proto_statement.id} succeeded."
         except Exception as e:
             statement_status = "error"
             statement_msg = "Update to statement prototype failed. Error reported {}".format(e)
@@ -1579,9 +1338,10 @@ def search_system_component(request):
         text =  form_values['text']
 
         # The final elements that are returned to the new dropdown created...
-        producer_system_elements = Element.objects.filter(element_type="system_element").filter(name__contains= text)
+        # Use the full-text index rather than scanning element names on every keystroke.
+        producer_system_elements = search.autocomplete(text, doc_types=["element"], subtype="system_element")
 
-        producer_elements = [{"id":str(ele.id), "name": ele.name} for ele in producer_system_elements]
+        producer_elements = [{"id": doc.object_id, "name": doc.title} for doc in producer_system_elements]
 
         results = {'producer_element_statement_values': producer_elements}
         data = json.dumps(results)
@@ -1590,6 +1350,39 @@ def search_system_component(request):
     # # Redirect to selected element page
     # return HttpResponseRedirect("/systems/{}/components/selected".format(system_id))
 
+def search_controls(request):
+    """Full-text search over components, statements and catalog controls.
+
+    Statement results are limited to prototype statements and, if a system_id
+    the user can view is given, that system's statements. Element results are
+    limited to components, since systems' root elements are private."""
+
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    doc_types = [doc_type for doc_type in request.GET.getlist("type") if doc_type in search.DOC_TYPES]
+    scope_element_ids = []
+    if request.GET.get("system_id"):
+        system = get_object_or_404(System, pk=request.GET["system_id"])
+        if not request.user.has_perm('view_system', system):
+            raise Http404
+        scope_element_ids.append(system.root_element_id)
+
+    try:
+        page = int(request.GET.get("page", 1))
+    except ValueError:
+        page = 1
+
+    if request.GET.get("autocomplete"):
+        results = search.autocomplete(request.GET.get("q", ""), doc_types=doc_types,
+                                      subtype=request.GET.get("subtype"), scope_element_ids=scope_element_ids,
+                                      element_types=["system_element"])
+        results = search.SearchResults(results, len(results), 1, max(1, len(results)))
+    else:
+        results = search.search(request.GET.get("q", ""), doc_types=doc_types, subtype=request.GET.get("subtype"),
+                                scope_element_ids=scope_element_ids, element_types=["system_element"], page=page)
+    return JsonResponse(results.as_json())
+
 class RelatedComponentStatements(View):
     """
     Returns the component statements that are produced(related) to one control implementation prototype
@@ -1699,9 +1492,10 @@ class EditorAutocomplete(View):
             text = form_values['text']
 
             # The final elements that are returned to the new dropdown created...
-            producer_system_elements = Element.objects.filter(element_type="system_element").filter(name__contains=text)
+            # Use the full-text index rather than scanning element names on every keystroke.
+            producer_system_elements = search.autocomplete(text, doc_types=["element"], subtype="system_element")
 
-            producer_elements = [{"id": str(ele.id), "name": ele.name} for ele in producer_system_elements]
+            producer_elements = [{"id": doc.object_id, "name": doc.title} for doc in producer_system_elements]
 
             results = {'producer_element_name_value': producer_elements}
             data = json.dumps(results)
@@ -1806,21 +1600,9 @@ def export_system_opencontrol(request, system_id):
     system = System.objects.get(id=system_id)
     # Retrieve related selected controls if user has permission on system
     if request.user.has_perm('view_system', system):
-        # Retrieve primary system Project
-        # Temporarily assume only one project and get first project
-        project = system.projects.all()[0]
-
-        # Create temporary directory structure
-        import tempfile
-        temp_dir = tempfile.TemporaryDirectory(dir=".")
-        repo_path = os.path.join(temp_dir.name, system.root_element.name.replace(" ", "_"))
-        if not os.path.exists(repo_path):
-            os.makedirs(repo_path)
-
-        # Create various directories
-        os.makedirs(os.path.join(repo_path, "components"))
-        os.makedirs(os.path.join(repo_path, "standards"))
-        os.makedirs(os.path.join(repo_path, "certifications"))
+        import zipfile
+        from itertools import groupby
+        from .exports import spooled_file_response, ZIP_MIME_TYPE
 
         # Create opencontrol.yaml config file
         cfg_str = """schema_version: 1.0.0
@@ -1849,85 +1631,39 @@ certifications:
         # if organization_name:
         #     cfg["metadata"]["organization"]["abbreviation"] = "".join([word[0].upper() for word in organization_name.split(" ")])
 
-        with open(os.path.join(repo_path, "opencontrol.yaml"), 'w') as outfile:
-            outfile.write(rtyaml.dump(cfg))
-
-        # Populate reference directories from reference
+        # Reference files copied into the archive from our OpenControl data directory
         OPENCONTROL_PATH = os.path.join(os.path.dirname(__file__), 'data', 'opencontrol')
-        shutil.copyfile(os.path.join(OPENCONTROL_PATH, "standards", "NIST-SP-800-53-rev4.yaml"),
-                        os.path.join(repo_path, "standards", "NIST-SP-800-53-rev4.yaml"))
-        shutil.copyfile(os.path.join(OPENCONTROL_PATH, "standards", "NIST-SP-800-171r1.yaml"),
-                        os.path.join(repo_path, "standards", "NIST-SP-800-53-rev4.yaml"))
-        shutil.copyfile(os.path.join(OPENCONTROL_PATH, "standards", "opencontrol.yaml"),
-                        os.path.join(repo_path, "standards", "opencontrol.yaml"))
-        shutil.copyfile(os.path.join(OPENCONTROL_PATH, "standards", "hipaa-draft.yaml"),
-                        os.path.join(repo_path, "standards", "hipaa-draft.yaml"))
-        shutil.copyfile(os.path.join(OPENCONTROL_PATH, "certifications", "fisma-low-impact.yaml"),
-                        os.path.join(repo_path, "certifications", "fisma-low-impact.yaml"))
-
-        # # Make stub README.md file
-        # with open(os.path.join(repo_path, "README.md"), 'w') as outfile:
-        #     outfile.write("Machine readable representation of 800-53 control implementations for {}.\n\n# Notes\n\n".format(system_name))
-        #     print("wrote file: {}\n".format(os.path.join(repo_path, "README.md")))
-
-        # Populate system information files
-
-        # Populate component files
-        if not os.path.exists(os.path.join(repo_path, "components")):
-            os.makedirs(os.path.join(repo_path, "components"))
-        for element in system.producer_elements:
-            # Build OpenControl
-            ocf = {
-                "name": element.name,
-                "schema_version": "3.0.0",
-                "documentation_complete": False,
-                "satisfies": []
-            }
-            satisfies_smts = ocf["satisfies"]
-            # Retrieve impl_smts produced by element and consumed by system
-            # Get the impl_smts contributed by this component to system
-            impl_smts = element.statements_produced.filter(consumer_element=system.root_element)
-            for smt in impl_smts:
-                my_dict = {
-                    "control_key": smt.sid.upper(),
-                    "control_name": smt.catalog_control_as_dict['title'],
-                    "standard_key": smt.sid_class,
-                    "covered_by": [],
-                    "security_control_type": "Hybrid | Inherited | ...",
-                    "narrative": [
-                        {"text": smt.body}
-                    ],
-                    "remarks": [
-                        {"text": smt.remarks}
-                    ]
-                }
-                satisfies_smts.append(my_dict)
-            opencontrol_string = rtyaml.dump(ocf)
-            # Write component file
-            with open(os.path.join(repo_path, "components", "{}.yaml".format(element.name.replace(" ", "_"))), 'w') as fh:
-                fh.write(opencontrol_string)
-
-        # Build Zip archive
-        # TODO Make Temporary File
-        #      Current approach leads to race conditions!
-        shutil.make_archive("/tmp/Zipped_file", 'zip', repo_path)
-
-        # Download Zip archive of OpenControl files
-        with open('/tmp/Zipped_file.zip', 'rb') as tmp:
-            tmp.seek(0)
-            stream = tmp.read()
-            blob = stream
-        mime_type = "application/octet-stream"
-        filename = "{}-opencontrol-{}.zip".format(system.root_element.name.replace(" ", "_"),
-                                                  datetime.now().strftime("%Y-%m-%d-%H-%M"))
+        reference_files = [
+            "standards/NIST-SP-800-53-rev4.yaml",
+            "standards/NIST-SP-800-171r1.yaml",
+            "standards/opencontrol.yaml",
+            "standards/hipaa-draft.yaml",
+            "certifications/fisma-low-impact.yaml",
+        ]
 
-        resp = HttpResponse(blob, mime_type)
-        resp['Content-Disposition'] = 'inline; filename=' + filename
+        # Retrieve all impl_smts consumed by the system in one query, ordered so
+        # that each producing component's statements are contiguous.
+        impl_smts = system.root_element.statements_consumed\
+            .filter(producer_element__isnull=False)\
+            .select_related('producer_element')\
+            .order_by('producer_element__name', 'producer_element_id', 'id')
+
+        def write_zip(fileobj):
+            # Build the archive directly in the response buffer. Nothing is
+            # written to the working directory or a shared /tmp path, so
+            # concurrent exports are safe.
+            with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr("opencontrol.yaml", rtyaml.dump(cfg))
+                for reference_file in reference_files:
+                    zf.write(os.path.join(OPENCONTROL_PATH, reference_file), reference_file)
+                # Populate component files
+                for element, element_smts in groupby(impl_smts.iterator(), key=lambda smt: smt.producer_element):
+                    opencontrol_string = OpenControlComponentSerializer(element, element_smts).as_yaml()
+                    zf.writestr("components/{}.yaml".format(element.name.replace(" ", "_")), opencontrol_string)
 
-        # Clean up
-        shutil.rmtree(repo_path)
-        # os.remove("/tmp/Zipped_file") ????
-        return resp
+        filename = "{}-opencontrol-{}.zip".format(system.root_element.name.replace(" ", "_"),
+                                                  datetime.now().strftime("%Y-%m-%d-%H-%M"))
+        return spooled_file_response(write_zip, filename, ZIP_MIME_TYPE)
 
     else:
         # User does not have permission to this system
@@ -2090,21 +1826,7 @@ def poam_export(request, system_id, format='xlsx'):
     system = System.objects.get(id=system_id)
     # Retrieve related selected POA&Ms if user has permission on system
     if request.user.has_perm('view_system', system):
-
-        if format == 'xlsx':
-            from openpyxl import Workbook
-            from openpyxl.styles import Border, Side, PatternFill, Font, GradientFill, Alignment
-            from tempfile import NamedTemporaryFile
-
-            wb = Workbook()
-            ws = wb.active
-            # create alignment style
-            wrap_alignment = Alignment(wrap_text=True)
-            ws.title = "POA&Ms"
-        else:
-            import csv, io
-            csv_buffer = io.StringIO(newline='\n')
-            csv_writer = csv.writer(csv_buffer)
+        from .exports import xlsx_response, csv_response
 
         poam_fields = [
             {'var_name': 'poam_id', 'name': 'POA&M ID', 'width': 8},
@@ -2121,110 +1843,36 @@ def poam_export(request, system_id, format='xlsx'):
             {'var_name': 'milestones', 'name': 'Milestones', 'width': 60},
             {'var_name': 'milestone_changes', 'name': 'Milestone Changes', 'width': 30},
             {'var_name': 'scheduled_completion_date', 'name': 'Scheduled Completion Date', 'width': 18},
+            # Add column for URL
+            {'var_name': 'url', 'name': 'URL', 'width': 60},
         ]
 
-        # create header row
-        column = 0
-        ord_zeroth_column = ord('A') - 1
-        csv_row = []
-
-        for poam_field in poam_fields:
-            column += 1
-            if format == 'xlsx':
-                c = ws.cell(row=1, column=column, value=poam_field['name'])
-                c.fill = PatternFill("solid", fgColor="5599FE")
-                c.font = Font(color="FFFFFF", bold=True)
-                c.border = Border(left=Side(border_style="thin", color="444444"),
-                                  right=Side(border_style="thin", color="444444"),
-                                  bottom=Side(border_style="thin", color="444444"),
-                                  outline=Side(border_style="thin", color="444444"))
-                ws.column_dimensions[chr(ord_zeroth_column + column)].width = poam_field['width']
-            else:
-                csv_row.append(poam_field['name'])
-        # Add column for URL
-        if format == 'xlsx':
-            c = ws.cell(row=1, column=column, value="URL")
-            c.fill = PatternFill("solid", fgColor="5599FE")
-            c.font = Font(color="FFFFFF", bold=True)
-            c.border = Border(left=Side(border_style="thin", color="444444"),
-                              right=Side(border_style="thin", color="444444"),
-                              bottom=Side(border_style="thin", color="444444"),
-                              outline=Side(border_style="thin", color="444444"))
-            ws.column_dimensions[chr(ord_zeroth_column + column)].width = 60
-        else:
-            csv_row.append('URL')
-
-        if format != 'xlsx':
-            csv_writer.writerow(csv_row)
-
-        # Retrieve POA&Ms and create POA&M rows
-        poam_smts = system.root_element.statements_consumed.filter(statement_type="POAM").order_by('id')
-        poam_smts_by_sid = {}
-        row = 1
-        for poam_smt in poam_smts:
-            csv_row = []
-            row += 1
-
-            # Loop through fields
-            column = 0
-            for poam_field in poam_fields:
-                column += 1
-                if format == 'xlsx':
+        def rows():
+            # Retrieve POA&Ms along with their Poam details in a single query
+            # and stream them rather than holding every row in memory.
+            poam_smts = system.root_element.statements_consumed.filter(statement_type="POAM")\
+                .select_related('poam').order_by('id')
+            for poam_smt in poam_smts.iterator():
+                row = []
+                for poam_field in poam_fields:
                     if poam_field['var_name'] in ['body', 'status']:
-                        c = ws.cell(row=row, column=column, value=getattr(poam_smt, poam_field['var_name']))
+                        row.append(getattr(poam_smt, poam_field['var_name']))
+                    elif poam_field['var_name'] == 'poam_id':
+                        row.append("V-{}".format(poam_smt.poam.poam_id))
+                    elif poam_field['var_name'] == 'url':
+                        row.append(settings.SITE_ROOT_URL + "/systems/{}/poams/{}/edit".format(system_id, poam_smt.id))
                     else:
-                        if poam_field['var_name'] == 'poam_id':
-                            c = ws.cell(row=row, column=column,
-                                        value="V-{}".format(getattr(poam_smt.poam, poam_field['var_name'])))
-                        else:
-                            c = ws.cell(row=row, column=column, value=getattr(poam_smt.poam, poam_field['var_name']))
-                    c.fill = PatternFill("solid", fgColor="FFFFFF")
-                    c.alignment = Alignment(vertical='top', horizontal='left', wrapText=True)
-                    c.border = Border(right=Side(border_style="thin", color="444444"),
-                                      bottom=Side(border_style="thin", color="444444"),
-                                      outline=Side(border_style="thin", color="444444"))
-                else:
-                    if poam_field['var_name'] in ['body', 'status']:
-                        csv_row.append(getattr(poam_smt, poam_field['var_name']))
-                    else:
-                        if poam_field['var_name'] == 'poam_id':
-                            csv_row.append("V-{}".format(getattr(poam_smt.poam, poam_field['var_name'])))
-                        else:
-                            csv_row.append(getattr(poam_smt.poam, poam_field['var_name']))
-
-            # Add URL column
-            poam_url = settings.SITE_ROOT_URL + "/systems/{}/poams/{}/edit".format(system_id, poam_smt.id)
-            if format == 'xlsx':
-                c = ws.cell(row=row, column=column, value=poam_url)
-                c.fill = PatternFill("solid", fgColor="FFFFFF")
-                c.alignment = Alignment(vertical='top', horizontal='left', wrapText=True)
-                c.border = Border(right=Side(border_style="thin", color="444444"),
-                                  bottom=Side(border_style="thin", color="444444"),
-                                  outline=Side(border_style="thin", color="444444"))
-            else:
-                csv_row.append(poam_url)
-
-            if format != 'xlsx':
-                csv_writer.writerow(csv_row)
-
-        if format == 'xlsx':
-            with NamedTemporaryFile() as tmp:
-                wb.save(tmp.name)
-                tmp.seek(0)
-                stream = tmp.read()
-                blob = stream
-        else:
-            blob = csv_buffer.getvalue()
-            csv_buffer.close()
+                        row.append(getattr(poam_smt.poam, poam_field['var_name']))
+                yield row
 
         # Determine filename based on system name
         system_name = system.root_element.name.replace(" ", "_") + "_" + system_id
         filename = "{}_poam_export-{}.{}".format(system_name, datetime.now().strftime("%Y-%m-%d-%H-%M"), format)
-        mime_type = "application/octet-stream"
 
-        resp = HttpResponse(blob, mime_type)
-        resp['Content-Disposition'] = 'inline; filename=' + filename
-        return resp
+        if format == 'xlsx':
+            return xlsx_response(filename, "POA&Ms", poam_fields, rows())
+        else:
+            return csv_response(filename, poam_fields, rows())
     else:
         # User does not have permission to this system
         raise Http404
@@ -0,0 +1,183 @@
+# @-mentions and #-mentions
+#
+# Comments can mention users with @username and organization-defined
+# vocabulary terms with #term. Most of what can be mentioned in a
+# discussion -- every member of a project in the organization, and the
+# organization's vocabulary -- is the same for every discussion in the
+# organization, so it is held in a MentionIndex that is built once per
+# organization and kept in process memory. The index is rebuilt when a
+# project membership or the organization changes, which is signalled
+# through the Django cache so that other processes notice too (with the
+# default per-process cache, other processes notice after INDEX_TTL), or
+# after INDEX_TTL seconds, since users' display names can change.
+#
+# A MentionIndex holds the mentionable tags in a trie, so that mentions are
+# found by walking the comment text once instead of with a regular
+# expression alternating every tag, and the lowercased tags and words of
+# display names in a sorted list for the autocomplete prefix search.
+
+import bisect
+import heapq
+import re
+import time
+import uuid
+
+MENTION_CHARS = ("@", "#")
+INDEX_TTL = 600 # seconds
+VERSION_CACHE_KEY = "mentions:version:%d"
+
+# A trigger character, possibly backslash-escaped since we're matching
+# against Markdown, not preceded by a word-ish character.
+TRIGGER = re.compile(r"(?<!\w)\\?([@#])")
+WORD = re.compile(r"\w")
+
+
+class MentionIndex:
+    def __init__(self, items):
+        # items is an iterable of (char, item) pairs, where item is a dict
+        # with a "tag" and, for users, a "user_id" and "display" name.
+        self.tries = { }
+        self.keys = { }
+        for i, (char, item) in enumerate(items):
+            if not item["tag"]:
+                continue
+
+            # Add to the trie. The None key marks the end of a tag.
+            node = self.tries.setdefault(char, { })
+            for c in item["tag"]:
+                node = node.setdefault(c, { })
+            node[None] = item
+
+            # Add search keys.
+            keys = { item["tag"].lower() } | { w.lower() for w in item.get("display", "").split() }
+            self.keys.setdefault(char, []).extend((key, i, item) for key in keys)
+        for keys in self.keys.values():
+            keys.sort(key=lambda k : k[:2])
+
+    def match(self, char, text, start):
+        # Return the item with the longest tag that appears in text at
+        # start and is not followed by a word-ish character, and the
+        # position where it ends, or None.
+        node = self.tries.get(char)
+        best = None
+        i = start
+        while node is not None:
+            if None in node and not WORD.match(text, i):
+                best = (node[None], i)
+            if i == len(text):
+                break
+            node = node.get(text[i])
+            i += 1
+        return best
+
+    def search(self, char, term, limit):
+        # Return up to limit items whose tag or a word in whose display
+        # name starts with term, in the order of their first matching
+        # search key, as (key, item) pairs.
+        keys = self.keys.get(char, [])
+        term = term.lower()
+        ret = { }
+        for key, i, item in keys[bisect.bisect_left(keys, (term,)):]:
+            if not key.startswith(term) or len(ret) == limit:
+                break
+            ret.setdefault(item["tag"], (key, item))
+        return list(ret.values())
+
+
+def find_mentions(text, indexes, replace_mentions=None):
+    # Find the mentions in text of the things in the MentionIndexes and
+    # return the text, with @-mentions of users replaced by the result of
+    # replace_mentions if given, and the set of IDs of the mentioned users.
+    parts = []
+    user_ids = set()
+    copied = 0 # the end of the text copied to parts
+    matched = 0 # the end of the last mention
+    for m in TRIGGER.finditer(text):
+        if m.start() < matched:
+            continue
+        best = None
+        for index in indexes:
+            r = index.match(m.group(1), text, m.end())
+            if r is not None and (best is None or r[1] > best[1]):
+                best = r
+        if best is None:
+            continue
+        item, matched = best
+        if item.get("user_id"):
+            user_ids.add(item["user_id"])
+            if replace_mentions:
+                parts.append(text[copied:m.start()])
+                parts.append(replace_mentions(text[m.start():matched]))
+                copied = matched
+    parts.append(text[copied:])
+    return ("".join(parts), user_ids)
+
+
+def search(indexes, char, term, offset=0, limit=10):
+    # Prefix-search the MentionIndexes, returning a page of items and
+    # whether there are more. Items are in the order of their first matching
+    # search key across the indexes, which is the order each index returns
+    # them in, so the first offset+limit+1 items of each index are enough.
+    items = { }
+    for key, item in heapq.merge(*[index.search(char, term, offset + limit + 1) for index in indexes],
+                                 key=lambda pair : pair[0]):
+        items.setdefault(item["tag"], item)
+    items = list(items.values())
+    return items[offset:offset+limit], len(items) > offset + limit
+
+
+def get_user_items(users):
+    from siteapp.models import User
+    users = list(users)
+    User.preload_profiles(users)
+    return [
+        ("@", {
+            "user_id": user.id,
+            "tag": user.username,
+            "display": user.render_context_dict()["name"],
+        })
+        for user in users
+    ]
+
+def build_user_index(users):
+    return MentionIndex(get_user_items(users))
+
+def build_organization_index(organization):
+    from siteapp.models import User
+    users = User.objects.filter(projectmembership__project__organization=organization).distinct()
+    return MentionIndex(
+        get_user_items(users)
+        + [ ("#", { "tag": term }) for term in organization.extra.get("vocabulary", []) ])
+
+
+# Caching organization indexes.
+
+_indexes = { } # organization id => (version, time built, MentionIndex)
+
+def get_organization_index(organization):
+    from django.core.cache import cache
+    key = VERSION_CACHE_KEY % organization.id
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+
+    entry = _indexes.get(organization.id)
+    if entry is not None and entry[0] == version and time.monotonic() - entry[1] < INDEX_TTL:
+        return entry[2]
+
+    index = build_organization_index(organization)
+    _indexes[organization.id] = (version, time.monotonic(), index)
+    return index
+
+def invalidate(organization_id):
+    from django.core.cache import cache
+    cache.set(VERSION_CACHE_KEY % organization_id, uuid.uuid4().hex, None)
+
+def invalidate_on_change(sender, instance, **kwargs):
+    # Signal receiver for Organizations and ProjectMemberships.
+    from siteapp.models import Organization
+    if isinstance(instance, Organization):
+        invalidate(instance.id)
+    elif instance.project.organization_id is not None:
+        invalidate(instance.project.organization_id)
@@ -0,0 +1,29 @@
+# Generated by Django 3.0.11 on 2026-10-18 22:03
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discussion', '0006_auto_20180212_2336'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='mentioned_users',
+            field=jsonfield.fields.JSONField(blank=True, help_text='The IDs of the users @-mentioned in the text of the comment.', null=True),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='render_version',
+            field=models.IntegerField(default=0, help_text='The version of the renderer that rendered text_rendered, so that comments can be rendered again when the renderer changes.'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='text_rendered',
+            field=models.TextField(blank=True, help_text='The text of the comment rendered to HTML.', null=True),
+        ),
+    ]
@@ -11,6 +11,13 @@ from jsonfield import JSONField
 
 from siteapp.models import User
 
+from . import mentions
+
+# Bump this when render_text changes so that comments stored with HTML
+# rendered by an earlier version are rendered again when they are next
+# displayed.
+RENDER_VERSION = 1
+
 class Discussion(models.Model):
     organization = models.ForeignKey('siteapp.Organization', related_name="discussions", on_delete=models.CASCADE, help_text="The Organization that this Discussion belongs to.")
 
@@ -108,7 +115,9 @@ class Discussion(models.Model):
         # Batch load user information. For the user's own draft, load the requesting user's info too.
         # Don't use a set to uniquify Users since the comments may have different User instances and
         # we want to fill in info for all of them.
-        User.preload_profiles([ c.user for c in comments ] + [ user ])
+        guests = list(self.guests.all())
+        User.preload_profiles([ c.user for c in comments ] + guests + [ user ])
+        self.get_user_roles([ c.user for c in comments ], guests)
 
         # Add.
         events.extend([
@@ -138,9 +147,9 @@ class Discussion(models.Model):
                 "can_invite": self.can_invite_guests(user),
                 "can_comment": self.can_comment(user),
             },
-            "guests": [ user.render_context_dict() for user in self.guests.all() ],
+            "guests": [ guest.render_context_dict() for guest in guests ],
             "events": events,
-            "autocomplete": self.get_autocompletes(user),
+            "autocomplete": list(mentions.MENTION_CHARS) if self.can_comment(user) else [],
             "draft": draft,
         }
 
@@ -158,7 +167,7 @@ class Discussion(models.Model):
                 raise ValueError("No comment entered.")
 
         # Save comment.
-        comment = Comment.objects.create(
+        comment = Comment(
             discussion=self,
             user=user,
             draft=is_draft,
@@ -171,6 +180,9 @@ class Discussion(models.Model):
         # If not a draft...
         if not is_draft:
             comment._on_published()
+        else:
+            comment.render_text()
+            comment.save()
 
         return comment
 
@@ -237,11 +249,28 @@ class Discussion(models.Model):
 
     ##
 
+    def get_user_roles(self, users, guests=None):
+        # Return a dict mapping user IDs to the roles of the users in the
+        # discussion, such as "editor" or "guest". Roles are looked up in
+        # a batch and cached on the instance.
+        roles = self.__dict__.setdefault('_user_roles', { })
+        users = [ u for u in users if u.id not in roles ]
+        if users:
+            found = { }
+            if self.attached_to_obj is not None:
+                found = self.attached_to_obj.get_user_roles(users)
+            if guests is None:
+                guests = self.guests.filter(id__in=[ u.id for u in users ])
+            guest_ids = { g.id for g in guests }
+            for u in users:
+                roles[u.id] = found.get(u.id) \
+                    or ("guest" if u.id in guest_ids else "former participant")
+        return roles
+
     def get_autocompletes(self, user):
         # When typing in a comment, what autocompletes are available to this user?
-        # Ensure the user is a participant of the discussion. Cache this on the
-        # instance since when we render the Discussion event history we fetch this
-        # once for each comment we render.
+        # Returns a list of MentionIndexes (see mentions.py). Ensure the user is a
+        # participant of the discussion. Cache this on the instance.
         if hasattr(self, '_get_autocompletes'): return self._get_autocompletes
         if self.attached_to_obj is None or not self.is_participant(user):
             self._get_autocompletes = []
@@ -260,6 +289,10 @@ class Comment(models.Model):
     draft = models.BooleanField(default=False, help_text="Set to true if the comment is a draft.")
     deleted = models.BooleanField(default=False, help_text="Set to true if the comment has been 'deleted'.")
 
+    text_rendered = models.TextField(blank=True, null=True, help_text="The text of the comment rendered to HTML.")
+    mentioned_users = JSONField(blank=True, null=True, help_text="The IDs of the users @-mentioned in the text of the comment.")
+    render_version = models.IntegerField(default=0, help_text="The version of the renderer that rendered text_rendered, so that comments can be rendered again when the renderer changes.")
+
     created = models.DateTimeField(auto_now_add=True, db_index=True)
     updated = models.DateTimeField(auto_now=True, db_index=True)
     extra = JSONField(blank=True, help_text="Additional information stored with this object.")
@@ -302,6 +335,10 @@ class Comment(models.Model):
 
         # Reset the creation date to the moment it's published.
         self.created = timezone.now()
+
+        # Render the final text.
+        self.render_text()
+
         # Save.
         self.save()
 
@@ -315,7 +352,7 @@ class Comment(models.Model):
         # notification.
         if self.draft: raise Exception("I'm still a draft.")
         from siteapp.views import issue_notification
-        _, mentioned_users = match_autocompletes(self.text, self.discussion.get_autocompletes(self.user))
+        mentioned_users = set(User.objects.filter(id__in=self.mentioned_users))
         issue_notification(
             self.user,
             "commented on",
@@ -368,6 +405,25 @@ class Comment(models.Model):
 
     # render
 
+    def render_text(self):
+        # Render the text to HTML and find the users @-mentioned in it, using
+        # the autocompletes available to the comment's author. This is done
+        # when the text changes, rather than each time the comment is shown.
+        # The caller saves the comment.
+        autocompletes = self.discussion.get_autocompletes(self.user)
+        _, mentioned_users = match_autocompletes(self.text, autocompletes)
+        self.text_rendered = render_text(self.text, autocompletes=autocompletes, comment=self)
+        self.mentioned_users = sorted(mentioned_users)
+        self.render_version = RENDER_VERSION
+
+    def get_text_rendered(self):
+        # Render the text if it hasn't been rendered by the current renderer.
+        if self.text_rendered is None or self.render_version != RENDER_VERSION:
+            self.render_text()
+            if self.id:
+                self.save(update_fields=['text_rendered', 'mentioned_users', 'render_version'])
+        return self.text_rendered
+
     def render_context_dict(self, whose_asking):
         if self.deleted:
             raise ValueError()
@@ -383,14 +439,6 @@ class Comment(models.Model):
             else:
                 return None
 
-        def get_user_role():
-            ret = self.discussion.attached_to_obj.get_user_role(self.user)
-            if ret is not None:
-                return ret
-            if self.user in self.discussion.guests.all():
-                return "guest"
-            return "former participant"
-
         return {
             "type": "comment",
             "id": self.id,
@@ -398,11 +446,11 @@ class Comment(models.Model):
             "can_delete": self.can_delete(whose_asking),
             "replies_to": self.replies_to_id,
             "user": self.user.render_context_dict(),
-            "user_role": get_user_role(),
+            "user_role": self.discussion.get_user_roles([self.user])[self.user.id],
             "date_relative": reldate(self.created, timezone.now()) + " ago",
             "date_posix": self.created.timestamp(), # POSIX time, seconds since the epoch, in UTC
             "text": self.text,
-            "text_rendered": render_text(self.text, autocompletes=self.discussion.get_autocompletes(whose_asking), comment=self),
+            "text_rendered": self.get_text_rendered(),
             "notification_text": notification_text(),
             "emojis": self.emojis.split(",") if self.emojis else None,
         }
@@ -464,48 +512,14 @@ def render_text(text, autocompletes=None, comment=None, unwrap_p=False):
     return text
 
 def match_autocompletes(text, autocompletes, replace_mentions=None):
-    import re
-    from siteapp.models import User
-
-    # Make a big regex for all mentions of all autocompletable things.
-    # Since we're matching against Markdown, allow the prefix character
-    # (@ or #) to be preceded by a backslash, since punctuation can
-    # be escaped. If this Markdown came from a rich text editor, we
-    # might have escapes in funny places.
-    pattern = "|".join(
-        r"\\?" + char + "(" + "|".join(
-            re.escape(item["tag"])
-            for item in items
-        ) + ")"
-        for char, items in autocompletes.items()
-        if len(items) > 0
-    )
-    if pattern == "":
-        return (text, set())
-
-    # Wrap in a lookbehind and a lookahead to not match if surrounded
-    # by word-ish characters.
-    pattern = r"(?<!\w)" + pattern + r"(?!\w)"
-
-    # Create a reverse-mapping.
-    reverse_mapping = { }
-    for char, items in autocompletes.items():
-        for item in items:
-            reverse_mapping[(char, item['tag'])] = item
-
-    # Find what was mentioned.
-    mentioned_users = set()
-    def replace_func(m):
-        char, tag = (m.group(0)[:1], m.group(0)[1:])
-        if char == "\\": # was escaped
-            char, tag = (m.group(0)[1:2], m.group(0)[2:])
-        item = reverse_mapping[(char, tag)]
-        if item.get("user_id"):
-            user = User.objects.get(id=item["user_id"])
-            mentioned_users.add(user)
-            if replace_mentions:
-                return replace_mentions(m.group(0))
-        return m.group(0)
-    text = re.sub(pattern, replace_func, text)
-
-    return (text, mentioned_users)
+    # Find the @-mentions of users and #-mentions of terms in text, given a
+    # list of MentionIndexes from Discussion.get_autocompletes. Returns the
+    # text, with @-mentions replaced by the result of replace_mentions if
+    # given, and the set of IDs of the mentioned users.
+    return mentions.find_mentions(text, autocompletes, replace_mentions)
+
+# Mentionable users and terms are cached per organization.
+from siteapp.models import Organization, ProjectMembership
+models.signals.post_save.connect(mentions.invalidate_on_change, sender=Organization)
+models.signals.post_save.connect(mentions.invalidate_on_change, sender=ProjectMembership)
+models.signals.post_delete.connect(mentions.invalidate_on_change, sender=ProjectMembership)
@@ -175,3 +175,76 @@ class DiscussionTests(SeleniumTest):
             return http.status!=404;""".format(imageFile))
 
         self.assertTrue(result)
+
+
+from guidedmodules.tests import TestCaseWithFixtureData
+
+class CommentRenderingTests(TestCaseWithFixtureData):
+
+    def setUp(self):
+        from guidedmodules.models import TaskAnswer
+        from siteapp.models import ProjectMembership
+        from .models import Discussion
+        ProjectMembership.objects.create(project=self.project, user=self.user)
+        ProjectMembership.objects.create(project=self.project, user=self.superuser, is_admin=True)
+        self.project.portfolio = Portfolio.objects.create(title="Discussion Portfolio")
+        self.project.save()
+        task = self.project.root_task
+        answer = TaskAnswer.objects.create(task=task, question=task.module.questions.first())
+        self.discussion = Discussion.get_for(self.organization, answer, create=True)
+
+    def test_rendered_text_is_stored(self):
+        from .models import Comment, RENDER_VERSION
+
+        # The text is rendered and its mentions resolved when the comment is posted.
+        comment = self.discussion.post_comment(self.user, "Hello @superunit.test, *welcome*.", "web")
+        comment = Comment.objects.get(id=comment.id)
+        self.assertEqual(comment.text_rendered, "<p>Hello <strong>@superunit.test</strong>, <em>welcome</em>.</p>\n")
+        self.assertEqual(comment.mentioned_users, [self.superuser.id])
+        self.assertEqual(comment.render_version, RENDER_VERSION)
+
+        # Comments rendered by an older renderer are rendered again.
+        Comment.objects.filter(id=comment.id).update(text_rendered="stale", render_version=RENDER_VERSION - 1)
+        events = self.discussion.render_context_dict(self.user)["events"]
+        self.assertEqual(events[-1]["text_rendered"], comment.text_rendered)
+        self.assertEqual(Comment.objects.get(id=comment.id).text_rendered, comment.text_rendered)
+
+        # Roles are looked up for all of the comments at once.
+        self.discussion.post_comment(self.superuser, "Thanks!", "web")
+        events = self.discussion.render_context_dict(self.user)["events"]
+        self.assertEqual([e["user_role"] for e in events], ["editor", "team admin"])
+
+    def test_mentions(self):
+        from .mentions import MentionIndex, find_mentions, get_organization_index
+
+        # The longest tag is matched, and not within words.
+        index = MentionIndex([("@", { "user_id": 1, "tag": "bob" }), ("@", { "user_id": 2, "tag": "bob.smith" }),
+                              ("#", { "tag": "FIPS" })])
+        text, user_ids = find_mentions("@bob.smith, @bob, x@bob \\@bob. #FIPS", [index], lambda m : "**" + m + "**")
+        self.assertEqual(text, "**@bob.smith**, **@bob**, x@bob **\\@bob**. #FIPS")
+        self.assertEqual(user_ids, { 1, 2 })
+
+        # Search results are paged in the order of their matching search keys.
+        from .mentions import search
+        index = MentionIndex([("@", { "user_id": 1, "tag": "zz1", "display": "Aa" }), ("@", { "user_id": 2, "tag": "zz2", "display": "Ab" })])
+        other = MentionIndex([("@", { "user_id": 3, "tag": "ac", "display": "C" })])
+        pages = [search([index, other], "@", "a", offset, 1) for offset in range(3)]
+        self.assertEqual([[item["tag"] for item in items] for items, more in pages], [["zz1"], ["zz2"], ["ac"]])
+        self.assertEqual([more for items, more in pages], [True, True, False])
+
+        # Organization members are indexed once, until memberships change.
+        from siteapp.models import ProjectMembership
+        index = get_organization_index(self.organization)
+        self.assertIs(get_organization_index(self.organization), index)
+        ProjectMembership.objects.filter(user=self.superuser).delete()
+        self.assertIsNot(get_organization_index(self.organization), index)
+
+        # Autocompletes are searched by prefix.
+        self.client.force_login(self.user)
+        response = self.client.get("/discussion/_discussion_autocomplete",
+            { "discussion": self.discussion.id, "char": "@", "q": "UNIT" })
+        self.assertEqual([item["tag"] for item in response.json()["items"]], ["unit.test"])
+        for params in ({ "discussion": "x" }, { "q": "UNIT" }, { "discussion": self.discussion.id, "limit": "x" }):
+            self.assertEqual(self.client.get("/discussion/_discussion_autocomplete", params).status_code, 400)
+        self.assertEqual(self.client.get("/discussion/_discussion_autocomplete", { "discussion": 0 }).status_code, 404)
+        self.assertEqual(self.discussion.render_context_dict(self.user)["autocomplete"], ["@", "#"])
@@ -1,6 +1,6 @@
 from django.db import transaction
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpResponseForbidden, JsonResponse, HttpResponseNotAllowed
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseForbidden, JsonResponse, HttpResponseNotAllowed
 from django.contrib.auth.decorators import login_required
 from django.conf import settings
 from django.utils import timezone
@@ -27,6 +27,7 @@ def update_discussion_comment_draft(request):
             pass
         else:
             comment.text = text
+            comment.render_text()
             comment.save()
 
     if comment is None:
@@ -75,6 +76,7 @@ def edit_discussion_comment(request):
 
     # edit
     comment.text = request.POST['text']
+    comment.render_text()
 
     # save
     comment.save()
@@ -168,6 +170,28 @@ def poll_for_events(request):
         request.POST.get("event_since", "0")
     ))
 
+@login_required
+def autocomplete_mentions(request):
+    # Search the users and terms that can be mentioned in a discussion
+    # by prefix, a page at a time.
+    try:
+        discussion_id = int(request.GET["discussion"])
+        offset = max(0, int(request.GET.get("offset", 0)))
+        limit = min(50, max(1, int(request.GET.get("limit", 10))))
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest()
+    discussion = get_object_or_404(Discussion, id=discussion_id)
+    if not discussion.can_comment(request.user):
+        return HttpResponseForbidden()
+
+    from .mentions import search
+    items, more = search(
+        discussion.get_autocompletes(request.user),
+        request.GET.get("char", "@"),
+        request.GET.get("q", ""),
+        offset, limit)
+    return JsonResponse({ "status": "ok", "items": items, "more": more })
+
 @login_required
 @transaction.atomic
 def create_attachments(request):
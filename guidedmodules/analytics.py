@@ -0,0 +1,196 @@
+# Instrumentation rollups
+#
+# InstrumentationEvents accumulate with every question view and page load,
+# so the analytics dashboard does not aggregate them directly. Instead,
+# update_rollups() folds new events into InstrumentationRollup rows, one per
+# day, event type, module and question, holding the count, sum, minimum and
+# maximum of the event values and a sketch of their distribution. It is run
+# periodically by the rollup_instrumentation management command.
+#
+# Rollups are maintained incrementally: each rollup records the largest
+# event id folded into it, and the next run starts after the largest of
+# those. Events are only rolled up once they are ROLLUP_DELAY old so that
+# events still being written by other processes are not skipped over.
+# Events that have been rolled up can then be deleted with prune_events().
+#
+# A sketch is a histogram of values in logarithmically sized buckets --
+# bucket i holds values in (GAMMA**(i-1), GAMMA**i] -- stored as a dict
+# from bucket index (as a string, since it is stored as JSON) to count.
+# Sketches can be merged by adding counts, and estimate any percentile to
+# within about 2.5% of its true value.
+
+import datetime
+import math
+
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+SKETCH_GAMMA = 1.05
+SKETCH_ZERO = "z" # the bucket for values that are zero or less
+ROLLUP_DELAY = datetime.timedelta(minutes=5)
+BATCH_SIZE = 10000
+
+# Events that later events measure time from (see task_finished) and that
+# there is only one of per task, so they are not pruned.
+UNPRUNED_EVENT_TYPES = ("task-create", "task-done")
+
+# Events that later events measure time from the first of (see save_answer
+# and instrumentation_record_interaction). The earliest of each per user,
+# task and question is not pruned.
+FIRST_EVENT_TYPES = ("task-question-show", "task-question-interact-first")
+
+
+# Sketches.
+
+def sketch_add(sketch, value, count=1):
+    if value <= 0:
+        key = SKETCH_ZERO
+    else:
+        key = str(math.ceil(math.log(value, SKETCH_GAMMA)))
+    sketch[key] = sketch.get(key, 0) + count
+
+def sketch_merge(sketch, other):
+    for key, count in other.items():
+        sketch[key] = sketch.get(key, 0) + count
+
+def sketch_quantile(sketch, q):
+    """Estimate the q'th quantile (0 <= q <= 1) of the values in a sketch,
+    or return None if it is empty."""
+    total = sum(sketch.values())
+    if total == 0:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for key in sorted(sketch, key=lambda key: -math.inf if key == SKETCH_ZERO else int(key)):
+        seen += sketch[key]
+        if seen > rank:
+            if key == SKETCH_ZERO:
+                return 0.0
+            # The value in the middle of the bucket, in relative terms.
+            return 2 * SKETCH_GAMMA**int(key) / (SKETCH_GAMMA + 1)
+
+
+# Rolling up events.
+
+def get_watermark():
+    """Return the largest InstrumentationEvent id that has been rolled up."""
+    from .models import InstrumentationRollup
+    return InstrumentationRollup.objects.aggregate(id=Max('last_event_id'))['id'] or 0
+
+def update_rollups(batch_size=BATCH_SIZE):
+    """Fold events that have not yet been rolled up into rollups. Returns
+    the number of events folded in."""
+    from .models import InstrumentationEvent
+
+    watermark = get_watermark()
+    end = InstrumentationEvent.objects\
+        .filter(event_time__lt=timezone.now() - ROLLUP_DELAY)\
+        .aggregate(id=Max('id'))['id'] or 0
+
+    count = 0
+    while watermark < end:
+        events = list(InstrumentationEvent.objects
+            .filter(id__gt=watermark, id__lte=end)
+            .order_by('id')
+            .values_list('id', 'event_time', 'event_type', 'module_id', 'question_id', 'event_value')
+            [:batch_size])
+        if not events:
+            break
+        with transaction.atomic():
+            _fold(events)
+        watermark = events[-1][0]
+        count += len(events)
+    return count
+
+def _fold(events):
+    from .models import InstrumentationRollup
+
+    # Aggregate the events in memory.
+    aggregates = { }
+    for event_id, event_time, event_type, module_id, question_id, value in events:
+        key = (timezone.localdate(event_time), event_type, module_id, question_id)
+        agg = aggregates.get(key)
+        if agg is None:
+            agg = aggregates[key] = InstrumentationRollup(
+                day=key[0], event_type=event_type, module_id=module_id, question_id=question_id,
+                sketch={})
+        agg.events += 1
+        agg.last_event_id = max(agg.last_event_id, event_id)
+        if value is not None:
+            agg.count += 1
+            agg.value_sum += value
+            agg.value_min = value if agg.value_min is None else min(agg.value_min, value)
+            agg.value_max = value if agg.value_max is None else max(agg.value_max, value)
+            sketch_add(agg.sketch, value)
+
+    # Merge them into the existing rollups for the same keys.
+    existing = InstrumentationRollup.objects.select_for_update().filter(
+        day__in={ key[0] for key in aggregates },
+        event_type__in={ key[1] for key in aggregates })
+    updated = []
+    for rollup in existing:
+        agg = aggregates.pop((rollup.day, rollup.event_type, rollup.module_id, rollup.question_id), None)
+        if agg is None:
+            continue
+        rollup.events += agg.events
+        rollup.count += agg.count
+        rollup.value_sum += agg.value_sum
+        if agg.count:
+            rollup.value_min = agg.value_min if rollup.value_min is None else min(rollup.value_min, agg.value_min)
+            rollup.value_max = agg.value_max if rollup.value_max is None else max(rollup.value_max, agg.value_max)
+        sketch_merge(rollup.sketch, agg.sketch)
+        rollup.last_event_id = max(rollup.last_event_id, agg.last_event_id)
+        updated.append(rollup)
+
+    InstrumentationRollup.objects.bulk_update(updated,
+        ['events', 'count', 'value_sum', 'value_min', 'value_max', 'sketch', 'last_event_id'],
+        batch_size=500)
+    InstrumentationRollup.objects.bulk_create(aggregates.values(), batch_size=500)
+
+def prune_events(retention_days):
+    """Delete events older than retention_days days that have been rolled
+    up, except UNPRUNED_EVENT_TYPES and the earliest FIRST_EVENT_TYPES
+    events. Returns the number of events deleted."""
+    from .models import InstrumentationEvent
+    earlier = InstrumentationEvent.objects.filter(
+        event_type=OuterRef('event_type'),
+        user=OuterRef('user'),
+        task=OuterRef('task'),
+        question=OuterRef('question'),
+        event_time__lt=OuterRef('event_time'))
+    events = InstrumentationEvent.objects.filter(
+        id__lte=get_watermark(),
+        event_time__lt=timezone.now() - datetime.timedelta(days=retention_days),
+    ).exclude(event_type__in=UNPRUNED_EVENT_TYPES)\
+     .annotate(has_earlier=Exists(earlier))\
+     .exclude(event_type__in=FIRST_EVENT_TYPES, has_earlier=False)
+    count, _ = InstrumentationEvent.objects.filter(id__in=events.values('id')).delete()
+    return count
+
+
+# Reading rollups.
+
+def summarize(rollups):
+    """Combine rollups into a dict of count, mean, min, max and percentile
+    estimates."""
+    count = 0
+    value_sum = 0.0
+    value_min = value_max = None
+    sketch = { }
+    for rollup in rollups:
+        if not rollup.count:
+            continue
+        count += rollup.count
+        value_sum += rollup.value_sum
+        value_min = rollup.value_min if value_min is None else min(value_min, rollup.value_min)
+        value_max = rollup.value_max if value_max is None else max(value_max, rollup.value_max)
+        sketch_merge(sketch, rollup.sketch)
+    return {
+        "count": count,
+        "mean": value_sum / count if count else None,
+        "min": value_min,
+        "max": value_max,
+        "p50": sketch_quantile(sketch, .5),
+        "p90": sketch_quantile(sketch, .9),
+    }
@@ -277,14 +277,18 @@ class validator:
         # Check data type.
         if not isinstance(value, dict):
             raise ValueError("Invalid data type (%s)." % type(value))
-        if not isinstance(value.get("content"), list):
+        if not isinstance(value.get("content"), list) and not hasattr(value.get("content"), "read"):
             raise ValueError("Invalid data type.")
         if not isinstance(value.get("type"), str):
             raise ValueError("Invalid data type.")
 
-        # Fetch content.
+        # Fetch content. It's either an array of strings or, from
+        # siteapp.project_json.load_json, a SpooledBase64Content.
         from base64 import b64decode
-        content = b64decode("".join(chunk for chunk in value["content"]).encode("ascii"))
+        if isinstance(value["content"], list):
+            content = b64decode("".join(chunk for chunk in value["content"]).encode("ascii"))
+        else:
+            content = b64decode(value["content"].read())
 
         # The file must have content.
         if len(content) == 0:
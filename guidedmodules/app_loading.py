@@ -4,9 +4,12 @@
 ###########################################################
 
 import enum
+import hashlib
 import json
+import os
 import sys
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 from django.db import transaction
 from django.db.models.deletion import ProtectedError
@@ -30,6 +33,12 @@ class ModuleDefinitionError(Exception):
 class ValidationError(ModuleDefinitionError):
     def __init__(self, file_name, scope, message):
         super().__init__("There was an error in %s (%s): %s" % (file_name, scope, message))
+        self.file_name = file_name
+        self.scope = scope
+        self.message = message
+    def __reduce__(self):
+        # So that it can be raised in a worker process.
+        return (self.__class__, (self.file_name, self.scope, self.message))
 
 class CyclicDependency(ModuleDefinitionError):
     def __init__(self, path):
@@ -42,12 +51,33 @@ class DependencyError(ModuleDefinitionError):
 class IncompatibleUpdate(Exception):
     pass
 
+# Bump this when a change to app loading changes what is stored for the
+# same app files, so that apps are reloaded even though they haven't changed.
+FINGERPRINT_VERSION = 1
 
+# Apps with fewer modules than this are not worth starting a process pool
+# for.
+PARALLEL_MIN_MODULES = 16
+
+
+@Task.deferred_clear_state() # clear the state of Tasks using updated Modules once, after committing
 @transaction.atomic # there can be an error mid-way through
-def load_app_into_database(app, update_mode=AppImportUpdateMode.CreateInstance, update_appinst=None):
+def load_app_into_database(app, update_mode=AppImportUpdateMode.CreateInstance, update_appinst=None, workers=1):
+    # Read all of the app's files and compute its fingerprint.
+    files = dict(app.get_files())
+    assets = list(app.get_assets())
+    fingerprint = get_app_fingerprint(app, files, assets)
+
+    # If we're updating an AppVersion that was loaded from exactly these
+    # files, there is nothing to do.
+    if update_appinst is not None \
+        and update_mode != AppImportUpdateMode.ForceUpdate \
+        and update_appinst.content_fingerprint == fingerprint:
+        return update_appinst
+
     # Pull in all of the modules. We need to know them all because they'll
     # be processed recursively.
-    available_modules = dict(app.get_modules())
+    available_modules = read_modules(app, files, workers)
 
     # Create an AppVersion to add new Modules into, unless update_appinst is given.
     if update_appinst is None:
@@ -73,7 +103,7 @@ def load_app_into_database(app, update_mode=AppImportUpdateMode.CreateInstance,
             [], update_mode)
 
     # Load assets.
-    load_module_assets_into_database(app, appinst)
+    load_module_assets_into_database(app, appinst, assets)
 
     # If there's an 'app' module, move the app catalog information
     # to the AppVersion.
@@ -100,27 +130,50 @@ def load_app_into_database(app, update_mode=AppImportUpdateMode.CreateInstance,
 
     # Update appinst. It may have been modified by extract_catalog_metadata
     # and by the loading of a README.md file.
+    appinst.content_fingerprint = fingerprint
     appinst.save()
 
     return appinst
 
 
-def load_module_into_database(app, appinst, module_id, available_modules, processed_modules, dependency_path, update_mode):
-    # Prevent cyclic dependencies between modules.
-    if module_id in dependency_path:
-        raise CyclicDependency(dependency_path)
-
-    # Because of dependencies between modules, we may have already
-    # been here. Do this after the cyclic dependency check or else
-    # we would never see a cyclic dependency.
-    if module_id in processed_modules:
-        return processed_modules[module_id]
+def get_app_fingerprint(app, files, assets):
+    # Hash the paths and contents of all of the app's files, plus
+    # the source setting that is copied into the AppVersion.
+    m = hashlib.sha256()
+    m.update(json.dumps([FINGERPRINT_VERSION, app.store.source.trust_assets]).encode("ascii"))
+    hashes = [(path, hashlib.sha256(content).hexdigest()) for path, content in files.items()]
+    hashes += [("assets/" + path, file_hash) for path, file_hash, content_loader in assets]
+    for path, file_hash in sorted(hashes):
+        m.update(path.encode("utf8") + b"\0" + file_hash.encode("ascii") + b"\n")
+    return m.hexdigest()
+
+
+def read_modules(app, files, workers=1):
+    # Parse and validate the YAML of all of the modules in the app and
+    # return an OrderedDict mapping module IDs to normalized specs. The
+    # app's files have already been read, so the work can be spread over
+    # a pool of processes. With workers=None, the pool is sized to the app,
+    # and larger apps use one. Only management commands should ask for a
+    # pool: forking a multi-threaded web server process isn't safe.
+    module_paths = list(app.get_module_paths())
+    if workers is None:
+        workers = min(os.cpu_count() or 1, len(module_paths) // PARALLEL_MIN_MODULES)
+    if workers <= 1:
+        specs = [read_module(module_id, files[path], app) for module_id, path in module_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(files,)) as pool:
+            specs = list(pool.map(_read_module_in_worker,
+                [(module_id, files[path]) for module_id, path in module_paths]))
+    return OrderedDict(
+        (module_id, spec)
+        for (module_id, path), spec in zip(module_paths, specs))
 
-    # Load the module's YAML file.
-    if module_id not in available_modules:
-        raise DependencyError((dependency_path[-1] if len(dependency_path) > 0 else None), module_id)
 
-    spec = available_modules[module_id]
+def read_module(module_id, content, app):
+    # Parse a module YAML file and validate and normalize the module
+    # specification.
+    from .app_source_connections import read_yaml_file
+    spec = read_yaml_file(content.decode("utf8"))
 
     # Sanity check that the 'id' in the YAML file matches just the last
     # part of the path of the module_id. This allows the IDs to be 
@@ -135,10 +188,51 @@ def load_module_into_database(app, appinst, module_id, available_modules, proces
 
     # Validate and normalize the module specification.
     try:
-        spec = validate_module(spec, app)
+        return validate_module(spec, app)
     except ModuleValidationError as e:
         raise ValidationError(spec['id'], e.context, e.message)
 
+
+class FilesApp:
+    # Stands in for an App in a worker process, where only the app's
+    # files are available, for validate_module to read documents from.
+    def __init__(self, files):
+        self.files = files
+    def read_file(self, path):
+        import fs.errors, fs.path
+        path = fs.path.relpath(fs.path.normpath(path))
+        if path not in self.files:
+            raise fs.errors.ResourceNotFound(path)
+        return self.files[path].decode("utf8")
+
+_worker_app = None
+
+def _init_worker(files):
+    global _worker_app
+    _worker_app = FilesApp(files)
+
+def _read_module_in_worker(args):
+    module_id, content = args
+    return read_module(module_id, content, _worker_app)
+
+
+def load_module_into_database(app, appinst, module_id, available_modules, processed_modules, dependency_path, update_mode):
+    # Prevent cyclic dependencies between modules.
+    if module_id in dependency_path:
+        raise CyclicDependency(dependency_path)
+
+    # Because of dependencies between modules, we may have already
+    # been here. Do this after the cyclic dependency check or else
+    # we would never see a cyclic dependency.
+    if module_id in processed_modules:
+        return processed_modules[module_id]
+
+    # Get the module's specification, which has already been validated.
+    if module_id not in available_modules:
+        raise DependencyError((dependency_path[-1] if len(dependency_path) > 0 else None), module_id)
+
+    spec = available_modules[module_id]
+
     # Recursively update any modules this module references
     # because references to those modules are stored in the
     # database using a foreign key, so we need to that those
@@ -251,8 +345,7 @@ def update_module(m, spec, log_status):
                 raise IncompatibleUpdate("Module {} cannot be updated because question {}, which has been removed, has already been answered.".format(m.module_name, q.key))
 
     # If we're updating a Module in-place, clear out any cached state on its Tasks.
-    for t in Task.objects.filter(module=m):
-        t.on_answer_changed()
+    Task.clear_state(Task.objects.filter(module=m))
 
 
 def update_question(m, definition_order, spec, log_status):
@@ -444,40 +537,53 @@ def is_question_changed(mq, definition_order, spec, module_id_map=None):
     # The changes to this question do not create a data inconsistency.
     return False
 
-def load_module_assets_into_database(app, appinst):
+def load_module_assets_into_database(app, appinst, assets=None):
     # Load all of the static assets from the source into the database.
     # If a ModuleAsset already exists for an asset, use that.
 
     source = app.store.source
-
-    # Add the assets.
-    appinst.trust_assets = source.trust_assets # remember setting at time of app load
-    appinst.asset_paths = { }
-    for file_path, file_hash, content_loader in app.get_assets():
-        # Get or create the ModuleAsset --- it might already exist in an earlier app.
-        asset, is_new = ModuleAsset.objects.get_or_create(
+    if assets is None:
+        assets = list(app.get_assets())
+
+    # Get the ModuleAssets that already exist --- they might be in an
+    # earlier app --- and create the rest.
+    existing = {
+        asset.content_hash: asset
+        for asset in ModuleAsset.objects.filter(
             source=source,
-            content_hash=file_hash,
-        )
-        if is_new:
+            content_hash__in={ file_hash for file_path, file_hash, content_loader in assets })
+    }
+    from django.core.files.base import ContentFile
+    for file_path, file_hash, content_loader in assets:
+        if file_hash not in existing:
             # Set the new file content.
-            from django.core.files.base import ContentFile
+            asset = ModuleAsset(source=source, content_hash=file_hash)
             asset.file.save(file_path, ContentFile(content_loader()))
             asset.save()
+            existing[file_hash] = asset
 
-        mime_types = {
-            "css": "text/css",
-            "js": "text/javascript",
-        }
+    # Set the MIME type of the stored files that have a known type.
+    mime_types = {
+        "css": "text/css",
+        "js": "text/javascript",
+    }
+    paths_by_mime_type = { }
+    for file_path, file_hash, content_loader in assets:
         mime_type = mime_types.get(file_path.rsplit(".", 1)[-1])
         if mime_type:
-            from dbstorage.models import StoredFile
+            paths_by_mime_type.setdefault(mime_type, set()).add(existing[file_hash].file.name)
+    if paths_by_mime_type:
+        from dbstorage.models import StoredFile
+        for mime_type, paths in paths_by_mime_type.items():
             StoredFile.objects\
-                .filter(path=asset.file.name)\
+                .filter(path__in=paths)\
                 .update(mime_type=mime_type)
 
-        # Add to the app.
-        appinst.asset_files.add(asset)
-        appinst.asset_paths[file_path] = file_hash
-
+    # Add to the app.
+    appinst.trust_assets = source.trust_assets # remember setting at time of app load
+    appinst.asset_files.add(*existing.values())
+    appinst.asset_paths = {
+        file_path: file_hash
+        for file_path, file_hash, content_loader in assets
+    }
     appinst.save()
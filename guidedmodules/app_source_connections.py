@@ -70,6 +70,10 @@ class App(object):
 
     def get_modules(self):
         raise Exception("Not implemented!")
+    def get_module_paths(self):
+        raise Exception("Not implemented!")
+    def get_files(self):
+        raise Exception("Not implemented!")
     def get_assets(self):
         raise Exception("Not implemented!")
 
@@ -256,11 +260,17 @@ class PyFsApp(App):
 
     def get_modules(self):
         # Return a generator over parsed YAML data for modules.
-        return self.iter_modules([])
+        for module_id, path in self.get_module_paths():
+            with self.fs.open(path) as f:
+                yield (module_id, read_yaml_file(f))
 
-    def iter_modules(self, path):
+    def get_module_paths(self):
+        # Return a generator over the module IDs and paths of the
+        # module YAML files.
+        return self.iter_module_paths([])
+
+    def iter_module_paths(self, path):
         from os.path import splitext
-        path_entries = self.fs.listdir('/'.join(path))
         for entry in self.fs.scandir('/'.join(path)):
             if not entry.is_dir:
                 # If this is a file that ends in .yaml, it is a module file.
@@ -270,12 +280,7 @@ class PyFsApp(App):
                 if fn_ext == ".yaml":
                     # The module ID combines its local path and the filename.
                     module_id = "/".join(path + [fn_name])
-
-                    # Read the YAML file.
-                    with self.fs.open(entry.name) as f:
-                        module_spec = read_yaml_file(f)
-
-                    yield (module_id, module_spec)
+                    yield (module_id, "/".join(path + [entry.name]))
 
             elif entry.name in ("assets", "private-assets"):
                 # Don't recurisvely walk into directories named 'assets' or
@@ -286,9 +291,26 @@ class PyFsApp(App):
 
             else:
                 # Recursively walk directories.
-                for module in self.iter_modules(path+[entry.name]):
+                for module in self.iter_module_paths(path+[entry.name]):
                     yield module
 
+    def get_files(self):
+        # Return a generator over the path and binary content of every file
+        # in the app except the public assets, which get_assets returns:
+        # the module YAML files, the documents they refer to, README.md,
+        # private assets, etc.
+        return self.iter_files([])
+
+    def iter_files(self, path):
+        for entry in self.fs.scandir('/'.join(path)):
+            fn = "/".join(path + [entry.name])
+            if not entry.is_dir:
+                with self.fs.open(fn, "rb") as f:
+                    yield (fn, f.read())
+            elif fn != "assets":
+                for file in self.iter_files(path+[entry.name]):
+                    yield file
+
     def read_file(self, path):
         with self.fs.open(path) as f:
             return f.read()
@@ -419,16 +441,25 @@ class GithubApiAppSourceConnection(PyFsAppSourceConnection):
 
 
 class GitRepositoryFilesystem(SimplifiedReadonlyFilesystem):
-    def __init__(self, url, branch, path, ssh_key=None):
+    """A filesystem over a branch of a git repository.
+
+    The branch is fetched into a bare repository in settings.GIT_CACHE_DIR
+    that is shared by all connections (and all processes) that use the
+    same repository URL, branch and SSH key. The repository is only fetched
+    again, incrementally, when it was last fetched more than
+    settings.GIT_CACHE_TTL seconds ago or with a different stale_key (see
+    AppSource.make_cache_stale_key). Files are read from the cached
+    repository's object database."""
+
+    # The ref in the cached repository that the branch is fetched into.
+    CACHE_REF = "refs/govready/fetched"
+
+    def __init__(self, url, branch, path, ssh_key=None, stale_key=None):
         self.url = url
         self.branch = branch or None
         self.path = (path or "") + "/"
         self.ssh_key = ssh_key
-
-        # Create a local git working directory.
-        import tempfile
-        self.tempdir_obj = tempfile.TemporaryDirectory()
-        self.tempdir = self.tempdir_obj.__enter__()
+        self.stale_key = stale_key
 
         self.description = self.url + "/" + self.path.strip("/")
         if self.branch:
@@ -441,64 +472,57 @@ class GitRepositoryFilesystem(SimplifiedReadonlyFilesystem):
         return "<gitfs '%s'>" % self.description
 
     def close(self):
-        # Release the temporary directory.
-        self.tempdir_obj.__exit__(None, None, None)
+        # Nothing to release. The cached repository is kept.
+        pass
+
+    def get_cache_dir(self):
+        # The cached repository's directory name is a hash of everything
+        # that determines its content or who may read it, which also keeps
+        # any credentials in the URL out of the filesystem.
+        import json, os.path
+        import xxhash
+        from django.conf import settings
+        key = json.dumps([self.url, self.branch, self.ssh_key]).encode("utf8")
+        return os.path.join(settings.GIT_CACHE_DIR, xxhash.xxh64(key).hexdigest() + ".git")
 
     def get_repo_root(self):
         # Return cached tree.
         if hasattr(self, "repo_root_tree"):
             return self.repo_root_tree
 
-        import os, os.path
+        import fcntl, json, os, os.path, time
         import git
+        from django.conf import settings
 
-        # Create an empty git repo in the temporary directory.
-        self.repo = git.Repo.init(self.tempdir)
-
-        # Make SSH non-interactive.
-        ssh_options = "ssh -o StrictHostKeyChecking=no -o BatchMode=yes"
-
-        # If an SSH key is provided, store it in the temporary directory and
-        # then use it.
-        if self.ssh_key:
-            ssh_key_file = os.path.join(self.tempdir, "ssh.key")
-            old_umask = os.umask(0o077) # ssh requires group/world permissions to be zero
+        cache_dir = self.get_cache_dir()
+        status_file = os.path.join(cache_dir, "govready-fetch.json")
+        def is_fresh():
             try:
-                with open(ssh_key_file, "wb") as f:
-                    f.write(self.ssh_key.encode("ascii"))
-            finally:
-                os.umask(old_umask)
-            ssh_options += " -i " + ssh_key_file
-
-        self.repo.git.environment()["GIT_SSH_COMMAND"] = ssh_options
-
-        # For debugging, log a command that we could try on the command line.
-        #print("SSH_COMMAND=\"{ssh_options}\" git fetch --depth 1 {url} {branch}".format(
-        #    ssh_options=ssh_options, url=self.url, branch=self.branch), file=sys.stderr)
-
-        # Fetch.
-        import git.exc
-        try:
-            self.repo.git.execute(
-                [
-                    self.repo.git.git_exec_name,
-                    "fetch",
-                    "--depth", "1", # avoid getting whole repo history
-                    self.url, # repo URL
-                    self.branch or "", # branch to fetch
-                ], kill_after_timeout=20)
-        except git.exc.GitCommandError as e:
-            # This is where errors occur, which is hopefully about auth.
-            raise fs.errors.CreateFailed("The repository URL is either not valid, not public, or ssh_key was not specified or not valid (%s)." % e.stderr)
-
-        # Get the tree for the remote branch's HEAD.
-        tree = self.repo.tree("FETCH_HEAD")
-
-        # The Pythonic way would be to add a remote for the remote repository, run
-        # fetch, and then access its ref.
-        #self.remote = self.repo.create_remote("origin", self.spec["url"])
-        #self.remote.fetch(self.spec.get("branch"))
-        #tree = self.repo.tree(self.remote.refs[0])
+                with open(status_file) as f:
+                    status = json.load(f)
+            except (OSError, ValueError):
+                return False
+            return status.get("stale_key") == self.stale_key \
+                and time.time() - status.get("fetched", 0) < settings.GIT_CACHE_TTL
+
+        if not is_fresh():
+            # Take an exclusive lock so that only one process fetches or
+            # creates the repository at a time. Other processes can still
+            # read from it meanwhile because git updates objects and refs
+            # atomically. Check again once we have the lock in case another
+            # process just fetched it.
+            os.makedirs(settings.GIT_CACHE_DIR, exist_ok=True)
+            with open(cache_dir + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not is_fresh():
+                    self.fetch(cache_dir)
+                    with open(status_file + ".tmp", "w") as f:
+                        json.dump({ "fetched": time.time(), "stale_key": self.stale_key }, f)
+                    os.replace(status_file + ".tmp", status_file)
+
+        # Get the tree for the fetched branch's HEAD.
+        self.repo = git.Repo(cache_dir)
+        tree = self.repo.commit(self.CACHE_REF).tree
 
         # If a path was given, move to that subdirectory.
         # TODO: Check that paths with subdirectories that have no other content
@@ -512,6 +536,49 @@ class GitRepositoryFilesystem(SimplifiedReadonlyFilesystem):
         self.repo_root_tree = tree
         return tree
 
+    def fetch(self, cache_dir):
+        import os, os.path, tempfile
+        import git, git.exc
+
+        # Create the bare repository if it doesn't exist yet.
+        repo = git.Repo.init(cache_dir, bare=True)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            # Make SSH non-interactive.
+            ssh_options = "ssh -o StrictHostKeyChecking=no -o BatchMode=yes"
+
+            # If an SSH key is provided, store it in a temporary directory and
+            # then use it.
+            if self.ssh_key:
+                ssh_key_file = os.path.join(tempdir, "ssh.key")
+                old_umask = os.umask(0o077) # ssh requires group/world permissions to be zero
+                try:
+                    with open(ssh_key_file, "wb") as f:
+                        f.write(self.ssh_key.encode("ascii"))
+                finally:
+                    os.umask(old_umask)
+                ssh_options += " -i " + ssh_key_file
+
+            repo.git.update_environment(GIT_SSH_COMMAND=ssh_options)
+
+            # For debugging, log a command that we could try on the command line.
+            #print("SSH_COMMAND=\"{ssh_options}\" git fetch --depth 1 {url} {branch}".format(
+            #    ssh_options=ssh_options, url=self.url, branch=self.branch), file=sys.stderr)
+
+            # Fetch. Objects already in the cache are not fetched again.
+            try:
+                repo.git.execute(
+                    [
+                        repo.git.git_exec_name,
+                        "fetch",
+                        "--depth", "1", # avoid getting whole repo history
+                        self.url, # repo URL
+                        "+" + (self.branch or "HEAD") + ":" + self.CACHE_REF, # branch to fetch
+                    ], kill_after_timeout=20)
+            except git.exc.GitCommandError as e:
+                # This is where errors occur, which is hopefully about auth.
+                raise fs.errors.CreateFailed("The repository URL is either not valid, not public, or ssh_key was not specified or not valid (%s)." % e.stderr)
+
     def getdir(self, path):
         tree = self.get_repo_root()
         for item in path.split("/"):
@@ -565,7 +632,8 @@ class GitRepositoryAppSourceConnection(PyFsAppSourceConnection):
         if not isinstance(options.get("path"), (str, type(None))): raise ValueError("The AppSource is misconfigured: missing or invalid 'path'.")
         super().__init__(source, lambda : GitRepositoryFilesystem(
             options["url"], options.get("branch"), options.get("path"),
-            options.get("ssh_key")))
+            options.get("ssh_key"),
+            source.make_cache_stale_key() if source else None))
 
 
 def read_yaml_file(f):
@@ -0,0 +1,200 @@
+# Upgrading projects to another version of their compliance app
+#
+# A Project is upgraded by repointing its Tasks at the same-named Modules in
+# the new AppVersion and its TaskAnswers at the same-keyed ModuleQuestions of
+# those Modules. That's safe if every Module in use by the Project exists in
+# the new app and hasn't changed incompatibly (see is_module_changed).
+#
+# Which Modules and ModuleQuestions replace which, and whether each Module
+# in use has changed incompatibly, doesn't depend on the Project. So an
+# UpgradePlan works them out once per pair of AppVersions, and for each old
+# Module only when it is first found in use. A ProjectUpgrader caches the
+# plans, so checking and upgrading many Projects costs a few queries per
+# batch of Projects. It remaps each batch with one UPDATE of the Tasks and
+# one of the TaskAnswers per Module in use, rather than statements per
+# Project, per Task or per question.
+
+from django.db import models, transaction
+
+BATCH_SIZE = 100 # projects checked and remapped at a time
+
+
+class UpgradePlan:
+    def __init__(self, old_app, new_app):
+        from .models import ModuleQuestion
+        self.old_app = old_app
+        self.new_app = new_app
+
+        # Get the Modules in the new app with their questions.
+        self.new_modules = { m.module_name: m for m in new_app.modules.all() }
+        self.new_questions = { }
+        for q in ModuleQuestion.objects.filter(module__app=new_app).order_by('definition_order'):
+            self.new_questions.setdefault(q.module_id, []).append(q)
+
+        # Make a mapping of modules in the existing compliance app to their corresponding
+        # modules in the new compliance app (for modules that exist in both the old and new
+        # app with the same name) so that when checking module-type questions, we can know
+        # to expect certain ID changes. Here we need all of the modules in the app regardless
+        # of whether they are in use.
+        self.module_id_map = {
+            m.id: self.new_modules[m.module_name].id
+            for m in old_app.modules.all()
+            if m.module_name in self.new_modules
+        }
+
+        # Old Module id => (new Module, None if the upgrade of the Module is safe
+        # or else a string saying why not, { old question id: new question id }).
+        self.modules = { }
+
+    def get_module(self, old_module):
+        if old_module.id not in self.modules:
+            self.modules[old_module.id] = self.plan_module(old_module)
+        return self.modules[old_module.id]
+
+    def plan_module(self, old_module):
+        from .app_loading import is_module_changed
+
+        new_module = self.new_modules.get(old_module.module_name)
+        if new_module is None:
+            # Module must exist in the new app version to be compatible.
+            return (None, "The module {} does not exist in the new app.".format(old_module.module_name), { })
+
+        # Get the 'spec' which is the Python representation of the
+        # YAML module data. Clone it (dict(...)) and put back the questions,
+        # which we move out when we load it into the database but which
+        # is_module_changed expects to be there.
+        new_questions = self.new_questions.get(new_module.id, [])
+        spec = dict(new_module.spec)
+        spec["questions"] = [q.spec for q in new_questions]
+
+        # 'None' signals no changes. 'False' means no incompatible changes.
+        # Otherwise 'changed' holds a string describing the issue.
+        changed = is_module_changed(old_module, self.new_app.source, spec, module_id_map=self.module_id_map)
+        if changed in (None, False):
+            changed = None
+
+        # Map the old Module's questions to the new Module's by key.
+        new_questions = { q.key: q.id for q in new_questions }
+        question_map = {
+            q.id: new_questions[q.key]
+            for q in old_module.questions.all()
+            if q.key in new_questions
+        }
+
+        return (new_module, changed, question_map)
+
+    def check(self, old_modules):
+        # Returns True if a Project using the old Modules can be upgraded,
+        # otherwise a string saying why not.
+        for old_module in old_modules:
+            new_module, changed, question_map = self.get_module(old_module)
+            if changed:
+                return changed
+        return True
+
+
+class ProjectUpgrader:
+    def __init__(self):
+        self.plans = { } # (old AppVersion id, new AppVersion id) => UpgradePlan
+        self.apps = { } # AppVersion id => AppVersion
+        self.modules = { } # Module id => Module
+
+    def get_plan(self, old_app_id, new_app):
+        key = (old_app_id, new_app.id)
+        if key not in self.plans:
+            self.plans[key] = UpgradePlan(self.get_apps([old_app_id])[old_app_id], new_app)
+        return self.plans[key]
+
+    def get_apps(self, app_ids):
+        from .models import AppVersion
+        missing = set(app_ids) - set(self.apps)
+        if missing:
+            for app in AppVersion.objects.filter(id__in=missing).select_related('source'):
+                self.apps[app.id] = app
+        return self.apps
+
+    def get_modules_in_use(self, project_ids):
+        # Returns a mapping from Project id to the Modules in use by the
+        # Project's Tasks and the id of the AppVersion of its root Task.
+        from siteapp.models import Project
+        from .models import Module, Task
+        modules = { }
+        for project_id, module_id in Task.objects.filter(project_id__in=project_ids)\
+                .values_list('project_id', 'module_id').distinct().order_by('project_id', 'module_id'):
+            modules.setdefault(project_id, []).append(module_id)
+        missing = { m for ms in modules.values() for m in ms } - set(self.modules)
+        for m in Module.objects.filter(id__in=missing):
+            self.modules[m.id] = m
+        root_apps = dict(Project.objects.filter(id__in=project_ids)
+            .values_list('id', 'root_task__module__app_id'))
+        return {
+            project_id: ([self.modules[m] for m in modules.get(project_id, [])], root_apps.get(project_id))
+            for project_id in project_ids
+        }
+
+    def check(self, project, new_app):
+        # Returns True if the Project can be upgraded to the new AppVersion,
+        # otherwise a string saying why not.
+        return self.upgrade([project], new_app, dry_run=True)[project.id]
+
+    def upgrade(self, projects, new_app, dry_run=False):
+        # Upgrades the Projects (or their ids) to the new AppVersion, a batch
+        # at a time, each batch in a transaction. Returns a mapping from
+        # Project id to True if the Project was upgraded (or in a dry run,
+        # would be), otherwise to a string saying why it wasn't.
+        project_ids = [getattr(p, "id", p) for p in projects]
+        results = { }
+        for i in range(0, len(project_ids), BATCH_SIZE):
+            with transaction.atomic():
+                results.update(self.upgrade_batch(project_ids[i:i+BATCH_SIZE], new_app, dry_run))
+        return results
+
+    def upgrade_batch(self, project_ids, new_app, dry_run):
+        from .models import Task, TaskAnswer
+
+        # Check which Projects can be upgraded.
+        results = { }
+        remaps = { } # (old Module id, UpgradePlan) => ids of the Projects using it to upgrade
+        modules_in_use = self.get_modules_in_use(project_ids)
+        self.get_apps({ app_id for modules, app_id in modules_in_use.values() if app_id })
+        for project_id, (old_modules, old_app_id) in modules_in_use.items():
+            if old_app_id is None:
+                results[project_id] = "The project has no root task."
+                continue
+            if old_app_id == new_app.id:
+                results[project_id] = True # nothing to do
+                continue
+            plan = self.get_plan(old_app_id, new_app)
+            results[project_id] = plan.check(old_modules)
+            if results[project_id] is True:
+                for m in old_modules:
+                    remaps.setdefault((m.id, plan), []).append(project_id)
+
+        if dry_run:
+            return results
+
+        # Every Task in the Projects is updated to point to the corresponding Module
+        # in the new app, and each TaskAnswer to the corresponding ModuleQuestion.
+        for (old_module_id, plan), upgrade_ids in remaps.items():
+            new_module, changed, question_map = plan.modules[old_module_id]
+            Task.objects\
+                .filter(project_id__in=upgrade_ids, module_id=old_module_id)\
+                .update(module=new_module)
+            if question_map:
+                TaskAnswer.objects\
+                    .filter(task__project_id__in=upgrade_ids, question__module_id=old_module_id)\
+                    .update(question=models.Case(
+                        *[models.When(question_id=old, then=models.Value(new)) for old, new in question_map.items()],
+                        default=models.F('question_id'),
+                        output_field=models.IntegerField()))
+
+        # The Tasks' cached state was computed with the old app. Clear it once
+        # the upgrade is committed. Clearing a Project's root Task clears the
+        # state of all of the Project's Tasks.
+        from siteapp.models import Project
+        upgraded = { project_id for upgrade_ids in remaps.values() for project_id in upgrade_ids }
+        with Task.deferred_clear_state():
+            Task.clear_state(Task.objects.filter(
+                id__in=Project.objects.filter(id__in=upgraded).values('root_task_id')))
+
+        return results
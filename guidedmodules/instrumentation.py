@@ -0,0 +1,151 @@
+# Buffered InstrumentationEvent writer
+#
+# Instrumentation events are recorded on hot request paths -- every
+# question page's load time, every answer saved. Rather than INSERTing each
+# event on the request thread, record() puts an unsaved InstrumentationEvent
+# on an in-process queue and a background worker writes queued events with
+# bulk_create in batches. If a batch can't be written, its events are
+# written one at a time so that one bad event doesn't lose the rest.
+#
+# Events recorded inside an atomic block are saved right away instead, as
+# part of that transaction, so that they are rolled back with it and the
+# worker never writes an event that refers to uncommitted rows. (This is
+# also how events are recorded under the test runner, whose transactions
+# never commit.) Views that read events back, e.g. to measure the time
+# since a question was first viewed, may not see events still queued.
+#
+# The queue is bounded by the "instrumentation-buffer-size" environment
+# setting (default 10000 events). When it is full, new events are dropped
+# and counted rather than slowing down or growing the process; the count
+# is logged with the next batch. The worker flushes at least every
+# "instrumentation-flush-interval" seconds (default 2). Setting the buffer
+# size to 0 writes each event synchronously instead.
+#
+# The worker is an ordinary daemon thread, which under gevent's monkey
+# patching becomes a greenlet. Events still queued when the process exits
+# are flushed by an atexit handler.
+
+import atexit
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+import structlog
+from structlog import get_logger
+from structlog.stdlib import LoggerFactory
+structlog.configure(logger_factory=LoggerFactory())
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = get_logger()
+
+BATCH_SIZE = 500
+
+
+class EventBuffer:
+    def __init__(self, max_size, flush_interval):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.worker = None
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Drop the event rather than block the request.
+            self.dropped += 1
+
+    def start(self):
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, name="instrumentation-writer", daemon=True)
+            self.worker.start()
+            atexit.register(self.flush)
+
+    def run(self):
+        from django.db import close_old_connections
+        while True:
+            # Wait for the first event of the next batch, then collect more
+            # until the batch is full or the flush interval has passed.
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                pass
+            close_old_connections()
+            self.write(batch)
+
+    def flush(self):
+        """Write all queued events on the calling thread."""
+        while True:
+            batch = []
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            self.write(batch)
+
+    def write(self, batch):
+        from .models import InstrumentationEvent
+        dropped, self.dropped = self.dropped, 0
+        if dropped:
+            logger.warning(event="instrumentation_events_dropped", object={"count": dropped})
+        try:
+            with transaction.atomic():
+                InstrumentationEvent.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+            return
+        except Exception:
+            pass
+
+        # Some event couldn't be written, e.g. because it refers to a row that
+        # has since been deleted. Write the events one at a time to save the
+        # rest. Instrumentation must never take down the writer.
+        failed = 0
+        error = None
+        for event in batch:
+            try:
+                with transaction.atomic():
+                    event.save()
+            except Exception as e:
+                failed += 1
+                error = e
+        if failed:
+            logger.error(event="instrumentation_events_write_failed", object={"count": failed, "error": str(error)})
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = EventBuffer(settings.INSTRUMENTATION_BUFFER_SIZE, settings.INSTRUMENTATION_FLUSH_INTERVAL)
+            _buffer.start()
+    return _buffer
+
+
+def record(**fields):
+    """Record an InstrumentationEvent with the given field values. The event
+    is written in the background, unless it is recorded inside an atomic
+    block or buffering is turned off, in which case it is saved now."""
+    from django.utils import timezone
+    from .models import InstrumentationEvent
+    fields.setdefault("event_time", timezone.now())
+    event = InstrumentationEvent(**fields)
+    if connection.in_atomic_block or not settings.INSTRUMENTATION_BUFFER_SIZE:
+        event.save()
+        return
+    get_buffer().put(event)
+
+
+def flush():
+    """Write any buffered events now."""
+    if _buffer is not None:
+        _buffer.flush()
@@ -21,6 +21,18 @@
 #
 # Start component apps automatically:
 # ./manage.py assemble --startapps assemble.yaml
+#
+# Assemble many driver files, given as files or directories
+# of YAML files, at once. The output directory must then be
+# given with --outdir. Each file's output documents are
+# saved to a subdirectory of the output directory named
+# after the file. With --workers, the files are assembled
+# in that many worker processes, each with its own throw-away
+# database:
+# ./manage.py assemble --workers 4 drivers/ --outdir outdir
+#
+# Within a run, apps are loaded into the database once and
+# reused by every driver file that the same process assembles.
 
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
@@ -31,6 +43,9 @@ from guidedmodules.models import AppSource, Task, TaskAnswer
 from guidedmodules.module_logic import ModuleAnswers
 
 import collections
+import contextlib
+import io
+import itertools
 import os
 import os.path
 import rtyaml
@@ -40,9 +55,10 @@ import termcolor
 LOG_COLORS = { "INFO": "white", "OK": "green", "WARN": "yellow", "ERROR": "red" }
 LOG_SYMBOLS = { "INFO": " ", "OK": "🗸", "WARN": "!", "ERROR": "✗" }
 LOG_NAMES = { "WARN": "warning", "ERROR": "error" }
+DRIVER_FILE_EXTENSIONS = (".yaml", ".yml")
 
 class Command(BaseCommand):
-    help = 'Starts compliance apps using a YAML driver file that specifies apps and data.'
+    help = 'Starts compliance apps using YAML driver files that specify apps and data.'
 
     def __init__(self):
         self.indent = 0
@@ -52,16 +68,132 @@ class Command(BaseCommand):
         parser.add_argument('--init', metavar="path/to/app", type=str, help="Creates a new assemble input YAML file for the app specified by the given path.")
         parser.add_argument('--startapps', metavar="path/to/apps1,path/to/apps2;...", type=str, help="Starts component apps using apps in the given paths.")
         parser.add_argument('--add-blank-answers', action='store_true', help="Adds unanswered questions to the YAML file.")
-        parser.add_argument('data.yaml', type=str)
-        parser.add_argument('outdir', type=str, nargs="?")
+        parser.add_argument('--outdir', type=str, help="Saves output documents to this directory.")
+        parser.add_argument('--workers', type=int, default=1, help="The number of driver files to assemble at a time, each worker process using its own throw-away database.")
+        parser.add_argument('data.yaml', type=str, nargs="+", help="Driver files or directories of driver files. A single driver file may be followed by the output directory instead of giving --outdir.")
 
     def handle(self, *args, **options):
-        fn = options['data.yaml']
-        basedir = os.path.dirname(fn)
+        files, outdirs = self.get_driver_files(options['data.yaml'], options["outdir"], options["init"])
 
         # Pre-process command-line arguments.
         self.load_startapps_catalog(options)
 
+        # Fixup Django settings. Turn DEBUG off. This might speed up
+        # program execution if e.g. database queries are not logged.
+        settings.DEBUG = False
+
+        # Conversions of output documents run in threads, shared out between
+        # the worker processes.
+        workers = max(1, min(options["workers"], len(files)))
+        self.output_threads = max(1, (os.cpu_count() or 1) // workers)
+
+        if workers > 1:
+            self.assemble_in_workers(files, outdirs, options, workers)
+        else:
+            self.setup_database()
+            try:
+                for fn, outdir in zip(files, outdirs):
+                    if len(files) == 1:
+                        self.assemble_file(fn, outdir, options)
+                    else:
+                        self.assemble_one_of_many(fn, outdir, options)
+            finally:
+                self.teardown_database()
+
+        for level in ("WARN", "ERROR"):
+            print(termcolor.colored("{} {}(s)".format(
+                self.logcounts.get(level, 0),
+                LOG_NAMES[level],
+            ), LOG_COLORS[level]))
+
+    def get_driver_files(self, paths, outdir, init=None):
+        # Return the driver files to assemble and the output directory for
+        # each. A single driver file may be followed by the output directory,
+        # as in the single-file usage. Otherwise it's given with --outdir.
+        paths = list(paths)
+        if not outdir and len(paths) == 2 and not os.path.isdir(paths[0]) \
+                and not paths[1].endswith(DRIVER_FILE_EXTENSIONS):
+            outdir = paths.pop()
+
+        # Expand directories into the driver files in them.
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(sorted(
+                    os.path.join(path, fn) for fn in os.listdir(path)
+                    if fn.endswith(DRIVER_FILE_EXTENSIONS)))
+            else:
+                files.append(path)
+        if init and (len(files) != 1 or len(paths) != 1):
+            raise CommandError("--init can only be used with a single driver file.")
+        if not outdir and len(paths) > 1:
+            raise CommandError("Give the output directory with --outdir when assembling more than one driver file.")
+
+        # When there are many driver files, each one's output documents go
+        # in a subdirectory of the output directory named after the file's
+        # path relative to the directory that holds all of the files.
+        outdirs = [outdir] * len(files)
+        if outdir and files and (len(paths) > 1 or files != paths):
+            base = os.path.commonpath([os.path.dirname(os.path.abspath(fn)) for fn in files])
+            outdirs = [os.path.join(outdir, os.path.splitext(os.path.relpath(os.path.abspath(fn), base))[0])
+                       for fn in files]
+        return files, outdirs
+
+    def setup_database(self, suffix=None):
+        # Switch to the throw-away test database so no database records
+        # we create in this command are persistent. Worker processes each
+        # get their own, so databases that aren't in-memory get the suffix
+        # added to their names.
+        from django.db import connections
+        from django.test.utils import setup_databases
+        if suffix:
+            for conn in connections.all():
+                test_name = conn.creation._get_test_db_name()
+                if conn.vendor == "sqlite" and conn.creation.is_in_memory_db(test_name):
+                    continue # already private to this process
+                conn.settings_dict["TEST"]["NAME"] = "{}_{}".format(test_name, suffix)
+        self.dbinfo = setup_databases(True, False)
+
+        # Cache app sources and app instances as we load app data into the
+        # database so that when sources and apps occur multiple times, in
+        # one driver file or across driver files, we reuse the existing
+        # instances in the database.
+        self.app_sources = { }
+        self.app_instances = { }
+
+    def teardown_database(self):
+        # Clean up the throw-away test database.
+        from django.test.utils import teardown_databases
+        teardown_databases(self.dbinfo, 1)
+
+    def assemble_in_workers(self, files, outdirs, options, workers):
+        # Assemble the driver files in a pool of worker processes. Each
+        # file's log is collected by the worker and printed here when the
+        # file is done, in order, so that logs of different files don't mix.
+        from concurrent.futures import ProcessPoolExecutor
+        from django.db import connections
+        connections.close_all() # don't share connections with the workers
+        with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(self.output_threads,)) as pool:
+            for output, logcounts in pool.map(assemble_in_worker, files, outdirs, itertools.repeat(options)):
+                print(output, end="")
+                for level, count in logcounts.items():
+                    self.logcounts[level] = self.logcounts.get(level, 0) + count
+
+    def assemble_one_of_many(self, fn, outdir, options):
+        # Assemble one of many driver files, logging rather than raising
+        # errors so that the other files are still assembled.
+        self.log("INFO", "Assembling {}...".format(fn))
+        self.indent += 1
+        try:
+            self.assemble_file(fn, outdir, options)
+        except Exception as e:
+            self.log("ERROR", "{}: {}".format(fn, e))
+        finally:
+            self.indent -= 1
+
+    def assemble_file(self, fn, outdir, options):
+        basedir = os.path.dirname(fn)
+
         # Open the end-user data file in a manner that we can.
         # update it. If --init is used, then instantiate a
         # new file for a new app.
@@ -83,7 +215,7 @@ class Command(BaseCommand):
                 data["app"] = os.path.relpath(options["init"], basedir) # compute path relative to the output file, not the current working directory
             
             # Run the file.
-            self.AssembleApp(data, basedir, options)
+            self.AssembleApp(data, basedir, outdir, options)
 
     # Show colored log output and count the number of warnings and errors.
     def log(self, level, message):
@@ -108,58 +240,35 @@ class Command(BaseCommand):
                         })
 
 
-    def AssembleApp(self, data, basedir, options):
-        # Fixup Django settings. Turn DEBUG off. This might speed up
-        # program execution if e.g. database queries are not logged.
-        settings.DEBUG = False
-
-        # Switch to the throw-away test database so no database records
-        # we create in this command are persistent.
-        from django.test.utils import setup_databases, teardown_databases
-        dbinfo = setup_databases(True, False)
-
-        try:
-            # Read the customized organization name, which substitutes in for
-            # {{organization}} in templates..
-            organization_name = "<Organization Name>"
-            if isinstance(data.get("organization"), dict) \
-              and isinstance(data["organization"].get("name"), str):
-                organization_name = data["organization"]["name"]
-
-            # Create stub data structures that are required to do module logic
-            # but that have mostly no end-user-visible presence. The only thing
-            # visible here is the organization's name, which gets substituted
-            # in {{organization}} variables in document templates.
-            self.dummy_org = Organization.objects.create(
-                name=organization_name,
-                slug=get_random_string(12))
-            self.dummy_user = User.objects.create(username=get_random_string(12))
-
-            # Cache app sources and app instances as we load app data into the
-            # database so that when sources and apps occur multiple times we
-            # reuse the existing instances in the database.
-            self.app_sources = { }
-            self.app_instances = { }
-
-            # Start the app.
-            project = self.start_app(data.get("app"), basedir)
-
-            if project: # no error
-                # Fill in the answers.
+    def AssembleApp(self, data, basedir, outdir, options):
+        # Read the customized organization name, which substitutes in for
+        # {{organization}} in templates..
+        organization_name = "<Organization Name>"
+        if isinstance(data.get("organization"), dict) \
+          and isinstance(data["organization"].get("name"), str):
+            organization_name = data["organization"]["name"]
+
+        # Create stub data structures that are required to do module logic
+        # but that have mostly no end-user-visible presence. The only thing
+        # visible here is the organization's name, which gets substituted
+        # in {{organization}} variables in document templates.
+        self.dummy_org = Organization.objects.create(
+            name=organization_name,
+            slug=get_random_string(12))
+        self.dummy_user = User.objects.create(username=get_random_string(12))
+
+        # Start the app.
+        project = self.start_app(data.get("app"), basedir)
+
+        if project: # no error
+            # Fill in the answers, clearing the cached state of the project's
+            # Tasks once at the end.
+            with Task.deferred_clear_state():
                 self.set_answers(project.root_task, data.setdefault("questions", []), basedir, options)
 
-                # Generate outputs if outdir was given on the command line.
-                if options["outdir"]:
-                    self.save_outputs(project, options["outdir"])
-        finally:
-            # Clean up the throw-away test database.
-            teardown_databases(dbinfo, 1)
-
-        for level in ("WARN", "ERROR"):
-            print(termcolor.colored("{} {}(s)".format(
-                self.logcounts.get(level, 0),
-                LOG_NAMES[level],
-            ), LOG_COLORS[level]))
+            # Generate outputs if an output directory was given on the command line.
+            if outdir:
+                self.save_outputs(project, outdir)
 
     def str_task(self, task):
         return "<#{}: {}>".format(task.id, task.title)
@@ -173,28 +282,29 @@ class Command(BaseCommand):
             if not isinstance(app.get("source"), dict): raise ValueError("invalid data type")
             if not isinstance(app.get("name"), str): raise ValueError("invalid data type")
 
+        if isinstance(app, str):
+            # If given as a string, take the last directory name as the
+            # app name and the preceding directories as the AppSource
+            # connection path.
+            spec = {
+                "type": "local",
+                "path": os.path.normpath(os.path.join(basedir, os.path.dirname(app))),
+            }
+            appname = os.path.basename(app)
+        else:
+            # Otherwise the 'source' and 'name' keys hold the source and app info.
+            spec = app["source"]
+            appname = app["name"]
+
         # Get an existing AppVersion if we've already created this app,
-        # otherwise create a new AppVersion.
-        key = rtyaml.dump(app)
+        # otherwise create a new AppVersion. The key uses the resolved
+        # path so that driver files in different directories share apps.
+        key = rtyaml.dump({ "source": spec, "name": appname })
         if key in self.app_instances:
             app_inst = self.app_instances[key]
         else:
             # Create a AppSource, or reuse if this source has been used before.
 
-            if isinstance(app, str):
-                # If given as a string, take the last directory name as the
-                # app name and the preceding directories as the AppSource
-                # connection path.
-                spec = {
-                    "type": "local",
-                    "path": os.path.normpath(os.path.join(basedir, os.path.dirname(app))),
-                }
-                appname = os.path.basename(app)
-            else:
-                # Otherwise the 'source' and 'name' keys hold the source and app info.
-                spec = app["source"]
-                appname = app["name"]
-
             # If we've already created & cached the AppSource, use it.
             srckey = rtyaml.dump(spec)
             if srckey in self.app_sources:
@@ -433,29 +543,65 @@ class Command(BaseCommand):
             return
 
     def save_outputs(self, project, outdir):
-        self.generate_task_outputs(project.root_task, outdir)
-
-    def generate_task_outputs(self, task, path):
-        # Generate this task's output documents.
-        for i, doc in enumerate(task.render_output_documents()):
-            self.save_output_document(task, i, doc, path)
-
-        self.log("OK", "Wrote documents for " + self.str_task(task) + " to " + path + ".")
+        # Output documents are rendered here, since rendering uses the
+        # database, and converted to each download format and written in
+        # a thread pool, since most of the conversions run pandoc.
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(self.output_threads) as pool:
+            jobs = []
+            self.generate_task_outputs(project.root_task, outdir, pool, jobs)
+            for job in jobs:
+                job.result() # raise any error
+
+    def generate_task_outputs(self, task, path, pool, jobs):
+        # Render this task's output documents once and queue saving them.
+        # The documents are rendered lazily, so render the formats that the
+        # conversions start from now, before they go to other threads.
+        documents = task.render_output_documents(use_data_urls=True)
+        for i, doc in enumerate(documents):
+            doc.render("html", *(["markdown"] if doc["format"] == "markdown" else []))
+            jobs.append(pool.submit(self.save_output_document, task, i, documents, path))
+
+        self.log("OK", "Writing documents for " + self.str_task(task) + " to " + path + ".")
 
         try:
             # Run recursively on any module answers to questions.
             self.indent += 1
             for q, is_answered, a, value in task.get_answers().with_extended_info().answertuples.values():
                 if isinstance(value, ModuleAnswers) and value.task:
-                    self.generate_task_outputs(value.task, os.path.join(path, q.key))
+                    self.generate_task_outputs(value.task, os.path.join(path, q.key), pool, jobs)
         finally:
             self.indent -= 1
 
-    def save_output_document(self, task, i, doc, path):
+    def save_output_document(self, task, i, documents, path):
         os.makedirs(path, exist_ok=True)
         for download_format in ("html", "markdown", "docx"):
-            blob, filename, mime_type = task.download_output_document(i, download_format)
+            blob, filename, mime_type = task.download_output_document(i, download_format, documents=documents)
             fn = os.path.join(path, filename)
             with open(fn, "wb") as f:
                 f.write(blob)
 
+
+# Worker processes for assembling many driver files at a time. Each worker
+# sets up its own throw-away database once and keeps it, and the apps it has
+# loaded into it, for all of the driver files it assembles.
+
+_worker = None
+
+def start_worker(output_threads):
+    global _worker
+    import django
+    import multiprocessing.util
+    django.setup() # if the worker was spawned rather than forked
+    _worker = Command()
+    _worker.output_threads = output_threads
+    _worker.setup_database(suffix=str(os.getpid()))
+    multiprocessing.util.Finalize(_worker, _worker.teardown_database, exitpriority=10)
+
+def assemble_in_worker(fn, outdir, options):
+    # Assemble the driver file and return its log and warning and error counts.
+    _worker.logcounts = { }
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        _worker.assemble_one_of_many(fn, outdir, options)
+    return output.getvalue(), _worker.logcounts
@@ -22,13 +22,14 @@ class Command(BaseCommand):
                     appinst = load_app_into_database(
                         app,
                         update_appinst=oldappinst,
-                        update_mode=AppImportUpdateMode.CompatibleUpdate if oldappinst else AppImportUpdateMode.CreateInstance)
+                        update_mode=AppImportUpdateMode.CompatibleUpdate if oldappinst else AppImportUpdateMode.CreateInstance,
+                        workers=None)
                 except IncompatibleUpdate as e:
                     # App was changed in an incompatible way, so fall back to creating
                     # a new AppVersion and mark the old one as no longer the system_app.
                     # Only one can be the system_app.
                     print(app, e)
-                    appinst = load_app_into_database(app)
+                    appinst = load_app_into_database(app, workers=None)
                     oldappinst.system_app = None # the correct value here is None, not False, to avoid unique constraint violation
                     oldappinst.save()
 
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from guidedmodules.analytics import update_rollups, prune_events
+
+class Command(BaseCommand):
+    help = 'Rolls up new instrumentation events into the daily aggregates shown on the analytics page and optionally deletes old events.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, help="Delete instrumentation events older than this many days once they have been rolled up. Events are kept if not given.")
+
+    def handle(self, *args, **options):
+        count = update_rollups()
+        print("Rolled up {} event(s).".format(count))
+
+        if options["retention_days"] is not None:
+            count = prune_events(options["retention_days"])
+            print("Deleted {} event(s) older than {} day(s).".format(count, options["retention_days"]))
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from siteapp.models import Project
+from guidedmodules.models import AppVersion
+from guidedmodules.app_upgrade import ProjectUpgrader
+
+class Command(BaseCommand):
+    help = 'Upgrades many projects to a new version of their app, in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_source', type=str, help="The name (slug) of an AppSource containing the AppVersion to upgrade to.")
+        parser.add_argument('app_name', type=str, help="The name of an AppVersion within the named AppSource.")
+        parser.add_argument('app_version', type=str, help="The version number of the AppVersion to upgrade to.")
+        parser.add_argument('--project', type=int, action="append", help="The ID of a siteapp.Project instance to upgrade. Can be given more than once. By default, all projects using another version of the app are upgraded.")
+        parser.add_argument('--from-version', type=str, help="Only upgrade projects using this version of the app.")
+        parser.add_argument('--dry-run', action="store_true", help="Report which projects can be upgraded without upgrading them.")
+        parser.add_argument('--workers', type=int, default=1, help="The number of worker processes to upgrade projects in.")
+
+    def handle(self, *args, **options):
+        # Get the target AppVersion.
+        new_app = AppVersion.objects.get(
+            source__slug=options["app_source"],
+            appname=options["app_name"],
+            version_number=options["app_version"])
+
+        # Get the projects to upgrade.
+        projects = Project.objects\
+            .filter(root_task__module__app__source=new_app.source,
+                    root_task__module__app__appname=new_app.appname)\
+            .exclude(root_task__module__app=new_app)
+        if options["project"]:
+            projects = projects.filter(id__in=options["project"])
+        if options["from_version"]:
+            projects = projects.filter(root_task__module__app__version_number=options["from_version"])
+        project_ids = list(projects.order_by('id').values_list('id', flat=True))
+        if not project_ids:
+            print("There are no projects to upgrade.")
+            return
+
+        # Check and upgrade the projects. The projects are divided evenly
+        # between the workers, each working out how to upgrade from each
+        # old version of the app once.
+        workers = max(1, min(options["workers"], len(project_ids)))
+        from django.db import connection
+        if connection.vendor == "sqlite" and not options["dry_run"]:
+            workers = 1 # SQLite can't write in more than one process at a time
+        if workers == 1:
+            results = upgrade_projects(project_ids, new_app.id, options["dry_run"])
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            from django.db import connections
+            connections.close_all() # don't share connections with the workers
+            groups = [project_ids[len(project_ids) * i // workers:len(project_ids) * (i + 1) // workers]
+                      for i in range(workers)]
+            results = { }
+            with ProcessPoolExecutor(workers, initializer=start_worker) as pool:
+                for r in pool.map(upgrade_projects, groups, [new_app.id] * workers, [options["dry_run"]] * workers):
+                    results.update(r)
+
+        # Report.
+        upgraded = 0
+        for project_id in project_ids:
+            result = results[project_id]
+            if result is True:
+                upgraded += 1
+                print("Project {}: {}.".format(project_id, "can be upgraded" if options["dry_run"] else "upgraded"))
+            else:
+                print("Project {}: incompatible: {}".format(project_id, result))
+        print("{} of {} project(s) {} to {} {}.".format(
+            upgraded, len(project_ids),
+            "can be upgraded" if options["dry_run"] else "upgraded",
+            new_app.appname, new_app.version_number))
+
+
+def start_worker():
+    import django
+    django.setup() # if the worker was spawned rather than forked
+
+def upgrade_projects(project_ids, new_app_id, dry_run):
+    new_app = AppVersion.objects.select_related('source').get(id=new_app_id)
+    return ProjectUpgrader().upgrade(project_ids, new_app, dry_run=dry_run)
@@ -1,6 +1,6 @@
 from time import time as now
 
-from .models import InstrumentationEvent
+from . import instrumentation
 
 class InstrumentQuestionPageLoadTimes:
     def __init__(self, next_middleware):
@@ -21,7 +21,7 @@ class InstrumentQuestionPageLoadTimes:
         if event_info:
             duration = (now() - start) * 1000 # store in msec because that's a more natural scale and
                                               # the analytics page likes to round event_value to integers
-            InstrumentationEvent.objects.create(
+            instrumentation.record(
                 user=request.user,
                 event_value=duration,
                 **event_info
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.11 on 2026-10-18 21:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0051_auto_20201113_1518'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='instrumentationevent',
+            name='event_time',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.0.11 on 2026-10-18 21:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0052_instrumentationevent_event_time_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstrumentationRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('event_type', models.CharField(max_length=32)),
+                ('events', models.IntegerField(default=0, help_text='The number of events, with or without a value.')),
+                ('count', models.IntegerField(default=0, help_text='The number of events with a value.')),
+                ('value_sum', models.FloatField(default=0)),
+                ('value_min', models.FloatField(null=True)),
+                ('value_max', models.FloatField(null=True)),
+                ('sketch', jsonfield.fields.JSONField(blank=True, default=dict, help_text='A histogram of the values in logarithmic buckets, for estimating percentiles.')),
+                ('last_event_id', models.IntegerField(db_index=True, default=0, help_text='The largest InstrumentationEvent id folded into this rollup.')),
+                ('module', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='guidedmodules.Module')),
+                ('question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='guidedmodules.ModuleQuestion')),
+            ],
+            options={
+                'index_together': {('event_type', 'day')},
+            },
+        ),
+    ]
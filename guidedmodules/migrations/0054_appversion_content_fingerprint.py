@@ -0,0 +1,18 @@
+# Generated by Django 3.0.11 on 2026-10-18 21:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0053_instrumentationrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appversion',
+            name='content_fingerprint',
+            field=models.CharField(blank=True, help_text="A hash of the app's files when it was last loaded from its AppSource, used to skip reloading an app that has not changed.", max_length=64, null=True),
+        ),
+    ]
@@ -5,15 +5,21 @@ from django.conf import settings
 from jsonfield import JSONField
 from copy import deepcopy
 from collections import OrderedDict
+from contextlib import contextmanager
+import threading
 import uuid
 
 from .module_logic import ModuleAnswers, render_content
 from .answer_validation import validator
 from siteapp.models import User, Organization, Project, ProjectMembership
+from siteapp import authz_cache
 from guardian.shortcuts import (assign_perm, get_objects_for_user,
                                 get_perms_for_model, get_user_perms,
                                 get_users_with_perms, remove_perm)
 
+# Tasks whose state clearing is deferred; see Task.deferred_clear_state.
+_deferred_clear_state = threading.local()
+
 
 class AppSource(models.Model):
     is_system_source = models.BooleanField(default=False, help_text="This field is set to True for a single AppSource that holds the system modules such as user profiles.")
@@ -91,11 +97,11 @@ class AppSource(models.Model):
             # try and render widget displaying available apps
             return
 
-    def add_app_to_catalog(self, appname):
+    def add_app_to_catalog(self, appname, workers=1):
         from .app_loading import load_app_into_database
         with self.open() as conn:
             app = conn.get_app(appname)
-            appver = load_app_into_database(app)
+            appver = load_app_into_database(app, workers=workers)
             appver.show_in_catalog = True
             appver.save()
         return appver
@@ -115,6 +121,7 @@ class AppVersion(models.Model):
     asset_files = models.ManyToManyField('guidedmodules.ModuleAsset', help_text="The assets linked to this pack.")
     asset_paths = JSONField(help_text="A dictionary mapping file paths to the content_hashes of assets included in the assets field of this instance.")
     trust_assets = models.BooleanField(default=False, help_text="Are assets trusted? Assets include Javascript that will be served on our domain, Python code included with Modules, and Jinja2 templates in Modules.")
+    content_fingerprint = models.CharField(blank=True, null=True, max_length=64, help_text="A hash of the app's files when it was last loaded from its AppSource, used to skip reloading an app that has not changed.")
 
     show_in_catalog = models.BooleanField(default=False, help_text='Whether to show this AppVersion in the compliane app catalog, which allows users to start the app.')
 
@@ -613,7 +620,8 @@ class Task(models.Model):
         task = Task.objects.create(**kwargs)
 
         # Add instrumentation event.
-        InstrumentationEvent.objects.create(
+        from . import instrumentation
+        instrumentation.record(
             user=kwargs["editor"],
             event_type="task-create",
             module=task.module,
@@ -689,7 +697,7 @@ class Task(models.Model):
             (TaskAnswerHistory.objects
                 .filter(taskanswer__task__in=tasks)
                 .order_by('-id')
-                .select_related('taskanswer', 'taskanswer__task', 'taskanswer__question', 'answered_by')
+                .select_related('taskanswer', 'taskanswer__task', 'taskanswer__task__module', 'taskanswer__question', 'answered_by')
                 .prefetch_related('answered_by_task')
                 .prefetch_related("answered_by_task__module__app__source")
                 .prefetch_related("answered_by_task__module__questions")):\
@@ -703,7 +711,7 @@ class Task(models.Model):
         for task in tasks:
             for question in questions:
                 # Skip if this question is not for this task.
-                if question.module != task.module: continue
+                if question.module_id != task.module_id: continue
 
                 # Get the latest TaskAnswerHistory instance, if there is any.
                 answer = current_answers.get((task, question), None)
@@ -721,11 +729,14 @@ class Task(models.Model):
             Task.get_all_current_answer_records([self]):
             yield (question, answer)
 
-    def get_answers(self):
+    def get_answers(self, answer_records=None):
         # Return a ModuleAnswers instance that wraps this Task and its Pythonic answer values.
         # The dict of answers is ordered to preserve the question definition order.
+        # answer_records can be the already-loaded output of get_current_answer_records.
         answertuples = OrderedDict()
-        for q, a in self.get_current_answer_records():
+        if answer_records is None:
+            answer_records = self.get_current_answer_records()
+        for q, a in answer_records:
             # Get the value of that answer.
             if a is not None:
                 is_answered = True
@@ -846,8 +857,14 @@ class Task(models.Model):
     #   based on project-level information because most Tasks might not peek
     #   up and Tasks that don't do not need to have their cached_state cleared
     #   in this case.
+    # Inside a deferred_clear_state block, the Tasks are only collected.
     @staticmethod
     def clear_state(tasks):
+        pending = getattr(_deferred_clear_state, "tasks", None)
+        if pending is not None:
+            pending.update(tasks)
+            return
+
         tasks = set(tasks)
         target_tasks = tasks
         while target_tasks:
@@ -879,6 +896,27 @@ class Task(models.Model):
         tasks_qs = Task.objects.filter(id__in={ t.id for t in tasks })
         tasks_qs.update(cached_state=None, updated=timezone.now())
 
+    # Batch the clearing of cached_state when many answers change in a row,
+    # e.g. during imports. Inside this block, the Tasks given to clear_state
+    # are collected, and they are cleared together, so that each project's
+    # Tasks are cleared once, when the outermost block exits or, if it is
+    # inside a transaction, when the transaction is committed. Cached state
+    # read inside the block may be out of date.
+    @staticmethod
+    @contextmanager
+    def deferred_clear_state():
+        if getattr(_deferred_clear_state, "tasks", None) is not None:
+            # The outermost block clears the state.
+            yield
+            return
+        tasks = _deferred_clear_state.tasks = set()
+        try:
+            yield
+        finally:
+            _deferred_clear_state.tasks = None
+            if tasks:
+                transaction.on_commit(lambda : Task.clear_state(tasks))
+
 
     def get_status_display(self):
         # Is this task done?
@@ -898,70 +936,131 @@ class Task(models.Model):
             ).distinct()
 
         if recursive:
-            # Add in all tasks that these tasks refer to via answers to questions.
+            # Add in all tasks that these tasks refer to via current answers to questions.
             # (Including tasks in the same project because those may reference
             # other tasks in other projects with different access levels.)
-            seen_task_ids = set(t.id for t in tasks)
-            tasks1 = tasks
-            while len(tasks1) > 0:
-                # Collect all of the tasks referenced by the last batch as answers,
-                # except ones we've already seen.
-                tasks2 = set()
-                for t in tasks1:
-                    for q, a in t.get_current_answer_records():
-                        if a:
-                            tasks2 |= set(a.answered_by_task.all())
-                tasks2_ids = set(tt.id for tt in tasks2)
-                seen_task_ids |= tasks2_ids
-                tasks |= Task.objects.filter(id__in=tasks2_ids).distinct()
-                tasks1 = tasks2
+            tasks = Task.objects.filter(
+                id__in=Task.get_referenced_task_closure(tasks),
+                deleted_at=None)
 
         return tasks
 
+    # Task IDs are seeded from a subquery and expanded by following the
+    # answered_by_task links of the current, uncleared answer to each question.
+    # UNION (rather than UNION ALL) stops at tasks that have already been seen.
+    REFERENCED_TASK_CLOSURE_SQL = """
+        WITH RECURSIVE closure(id) AS (
+            SELECT seed.id FROM ({seed}) seed
+            UNION
+            SELECT m.task_id
+            FROM closure
+            JOIN {taskanswer} ta ON ta.task_id = closure.id
+            JOIN {taskanswerhistory} h ON h.taskanswer_id = ta.id
+            JOIN {answered_by_task} m ON m.taskanswerhistory_id = h.id
+            WHERE h.cleared = %s
+            AND h.id = (SELECT MAX(h2.id) FROM {taskanswerhistory} h2 WHERE h2.taskanswer_id = ta.id)
+        )
+        SELECT id FROM closure"""
+
+    @staticmethod
+    def get_referenced_task_closure(tasks):
+        # Return the IDs of the tasks in the queryset tasks plus all tasks that
+        # they refer to via current answers to questions, recursively, in a form
+        # that can be passed to an id__in filter. Where the database supports
+        # recursive common table expressions, this is a subquery computed by the
+        # database. Otherwise it's a set of IDs computed with one query per level
+        # of references.
+        from django.db import connection
+        from django.db.models import Max
+        if connection.vendor in ("postgresql", "sqlite"):
+            from django.db.models.expressions import RawSQL
+            seed_sql, seed_params = tasks.order_by().values("id").query.sql_with_params()
+            sql = Task.REFERENCED_TASK_CLOSURE_SQL.format(
+                seed=seed_sql,
+                taskanswer=TaskAnswer._meta.db_table,
+                taskanswerhistory=TaskAnswerHistory._meta.db_table,
+                answered_by_task=TaskAnswerHistory.answered_by_task.through._meta.db_table)
+            return RawSQL(sql, tuple(seed_params) + (False,))
+
+        task_ids = set(tasks.values_list("id", flat=True))
+        search_task_ids = task_ids
+        while search_task_ids:
+            current_answers = TaskAnswer.objects.filter(task_id__in=search_task_ids)\
+                .annotate(current_answer_id=Max("answer_history__id"))\
+                .values("current_answer_id")
+            referenced_task_ids = set(TaskAnswerHistory.answered_by_task.through.objects
+                .filter(taskanswerhistory_id__in=current_answers, taskanswerhistory__cleared=False)
+                .values_list("task_id", flat=True))
+            search_task_ids = referenced_task_ids - task_ids
+            task_ids |= referenced_task_ids
+        return task_ids
+
     def get_access_level(self, user, allow_access_to_deleted=False, recursive=True):
         # symmetric with get_all_tasks_readable_by
         if self.deleted_at and not allow_access_to_deleted:
             return False
-        if self.editor == user:
+        return authz_cache.cached(("task_access", self.id, authz_cache.user_key(user), recursive),
+                                  lambda : self._get_access_level(user, recursive))
+
+    def _get_access_level(self, user, recursive):
+        if self.editor_id == authz_cache.user_key(user):
             # The editor.
             return "WRITE"
-        if ProjectMembership.objects.filter(project=self.project, user=user).exists():
+        if ProjectMembership.objects.filter(project_id=self.project_id, user=user).exists():
             # All project members have read-write access to the tasks in that projectget.
             return "WRITE"
 
         if recursive:
             # Access also comes from access to any Task that refers to this Task as a
-            # *current* answer to the question. First fetch all tasks that refer to this
-            # task, and then filter to see if the answer is current. Include Tasks in
-            # the same project because they may in turn be answers to tasks in other
-            # projects. Expand this out recursively.
-            parent_tasks = set()
-            search_tasks = [self]
-            while len(search_tasks) > 0:
-                ptasks = set(
-                    tah.taskanswer.task
-                    for tah in TaskAnswerHistory.objects
-                        .filter(answered_by_task__in=search_tasks)
-                        .exclude(taskanswer__task__id__in=[t.id for t in parent_tasks])
-                        .select_related("taskanswer__task")
-                    if tah.is_latest())
-                parent_tasks |= ptasks
-                search_tasks = ptasks
-
-            access_levels = set(t.get_access_level(user, recursive=False) for t in parent_tasks)
-            if "WRITE" in access_levels:
+            # *current* answer to the question, recursively. The non-recursive access
+            # level of those tasks is checked for all of them in one query.
+            parent_task_ids = self.get_referring_task_ids()
+            if parent_task_ids and Task.objects.filter(
+                    models.Q(editor=user) | models.Q(project__members__user=user),
+                    id__in=parent_task_ids,
+                    deleted_at=None).exists():
                 return "WRITE"
-            if "READ" in access_levels:
-                return "READ"
 
         return None
 
+    def get_referring_task_ids(self):
+        # Return the set of IDs of the Tasks that refer to this Task as a *current*
+        # answer to a question, and of the Tasks that refer to those, and so on.
+        # Include Tasks in the same project because they may in turn be answers to
+        # tasks in other projects. This doesn't depend on the user, so it is shared
+        # by every privilege check on this Task in a request.
+        return authz_cache.cached(("task_referrers", self.id), self._get_referring_task_ids)
+
+    def _get_referring_task_ids(self):
+        from django.db.models import Max
+        parent_task_ids = set()
+        search_task_ids = { self.id }
+        while search_task_ids:
+            # Fetch the answers that refer to the last batch of tasks along with
+            # the ID of the current answer to the same question, so that old
+            # answers can be skipped without a query for each one.
+            ptask_ids = set(
+                task_id
+                for ansh_id, current_ansh_id, task_id in TaskAnswerHistory.objects
+                    .filter(answered_by_task__in=search_task_ids)
+                    .exclude(taskanswer__task__id__in=parent_task_ids)
+                    .annotate(current_ansh_id=Max('taskanswer__answer_history__id'))
+                    .values_list('id', 'current_ansh_id', 'taskanswer__task_id')
+                if ansh_id == current_ansh_id)
+            search_task_ids = ptask_ids - parent_task_ids
+            parent_task_ids |= ptask_ids
+        return parent_task_ids
+
     def has_read_priv(self, user, allow_access_to_deleted=False):
-        return self.get_access_level(user, allow_access_to_deleted=allow_access_to_deleted) in ("READ", "WRITE") or self.project.has_read_priv(user)
+        return authz_cache.cached(("task_read", self.id, authz_cache.user_key(user), allow_access_to_deleted),
+            lambda : self.get_access_level(user, allow_access_to_deleted=allow_access_to_deleted) in ("READ", "WRITE") or self.project.has_read_priv(user))
 
     def has_write_priv(self, user, allow_access_to_deleted=False):
         """Return True if user has write privilege on task"""
+        return authz_cache.cached(("task_write", self.id, authz_cache.user_key(user), allow_access_to_deleted),
+            lambda : self._has_write_priv(user, allow_access_to_deleted))
 
+    def _has_write_priv(self, user, allow_access_to_deleted):
         # Deny write privilege to users with ONLY view_project permission
         project_user_permissions = get_user_perms(user, self.project)
         if len(project_user_permissions) == 1 and user.has_perm('view_project', self.project):
@@ -1125,7 +1224,7 @@ class Task(models.Model):
             answers = self.get_answers()
         return answers.render_output(use_data_urls=use_data_urls)
 
-    def download_output_document(self, document_id, download_format, answers=None):
+    def download_output_document(self, document_id, download_format, answers=None, documents=None):
         # Map output format to:
         # 1) pandoc format name
         # 2) typical file extension
@@ -1153,11 +1252,12 @@ class Task(models.Model):
 
         pandoc_format, file_extension, mime_type = format_opts[download_format]
 
-        # Lazy-render the output documents. Use data: URLs so all
-        # assets are embedded.
+        # Lazy-render the output documents, unless the caller already
+        # rendered them. Use data: URLs so all assets are embedded.
 
-        documents = self.render_output_documents(answers=answers,
-                                                 use_data_urls=True)
+        if documents is None:
+            documents = self.render_output_documents(answers=answers,
+                                                     use_data_urls=True)
 
         # Find the document with the named id, if id is a string, or
         # by index if id is an integer.
@@ -1436,8 +1536,9 @@ class Task(models.Model):
             # Create a dict holding the user-entered and imputed answers to
             # questions in this task.
             ret = OrderedDict()
-            answers = self.get_answers().with_extended_info()
-            for q, a in self.get_current_answer_records():
+            answer_records = serializer.get_answer_records(self)
+            answers = self.get_answers(answer_records).with_extended_info()
+            for q, a in answer_records:
                 if q.key in answers.was_imputed:
                     # This was imputed. Ignore any user answer and serialize
                     # with a dummy TaskAnswerHistory.
@@ -1677,7 +1778,9 @@ class TaskAnswer(models.Model):
         # display different text.
         import html
         is_cleared = True
-        for i, answer in enumerate(self.answer_history.order_by('id')):
+        answers = list(self.answer_history.order_by('id').select_related('answered_by'))
+        User.preload_profiles([answer.answered_by for answer in answers])
+        for i, answer in enumerate(answers):
             if answer.cleared:
                 vp = "cleared the answer"
                 is_cleared = True
@@ -1770,32 +1873,9 @@ class TaskAnswer(models.Model):
         current_answer = self.get_current_answer()
 
         # Check if the answer is changing. If not, return False.
-
-        def read_file(f):
-            f.open()
-            try:
-                return f.read()
-            finally:
-                f.close()
-
-        def are_files_same():
-            if answered_by_file is None and current_answer.answered_by_file.name == "":
-                # No files in either case -- so the file field is the same.
-                return True
-            if answered_by_file is None or current_answer.answered_by_file.name == "":
-                # One but not both are null, so there is a change.
-                return False
-            # Both have content -- check if the content matches.
-            return read_file(answered_by_file) == current_answer.answered_by_file.read()
-
         value_encoding = None
-        if current_answer and not current_answer.cleared \
-            and value == current_answer.stored_value \
-            and value_encoding == current_answer.stored_encoding \
-            and set(answered_by_tasks) == set(current_answer.answered_by_task.all()) \
-            and are_files_same() \
-            and skipped_reason == current_answer.skipped_reason \
-            and unsure == current_answer.unsure:
+        if current_answer and current_answer.is_same_answer(value, value_encoding,
+            answered_by_tasks, answered_by_file, skipped_reason, unsure):
             return False
 
         # The answer is new or changing. Create a new record for it.
@@ -1819,6 +1899,97 @@ class TaskAnswer(models.Model):
         # Return True to indicate we saved something.
         return True
 
+    @staticmethod
+    def save_answers(answers, user, method):
+        # Save many answers at once. answers is a list of (Task, ModuleQuestion,
+        # value, answered_by_tasks, answered_by_file) tuples, which are saved as
+        # save_answer would save them, except that the current answers are
+        # compared in one query, the changed answers are inserted in bulk in a
+        # single transaction, and the Tasks' states are cleared once at the end.
+        # Returns a list of whether each answer was changed. If the same question
+        # is given more than once, only the last answer is saved.
+        from django.db import connection
+        if not answers:
+            return []
+        with Task.deferred_clear_state(), transaction.atomic():
+            # Get or create the TaskAnswers.
+            keys = { (task.id, question.id) for task, question, *_ in answers }
+            def get_taskanswers():
+                return {
+                    (ta.task_id, ta.question_id): ta
+                    for ta in TaskAnswer.objects.filter(
+                        task__in={ key[0] for key in keys },
+                        question__in={ key[1] for key in keys })
+                    if (ta.task_id, ta.question_id) in keys
+                }
+            taskanswers = get_taskanswers()
+            if len(taskanswers) < len(keys):
+                TaskAnswer.objects.bulk_create([
+                    TaskAnswer(task_id=task_id, question_id=question_id)
+                    for task_id, question_id in keys - set(taskanswers)
+                ], ignore_conflicts=True)
+                taskanswers = get_taskanswers()
+
+            # Get the current answers in one query.
+            current_answers = {
+                ans.taskanswer_id: ans
+                for ans in TaskAnswerHistory.objects.filter(id__in=models.Subquery(
+                        TaskAnswerHistory.objects
+                            .filter(taskanswer__in=taskanswers.values())
+                            .order_by().values('taskanswer')
+                            .annotate(current_answer_id=models.Max('id'))
+                            .values('current_answer_id')))
+                    .prefetch_related('answered_by_task')
+            }
+
+            # Make new TaskAnswerHistory records for the answers that are changing.
+            last = { (task.id, question.id): i for i, (task, question, *_) in enumerate(answers) }
+            ret = [False] * len(answers)
+            new_answers = []
+            changed_tasks = set()
+            for i, (task, question, value, answered_by_tasks, answered_by_file) in enumerate(answers):
+                if last[(task.id, question.id)] != i:
+                    continue
+                taskanswer = taskanswers[(task.id, question.id)]
+                current_answer = current_answers.get(taskanswer.id)
+                if current_answer and current_answer.is_same_answer(value, None,
+                    answered_by_tasks, answered_by_file, None, False):
+                    continue
+                new_answers.append((TaskAnswerHistory(
+                    taskanswer=taskanswer,
+                    answered_by=user,
+                    answered_by_method=method,
+                    stored_value=value,
+                    answered_by_file=answered_by_file), answered_by_tasks))
+                changed_tasks.add(task)
+                ret[i] = True
+            if not new_answers:
+                return ret
+
+            # Insert them. Answers with sub-tasks need their IDs to add the
+            # sub-tasks, so if the database can't return the IDs of rows
+            # inserted in bulk, insert those one at a time.
+            if connection.features.can_return_rows_from_bulk_insert:
+                TaskAnswerHistory.objects.bulk_create([answer for answer, tasks in new_answers])
+            else:
+                TaskAnswerHistory.objects.bulk_create([answer for answer, tasks in new_answers if not tasks])
+                for answer, tasks in new_answers:
+                    if tasks:
+                        answer.save()
+            TaskAnswerHistory.answered_by_task.through.objects.bulk_create([
+                TaskAnswerHistory.answered_by_task.through(taskanswerhistory_id=answer.id, task_id=t.id)
+                for answer, tasks in new_answers
+                for t in tasks
+            ])
+
+            # Bulk inserts don't send the signals that clear the authorization
+            # cache, so clear it here, and let the Tasks know that their
+            # answers have changed (once the transaction is committed).
+            authz_cache.clear()
+            Task.clear_state(changed_tasks)
+
+        return ret
+
     # required to attach a Discussion to it
     @property
     def title(self):
@@ -1868,6 +2039,19 @@ class TaskAnswer(models.Model):
                 return "project member"
         return None
 
+    # required to attach a Discussion to it
+    def get_user_roles(self, users):
+        # Like get_user_role but for many users at once, returning a dict
+        # from user IDs to roles for the users that have one.
+        roles = { }
+        for mbr in ProjectMembership.objects.filter(
+            project=self.task.project,
+            user__in=users):
+            roles[mbr.user_id] = "team admin" if mbr.is_admin else "project member"
+        if self.task.editor_id in { u.id for u in users }:
+            roles[self.task.editor_id] = "editor"
+        return roles
+
     # required to attach a Discussion to it
     def can_invite_guests(self, user):
         return ProjectMembership.objects.filter(project=self.task.project, user=user).exists()
@@ -1878,33 +2062,16 @@ class TaskAnswer(models.Model):
 
     # required to attach a Discussion to it
     def get_discussion_autocompletes(self, discussion):
-        # Get a list of all users who can be @-mentioned. It includes the discussion
-        # participants (i.e. people working on the same project and disussion guests)
-        # plus anyone in the same organization.
-        organization = self.task.project.organization
-        mentionable_users = set(discussion.get_all_participants()) \
-                          | set(User.objects.filter(projectmembership__project__organization=self.task.project.organization).distinct())
-        User.preload_profiles(mentionable_users)
-        return {
-            # @-mention participants in the discussion and other
-            # users in mentionable_users.
-            "@": [
-                {
-                    "user_id": user.id,
-                    "tag": user.username,
-                    "display": user.render_context_dict()["name"],
-                }
-                for user in mentionable_users
-            ],
-
-            # #-mention Organization-defined terms
-            "#": [
-                {
-                    "tag": term,
-                }
-                for term in organization.extra.get("vocabulary", [])
-            ]
-        }
+        # Get the MentionIndexes of all users who can be @-mentioned and the terms
+        # that can be #-mentioned. They include the discussion participants (i.e.
+        # people working on the same project and disussion guests) plus anyone in
+        # the same organization and the Organization-defined terms, which are
+        # indexed once for the whole organization.
+        from discussion import mentions
+        return [
+            mentions.build_user_index(discussion.get_all_participants()),
+            mentions.get_organization_index(self.task.project.organization),
+        ]
 
     # required to attach a Discussion to it
     def on_discussion_comment(self, comment):
@@ -1966,10 +2133,46 @@ class TaskAnswerHistory(models.Model):
         # For debugging.
         return "<TaskAnswerHistory %s>" % (repr(self.taskanswer),)
 
+    def is_same_answer(self, value, value_encoding, answered_by_tasks, answered_by_file, skipped_reason, unsure):
+        # Would saving this answer leave this answer unchanged? See TaskAnswer.save_answer.
+        def read_file(f):
+            f.open()
+            try:
+                return f.read()
+            finally:
+                f.close()
+
+        def are_files_same():
+            if answered_by_file is None and self.answered_by_file.name == "":
+                # No files in either case -- so the file field is the same.
+                return True
+            if answered_by_file is None or self.answered_by_file.name == "":
+                # One but not both are null, so there is a change.
+                return False
+            # Both have content -- check if the content matches.
+            return read_file(answered_by_file) == self.answered_by_file.read()
+
+        return not self.cleared \
+            and value == self.stored_value \
+            and value_encoding == self.stored_encoding \
+            and set(answered_by_tasks) == set(self.answered_by_task.all()) \
+            and are_files_same() \
+            and skipped_reason == self.skipped_reason \
+            and unsure == self.unsure
+
     def is_latest(self):
         # Is this the most recent --- the current --- answer for a TaskAnswer.
         return self.taskanswer.get_current_answer() == self
 
+    def get_file_fingerprint(self):
+        # Return a short fingerprint of the file that answers this question
+        # that changes whenever a new file is uploaded. It is computed from
+        # the answer ID and the stored file name without reading the file,
+        # keyed with the SECRET_KEY so that it can't be guessed.
+        from django.utils.crypto import salted_hmac
+        payload = "%d|%s" % (self.id, self.answered_by_file.name)
+        return salted_hmac("guidedmodules.TaskAnswerHistory.get_file_fingerprint", payload).hexdigest()
+
     def is_skipped(self):
         # A skipped question is one whose answer is None,
         # except for interstitial questions where a None
@@ -1977,7 +2180,9 @@ class TaskAnswerHistory(models.Model):
         if self.taskanswer.question.spec['type'] == "interstitial": return False
         return (self.get_value() is None)
 
-    def get_value(self):
+    def get_value(self, file_dataurls=True):
+        # If file_dataurls is False, the content_dataurl and thumbnail_dataurl
+        # of "file" answers are None so that images are not decoded.
         if self.cleared:
             raise RuntimeError("get_value cannot be called on a cleared answer")
 
@@ -2055,7 +2260,7 @@ class TaskAnswerHistory(models.Model):
 
             # Convert it to a data URL so that it can be rendered in exported documents.
             content_dataurl = None
-            if q.spec.get("file-type") == "image":
+            if q.spec.get("file-type") == "image" and file_dataurls:
                 content_dataurl = image_to_dataurl(self.answered_by_file, 640)
 
             # Construct a thumbnail and a URL to it.
@@ -2102,7 +2307,8 @@ class TaskAnswerHistory(models.Model):
             if self.thumbnail:
                 # If we have a thumbnail, indicate so by returning a URL to it.
                 thumbnail_url = url + "?thumbnail=1"
-                thumbnail_dataurl = image_to_dataurl(self.thumbnail, 640)
+                if file_dataurls:
+                    thumbnail_dataurl = image_to_dataurl(self.thumbnail, 640)
 
             return {
                 "url": url,
@@ -2171,10 +2377,8 @@ class TaskAnswerHistory(models.Model):
                 # Add the file content to it. It's other important field is 'type' which
                 # holds the MIME type.
                 if serializer.include_file_content:
-                    import re
-                    from base64 import b64encode
                     value.update({
-                        "content": re.findall(".{1,64}", b64encode(self.answered_by_file.read()).decode("ascii")),
+                        "content": serializer.serialize_file(self.answered_by_file),
                     })
 
             else:
@@ -2338,7 +2542,7 @@ class TaskAnswerHistory(models.Model):
 class InstrumentationEvent(models.Model):
     user = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL)
 
-    event_time = models.DateTimeField(auto_now_add=True, db_index=True)
+    event_time = models.DateTimeField(default=timezone.now, db_index=True) # set when recorded, not when written; see instrumentation.py
     event_type = models.CharField(max_length=32)
     event_value = models.FloatField(null=True)
 
@@ -2357,6 +2561,30 @@ class InstrumentationEvent(models.Model):
             ('module', 'event_type', 'event_time'),
         ]
 
+class InstrumentationRollup(models.Model):
+    # Daily aggregates of InstrumentationEvents, maintained incrementally
+    # by the rollup_instrumentation management command. The analytics
+    # dashboard reads only these so that raw events can be pruned. See
+    # guidedmodules/analytics.py.
+    day = models.DateField()
+    event_type = models.CharField(max_length=32)
+    module = models.ForeignKey(Module, blank=True, null=True, on_delete=models.SET_NULL)
+    question = models.ForeignKey(ModuleQuestion, blank=True, null=True, on_delete=models.SET_NULL)
+
+    events = models.IntegerField(default=0, help_text="The number of events, with or without a value.")
+    count = models.IntegerField(default=0, help_text="The number of events with a value.")
+    value_sum = models.FloatField(default=0)
+    value_min = models.FloatField(null=True)
+    value_max = models.FloatField(null=True)
+    sketch = JSONField(default=dict, blank=True, help_text="A histogram of the values in logarithmic buckets, for estimating percentiles.")
+
+    last_event_id = models.IntegerField(default=0, db_index=True, help_text="The largest InstrumentationEvent id folded into this rollup.")
+
+    class Meta:
+        index_together = [
+            ('event_type', 'day'),
+        ]
+
 def image_to_dataurl(f, size):
     from PIL import Image
     from io import BytesIO
@@ -2373,4 +2601,13 @@ def image_to_dataurl(f, size):
     im.thumbnail((size, size))
     buf = BytesIO()
     im.save(buf, "png")
-    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
\ No newline at end of file
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+# Signal receivers.
+
+# Forget memoized authorization checks when task editors or the tasks that
+# answer questions change. See siteapp/authz_cache.py.
+models.signals.post_save.connect(authz_cache.clear_on_change, sender=Task)
+models.signals.post_save.connect(authz_cache.clear_on_change, sender=TaskAnswerHistory)
+models.signals.m2m_changed.connect(authz_cache.clear_on_change, sender=TaskAnswerHistory.answered_by_task.through)
@@ -1,6 +1,14 @@
 from django.conf import settings
 from jinja2.sandbox import SandboxedEnvironment
 
+import collections
+import threading
+
+from siteapp import profiling
+
+# The number of rendered answers HtmlAnswerRenderer keeps in memory.
+ANSWER_HTML_CACHE_SIZE = 10000
+
 def get_jinja2_template_vars(template):
     from jinja2 import meta, TemplateSyntaxError
     env = SandboxedEnvironment()
@@ -92,6 +100,7 @@ def walk_module_questions(module, callback):
         walk_question(q, [])
 
 
+@profiling.timed("evaluate_module_state")
 def evaluate_module_state(current_answers, parent_context=None):
     # Compute the next question to ask the user, given the user's
     # answers to questions so far, and all imputed answers up to
@@ -283,6 +292,7 @@ def get_question_context(answers, question):
     return context_sorted
 
 
+@profiling.timed("render_content")
 def render_content(content, answers, output_format, source,
                    additional_context={}, demote_headings=True,
                    show_answer_metadata=False, use_data_urls=False,
@@ -746,10 +756,45 @@ def render_content(content, answers, output_format, source,
 
 
 class HtmlAnswerRenderer:
+    # The HTML of answers that users gave is cached in memory, evicting the
+    # least recently used, since TaskAnswerHistory records don't change once
+    # they're saved. It's keyed by the record, the question (which is
+    # updated if its module is reloaded), and a hash of the value being
+    # rendered, since templates render answers in several ways. The metadata
+    # that show_metadata adds includes the answer's review state, which can
+    # change, so it isn't cached. Nor is HTML rendered with use_data_urls,
+    # which embeds whole images, so the cache's size is bounded by its count.
+    cache = collections.OrderedDict()
+    cache_lock = threading.Lock()
+
     def __init__(self, show_metadata, use_data_urls=False):
         self.show_metadata = show_metadata
         self.use_data_urls = use_data_urls
+
     def __call__(self, question, task, has_answer, answerobj, value):
+        if question is not None and question.id is not None \
+          and answerobj is not None and answerobj.id is not None \
+          and not self.use_data_urls:
+            import xxhash
+            key = (answerobj.id, question.id, question.updated,
+                   xxhash.xxh64(str(value).encode("utf8")).digest())
+            with self.cache_lock:
+                rendered = self.cache.get(key)
+                if rendered is not None:
+                    self.cache.move_to_end(key)
+            profiling.count("answer_html_cache." + ("miss" if rendered is None else "hit"))
+            if rendered is None:
+                rendered = self.render_value(question, answerobj, value)
+                with self.cache_lock:
+                    self.cache[key] = rendered
+                    while len(self.cache) > ANSWER_HTML_CACHE_SIZE:
+                        self.cache.popitem(last=False)
+        else:
+            rendered = self.render_value(question, answerobj, value)
+        return self.add_metadata(question, task, has_answer, answerobj, *rendered)
+
+    def render_value(self, question, answerobj, value):
+        # Returns the HTML of the value and the tag to wrap it in.
         import html
 
         if question is not None and question.spec["type"] == "longtext":
@@ -866,6 +911,11 @@ class HtmlAnswerRenderer:
             value = html.escape(str(value))
             wrappertag = "span"
 
+        return (value, wrappertag)
+
+    def add_metadata(self, question, task, has_answer, answerobj, value, wrappertag):
+        import html
+
         if (not self.show_metadata) or (question is None):
             return value
 
@@ -1030,6 +1080,7 @@ def compile_jinja2_expression(expr):
     # Return it.
     return compiled
 
+@profiling.timed("run_impute_conditions")
 def run_impute_conditions(conditions, context):
     # Check if any of the impute conditions are met based on
     # the questions that have been answered so far and return
@@ -1082,10 +1133,18 @@ def run_impute_conditions(conditions, context):
 
 
 def get_question_choice(question, key):
-    for choice in question.spec["choices"]:
-        if choice["key"] == key:
-            return choice
-    raise KeyError(repr(key) + " is not a choice")
+    # Look the choice up in a mapping from keys to choices that is made once
+    # per question (and again if its spec is replaced).
+    choices = getattr(question, "_choices_by_key", None)
+    if choices is None or choices[0] is not question.spec:
+        choices = (question.spec, { })
+        for choice in question.spec["choices"]:
+            choices[1].setdefault(choice["key"], choice)
+        question._choices_by_key = choices
+    try:
+        return choices[1][key]
+    except (KeyError, TypeError):
+        raise KeyError(repr(key) + " is not a choice")
 
 class ModuleAnswers(object):
     """Represents a set of answers to a Task."""
@@ -1142,27 +1201,32 @@ class ModuleAnswers(object):
                 else:
                     value_display = "<i>skipped</i>"
             else:
-                # Use the template rendering system to produce a human-readable
-                # HTML rendering of the value.
-                value_display = RenderedAnswer(self.task, q, is_answered, a, value, tc)
-                
-                # For question types whose primary value is machine-readable,
-                # show a nice display form if possible using the .text attribute,
-                # if possible. It probably returns a SafeString which needs __html__()
-                # to be called on it. "file" questions render nicer without .text.
-                if q.spec["type"] not in ("file",):
-                    try:
-                        value_display = value_display.text
-                    except AttributeError:
-                        pass
-
-                # Whether or not we called .text, call __html__() to get
-                # a rendered form.
-                if hasattr(value_display, "__html__"):
-                    value_display = value_display.__html__()
+                value_display = self.render_answer_html(q, is_answered, a, value, tc)
 
             yield (q, a, value_display)
 
+    def render_answer_html(self, q, is_answered, a, value, tc):
+        # Use the template rendering system to produce a human-readable
+        # HTML rendering of the value.
+        value_display = RenderedAnswer(self.task, q, is_answered, a, value, tc)
+
+        # For question types whose primary value is machine-readable,
+        # show a nice display form if possible using the .text attribute,
+        # if possible. It probably returns a SafeString which needs __html__()
+        # to be called on it. "file" questions render nicer without .text.
+        if q.spec["type"] not in ("file",):
+            try:
+                value_display = value_display.text
+            except AttributeError:
+                pass
+
+        # Whether or not we called .text, call __html__() to get
+        # a rendered form.
+        if hasattr(value_display, "__html__"):
+            value_display = value_display.__html__()
+
+        return value_display
+
     def render_output(self, use_data_urls=False):
         # Now that all questions have been answered, generate this
         # module's output. The output is a set of documents. The
@@ -1236,6 +1300,11 @@ class ModuleAnswers(object):
                 if entry in self.output_formats or entry in self.document:
                     return self[entry]
 
+            def render(self, *entries):
+                # Render the given output formats now rather than when they
+                # are first used, and return them.
+                return [self[entry] for entry in entries]
+
         return [ LazyRenderedDocument(self, d, i, use_data_urls) for i, d in enumerate(self.module.spec.get("output", [])) ]
 
 
@@ -2,6 +2,7 @@ from django.contrib.auth.models import Permission
 from django.db.models import Q
 from django.test import TestCase
 from siteapp.models import Organization, Project, User
+from siteapp.project_json import JSONStreamParser, Serializer
 from .app_loading import load_app_into_database
 from .models import Module, Task, AppVersion
 from .module_logic import *
@@ -664,13 +665,433 @@ class RenderTests(TestCaseWithFixtureData):
             expected_impute_value = expected
         self.assertEqual(actual, expected_impute_value, msg="impute value expression %s" % expression)
 
+class AuthzTests(TestCaseWithFixtureData):
+    ## TASK PRIVILEGE TESTS ##
+
+    def test_access_through_referring_task(self):
+        from siteapp import authz_cache
+        from .models import TaskAnswer
+
+        # Another user's project whose root task will be answered by a task in self.project.
+        other_user = User.objects.create(username="other.unit.test", email='other@example.org')
+        stranger = User.objects.create(username="stranger.unit.test", email='stranger@example.org')
+        other_project = Project.objects.create(organization=self.organization)
+        other_project.root_task = Task.objects.create(module=self.getModule("app"), project=other_project, editor=other_user)
+        other_project.save()
+
+        task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        self.assertEqual(task.get_access_level(self.user), "WRITE")
+        self.assertIsNone(task.get_access_level(other_user))
+
+        # Once the task answers a question in the other project, its editor gets access.
+        ta, _ = TaskAnswer.objects.get_or_create(task=other_project.root_task,
+            question=self.getModule("app").questions.get(key="simple_module"))
+        ta.save_answer(None, [task], None, other_user, "web")
+        self.assertEqual(task.get_referring_task_ids(), { other_project.root_task.id })
+        self.assertEqual(task.get_access_level(other_user), "WRITE")
+        self.assertIsNone(task.get_access_level(stranger))
+
+        # The tasks readable by the other user include the referenced task, whether
+        # the closure is computed by the database or level by level.
+        from unittest import mock
+        from django.db import connection
+        self.assertEqual(set(Task.get_all_tasks_readable_by(other_user)), { other_project.root_task })
+        self.assertEqual(set(Task.get_all_tasks_readable_by(other_user, recursive=True)), { other_project.root_task, task })
+        with mock.patch.object(connection, "vendor", "unknown"):
+            self.assertEqual(set(Task.get_all_tasks_readable_by(other_user, recursive=True)), { other_project.root_task, task })
+        self.assertTrue(self.project.has_read_priv(other_user))
+
+        # Checks are memoized within a scope and forgotten when answers change.
+        with authz_cache.scope():
+            self.assertEqual(task.get_access_level(other_user), "WRITE")
+            with self.assertNumQueries(0):
+                self.assertEqual(task.get_access_level(other_user), "WRITE")
+            ta.save_answer(None, [Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)],
+                None, other_user, "web")
+            self.assertIsNone(task.get_access_level(other_user))
+        self.assertNotIn(task, set(Task.get_all_tasks_readable_by(other_user, recursive=True)))
+
+class AnswerSavingTests(TestCaseWithFixtureData):
+
+    def test_save_answers(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import TaskAnswer
+
+        m = self.getModule("question_types_text")
+        task = Task.objects.create(module=m, project=self.project, editor=self.user)
+        questions = { q.key: q for q in m.questions.all() }
+        def save(answers):
+            with CaptureQueriesContext(connection) as queries:
+                ret = TaskAnswer.save_answers([(task, questions[key], value, [], None) for key, value in answers], self.user, "api")
+            return ret, len(queries)
+
+        # New answers are saved, unchanged answers are not, and if a question
+        # is given twice the last answer is saved.
+        self.assertEqual(save([("q_text", "a"), ("q_password", "b")])[0], [True, True])
+        self.assertEqual(save([("q_text", "a"), ("q_password", "c"), ("q_url", "x"), ("q_url", "https://www.govready.com")])[0],
+            [False, True, False, True])
+        self.assertEqual(task.get_answers().as_dict(), { "q_text": "a", "q_password": "c", "q_url": "https://www.govready.com" })
+
+        # Once the TaskAnswers exist, the number of queries doesn't depend on
+        # the number of answers.
+        keys = ("q_text", "q_text_with_default", "q_password", "q_longtext", "q_longtext_with_default")
+        save([(key, "1") for key in keys])
+        few = save([(key, "2") for key in keys[:2]])[1]
+        many = save([(key, "3") for key in keys])[1]
+        self.assertEqual(few, many)
+
+    def test_deferred_clear_state(self):
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        tasks = [Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user, cached_state={ "title": "x" })
+                 for i in range(2)]
+        def cached_states():
+            return [t.cached_state for t in Task.objects.filter(id__in=[t.id for t in tasks]).order_by('id')]
+
+        # Tasks are collected in (nested) blocks and cleared when the outer
+        # block is committed. (Test transactions are never committed, so commit
+        # right away.)
+        with mock.patch("django.db.transaction.on_commit", lambda func : func()):
+            with Task.deferred_clear_state():
+                with CaptureQueriesContext(connection) as queries:
+                    with Task.deferred_clear_state():
+                        tasks[0].on_answer_changed()
+                    tasks[1].on_answer_changed()
+                self.assertEqual(len(queries), 0)
+                self.assertEqual(cached_states(), [{ "title": "x" }] * 2)
+            self.assertEqual(cached_states(), [None, None])
+
+class AnswerReviewTests(TestCaseWithFixtureData):
+
+    def test_review_page(self):
+        from siteapp import profiling
+        from siteapp.models import Portfolio, ProjectMembership
+        from .models import TaskAnswer
+        from .module_logic import HtmlAnswerRenderer
+
+        # Start a project and answer a question in a sub-task.
+        project = Project.objects.create(organization=self.organization, portfolio=Portfolio.objects.create(title="Review"))
+        project.set_root_task(self.getModule("app"), self.user)
+        ProjectMembership.objects.create(project=project, user=self.user)
+        root_task = project.root_task
+        subtask = root_task.get_or_create_subtask(self.user, root_task.module.questions.get(key="question_types_text"))
+        TaskAnswer.save_answers([(subtask, subtask.module.questions.get(key="q_text"), "my review answer", [], None)], self.user, "api")
+
+        # The page lists the tasks without their answers.
+        self.client.force_login(self.user)
+        url = project.get_absolute_url() + "/list"
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([section["task"] for section in resp.context["sections"]], [root_task, subtask])
+        self.assertContains(resp, url + "?task=" + str(subtask.id))
+        self.assertNotContains(resp, "my review answer")
+
+        # The answers are loaded a task at a time, and are rendered once.
+        HtmlAnswerRenderer.cache.clear()
+        with profiling.profile() as p:
+            for i in range(2):
+                resp = self.client.get(url + "?task=" + str(subtask.id))
+                self.assertContains(resp, "my review answer")
+        self.assertEqual(p.counters["answer_html_cache.miss"], 1)
+        self.assertEqual(p.counters["answer_html_cache.hit"], 1)
+        self.assertEqual(self.client.get(url + "?task=0").status_code, 404)
+        self.assertEqual(self.client.get(url + "?task=x").status_code, 404)
+
+        # Tasks that the project doesn't refer to aren't sections of it.
+        other_task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        self.assertEqual(self.client.get(url + "?task=" + str(other_task.id)).status_code, 404)
+
+    def test_answer_html_cache(self):
+        from siteapp import profiling
+        from .models import TaskAnswer
+        from .module_logic import HtmlAnswerRenderer
+
+        task = Task.objects.create(module=self.getModule("question_types_text"), project=self.project, editor=self.user)
+        TaskAnswer.save_answers([(task, task.module.questions.get(key="q_text"), "<cached answer>", [], None)], self.user, "api")
+        def render():
+            return { q.key: html for q, a, html in task.get_answers().render_answers(show_unanswered=False, show_metadata=True) }
+        HtmlAnswerRenderer.cache.clear()
+
+        # The answer is rendered once, but its review state is always current.
+        with profiling.profile() as p:
+            self.assertIn("&lt;cached answer&gt;", render()["q_text"])
+            answer = TaskAnswer.objects.get(task=task, question__key="q_text").get_current_answer()
+            answer.reviewed = 1
+            answer.save()
+            self.assertIn("data-reviewed='1'", render()["q_text"])
+        self.assertEqual(p.counters["answer_html_cache.miss"], 1)
+        self.assertEqual(p.counters["answer_html_cache.hit"], 1)
+
+        # HTML with embedded data URLs isn't cached.
+        HtmlAnswerRenderer(show_metadata=False, use_data_urls=True)(answer.taskanswer.question, task, True, answer, "<cached answer>")
+        self.assertEqual(len(HtmlAnswerRenderer.cache), 1)
+
+class InstrumentationTests(TestCaseWithFixtureData):
+
+    def test_event_buffer(self):
+        from .instrumentation import EventBuffer
+        from .models import InstrumentationEvent
+
+        # Events are queued until flushed, and dropped when the queue is full.
+        buf = EventBuffer(2, 1)
+        task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        for i in range(3):
+            buf.put(InstrumentationEvent(user=self.user, event_type="task-question-show", event_value=1, task=task))
+        self.assertEqual(buf.dropped, 1)
+        self.assertFalse(InstrumentationEvent.objects.filter(event_type="task-question-show").exists())
+        buf.flush()
+        self.assertEqual(InstrumentationEvent.objects.filter(event_type="task-question-show", task=task).count(), 2)
+        self.assertEqual(buf.dropped, 0)
+
+        # If a batch can't be written, the events that can be are written one at a time.
+        buf.write([
+            InstrumentationEvent(user=self.user, event_type="task-question-answer", event_value="not a number", task=task),
+            InstrumentationEvent(user=self.user, event_type="task-question-answer", event_value=1, task=task),
+        ])
+        self.assertEqual(InstrumentationEvent.objects.filter(event_type="task-question-answer", task=task).count(), 1)
+
+    def test_record(self):
+        from unittest import mock
+        from django.db import connection
+        from django.test import override_settings
+        from .instrumentation import record
+        from .models import InstrumentationEvent
+
+        # Events are queued outside of atomic blocks and saved right away
+        # inside them (as they are in every test).
+        with override_settings(INSTRUMENTATION_BUFFER_SIZE=10), \
+             mock.patch("guidedmodules.instrumentation.get_buffer") as get_buffer:
+            with mock.patch.object(connection, "in_atomic_block", False):
+                record(user=self.user, event_type="task-question-answer", event_value=1)
+            self.assertEqual(get_buffer().put.call_count, 1)
+            record(user=self.user, event_type="task-done", event_value=1)
+            self.assertEqual(get_buffer().put.call_count, 1)
+        self.assertFalse(InstrumentationEvent.objects.filter(event_type="task-question-answer").exists())
+        self.assertTrue(InstrumentationEvent.objects.filter(event_type="task-done").exists())
+
+    def test_rollups(self):
+        import datetime
+        from django.utils import timezone
+        from .analytics import update_rollups, prune_events, summarize, sketch_add, sketch_quantile
+        from .models import InstrumentationEvent, InstrumentationRollup
+
+        # Sketches estimate percentiles within their relative accuracy.
+        sketch = { }
+        for v in range(1, 101):
+            sketch_add(sketch, v)
+        self.assertAlmostEqual(sketch_quantile(sketch, .9), 90, delta=90*.05)
+
+        module = self.getModule("simple")
+        old = timezone.now() - datetime.timedelta(days=10)
+        def add_events(values, event_time):
+            InstrumentationEvent.objects.bulk_create([
+                InstrumentationEvent(event_type="task-question-request-duration", event_value=v,
+                                     module=module, event_time=event_time, extra={})
+                for v in values ])
+
+        # Events are rolled up once and only once they have settled.
+        add_events([10, 20, 30], old)
+        add_events([40], timezone.now())
+        self.assertEqual(update_rollups(batch_size=2), 3)
+        self.assertEqual(update_rollups(), 0)
+        add_events([50], old)
+        self.assertEqual(update_rollups(), 2)
+
+        rollups = InstrumentationRollup.objects.filter(module=module)
+        self.assertEqual(rollups.count(), 2)
+        summary = summarize(rollups)
+        self.assertEqual(summary["count"], 5)
+        self.assertEqual(summary["mean"], 30)
+        self.assertEqual((summary["min"], summary["max"]), (10, 50))
+
+        # Only old events that have been rolled up are pruned.
+        add_events([60], old)
+        self.assertEqual(prune_events(5), 4)
+        self.assertEqual(list(InstrumentationEvent.objects.values_list('event_value', flat=True).order_by('event_value')), [40, 60])
+
+        # The analytics page reads the rollups.
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get("/tasks/analytics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["tables"][3]["overall"], 30)
+        self.assertEqual(response.context["tables"][3]["rows"][0]["n"], 5)
+
+        # View counts are the sums of the question view events' values.
+        task = Task.objects.create(module=module, project=self.project, editor=self.user)
+        question = module.questions.first()
+        InstrumentationEvent.objects.bulk_create([
+            InstrumentationEvent(event_type="task-question-show", event_value=1, module=module,
+                                 question=question, task=task, event_time=old, extra={})
+            for i in range(3) ])
+        update_rollups()
+        response = self.client.get("/tasks/analytics")
+        self.assertEqual(response.context["tables"][4]["overall"], 3)
+        self.assertEqual(response.context["tables"][4]["rows"][0]["value"], 3)
+
+    def test_prune_first_events(self):
+        import datetime
+        from django.utils import timezone
+        from .analytics import update_rollups, prune_events
+        from .models import InstrumentationEvent
+
+        # The first view of and interaction with a question are kept, since
+        # the time to answer and to first interaction are measured from them.
+        module = self.getModule("simple")
+        task = Task.objects.create(module=module, project=self.project, editor=self.user)
+        question = module.questions.first()
+        old = timezone.now() - datetime.timedelta(days=10)
+        for event_type in ("task-question-show", "task-question-interact-first"):
+            InstrumentationEvent.objects.bulk_create([
+                InstrumentationEvent(event_type=event_type, event_value=1, user=self.user, module=module,
+                                     question=question, task=task, event_time=old + datetime.timedelta(hours=i), extra={})
+                for i in (2, 0, 1) ])
+        update_rollups()
+        self.assertEqual(prune_events(5), 4)
+        for event_type in ("task-question-show", "task-question-interact-first"):
+            self.assertEqual(list(InstrumentationEvent.objects.filter(event_type=event_type).values_list('event_time', flat=True)), [old])
+
+class AppLoadingTests(TestCaseWithFixtureData):
+
+    def test_unchanged_app_is_skipped(self):
+        import shutil, tempfile
+        from .app_loading import AppImportUpdateMode, read_modules
+        from .models import AppSource
+
+        # Load a copy of the fixture app so that it can be modified.
+        with tempfile.TemporaryDirectory() as path:
+            shutil.copytree("fixtures/modules/other/simple_project", path + "/simple_project")
+            src = AppSource.objects.create(slug="app_loading_test", spec={ "type": "local", "path": path })
+            with src.open() as store:
+                appver = load_app_into_database(store.get_app("simple_project"))
+            self.assertEqual(len(appver.content_fingerprint), 64)
+            module = appver.modules.get(module_name="simple")
+            self.assertEqual(module.spec["title"], "A Simple Module")
+
+            # Reloading an unchanged app does nothing.
+            updated = appver.updated
+            with src.open() as store:
+                app = store.get_app("simple_project")
+                load_app_into_database(app, AppImportUpdateMode.CompatibleUpdate, appver)
+            appver.refresh_from_db()
+            self.assertEqual(appver.updated, updated)
+
+            # Modules are parsed and validated the same way in a process pool.
+            with src.open() as store:
+                app = store.get_app("simple_project")
+                files = dict(app.get_files())
+                self.assertEqual(read_modules(app, files, workers=2), read_modules(app, files, workers=1))
+
+                # But not unless asked for, as in web requests.
+                from unittest import mock
+                with mock.patch("guidedmodules.app_loading.PARALLEL_MIN_MODULES", 1), \
+                     mock.patch("guidedmodules.app_loading.ProcessPoolExecutor") as pool:
+                    read_modules(app, files)
+                pool.assert_not_called()
+
+            # Changes to the app are loaded.
+            with open(path + "/simple_project/simple.yaml") as f:
+                yaml = f.read()
+            with open(path + "/simple_project/simple.yaml", "w") as f:
+                f.write(yaml.replace("A Simple Module", "A Changed Module"))
+            fingerprint = appver.content_fingerprint
+            with src.open() as store:
+                load_app_into_database(store.get_app("simple_project"), AppImportUpdateMode.CompatibleUpdate, appver)
+            self.assertNotEqual(appver.content_fingerprint, fingerprint)
+            module.refresh_from_db()
+            self.assertEqual(module.spec["title"], "A Changed Module")
+
+    def test_git_cache(self):
+        import os, shutil, subprocess, tempfile
+        from django.test import override_settings
+        from .models import AppSource
+
+        # Make a git repository holding the fixture app.
+        with tempfile.TemporaryDirectory() as path:
+            repo = path + "/repo"
+            shutil.copytree("fixtures/modules/other", repo)
+            def commit(message):
+                subprocess.run(["git", "add", "."], cwd=repo, check=True)
+                subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.org",
+                                "commit", "-q", "-m", message], cwd=repo, check=True)
+            subprocess.run(["git", "init", "-q"], cwd=repo, check=True)
+            commit("first")
+
+            src = AppSource.objects.create(slug="git_cache_test", spec={ "type": "git", "url": "file://" + repo })
+            def get_title():
+                with src.open() as store:
+                    return [module for module_id, module in store.get_app("simple_project").get_modules()
+                            if module_id == "simple"][0]["title"]
+
+            with override_settings(GIT_CACHE_DIR=path + "/cache", GIT_CACHE_TTL=60):
+                # The repository is fetched into a bare repository in the cache.
+                self.assertEqual(get_title(), "A Simple Module")
+                self.assertEqual(len(os.listdir(path + "/cache")), 2) # the repository and its lock file
+
+                # It isn't fetched again until it is stale.
+                with open(repo + "/simple_project/simple.yaml") as f:
+                    yaml = f.read()
+                with open(repo + "/simple_project/simple.yaml", "w") as f:
+                    f.write(yaml.replace("A Simple Module", "A Changed Module"))
+                commit("second")
+                self.assertEqual(get_title(), "A Simple Module")
+
+                # Changing the AppSource makes it stale.
+                src.save()
+                self.assertEqual(get_title(), "A Changed Module")
+
+class AppUpgradeTests(TestCaseWithFixtureData):
+
+    def test_upgrade_projects(self):
+        from unittest import mock
+        from .app_upgrade import ProjectUpgrader
+        from .models import TaskAnswer
+
+        # Load new versions of the fixture app, one of which is missing a module.
+        with self.fixture_app.source.open() as store:
+            new_app = load_app_into_database(store.get_app("simple_project"))
+            incompatible_app = load_app_into_database(store.get_app("simple_project"))
+        incompatible_app.modules.filter(module_name="simple").update(module_name="renamed")
+
+        # Start projects using the old version and answer a question in each.
+        projects = []
+        for i in range(3):
+            project = Project.objects.create(organization=self.organization)
+            project.set_root_task(self.getModule("app"), self.user)
+            task = Task.objects.create(module=self.getModule("simple"), project=project, editor=self.user)
+            TaskAnswer.save_answers([(task, task.module.questions.get(key="q1"), "answer", [], None)], self.user, "api")
+            projects.append(project)
+        def apps(project):
+            return { t.module.app for t in Task.objects.filter(project=project) } \
+                 | { a.question.module.app for a in TaskAnswer.objects.filter(task__project=project) }
+
+        # A dry run checks the projects without upgrading them.
+        upgrader = ProjectUpgrader()
+        self.assertEqual(upgrader.upgrade(projects, incompatible_app, dry_run=True),
+            { p.id: "The module simple does not exist in the new app." for p in projects })
+        self.assertEqual(upgrader.upgrade(projects, new_app, dry_run=True), { p.id: True for p in projects })
+        self.assertEqual(apps(projects[0]), { self.fixture_app })
+
+        # Upgrading remaps the projects' Tasks and TaskAnswers to the new app.
+        with mock.patch("django.db.transaction.on_commit", lambda func : func()):
+            self.assertEqual(upgrader.upgrade(projects[:2], new_app), { p.id: True for p in projects[:2] })
+        for project in projects[:2]:
+            self.assertEqual(apps(project), { new_app })
+            task = Task.objects.get(project=project, module__module_name="simple")
+            self.assertEqual(task.get_answers().as_dict(), { "q1": "answer" })
+        self.assertEqual(apps(projects[2]), { self.fixture_app })
+        self.assertEqual(projects[2].is_safe_upgrade(new_app), True)
+
 class ImportExportTests(TestCaseWithFixtureData):
     ## IMPORT/EXPORT TASK DATA TESTS ##
 
-    class DummySerializer:
+    class DummySerializer(Serializer):
         def __init__(self, include_metadata=True):
-            self.include_metadata = include_metadata
-            self.include_file_content = True
+            super().__init__(include_file_content=True, include_metadata=include_metadata)
         def serializeOnce(self, object, preferred_key, value_func):
             return value_func()
 
@@ -761,6 +1182,61 @@ class ImportExportTests(TestCaseWithFixtureData):
                     self.assertEqual(b.get(k), v, "->".join(path+[k]))
         check_dict(task_dict, export, [module_name, question_name])
 
+    def test_streaming_export(self):
+        import json, io, os
+        from django.core.files.base import ContentFile
+        from django.core.serializers.json import DjangoJSONEncoder
+        from .models import TaskAnswer
+
+        # Answer two questions with the same sub-task, so that it is
+        # serialized once and then referenced, and upload a file that is
+        # read in several chunks.
+        root_task = self.project.root_task
+        subtask = root_task.get_or_create_subtask(self.user, "simple_module")
+        TaskAnswer.objects.get_or_create(task=root_task, question=root_task.module.questions.get(key="simple_module_two"))[0]\
+            .save_answer(None, [subtask], None, self.user, "web")
+        media_task = root_task.get_or_create_subtask(self.user, "question_types_media")
+        file_content = os.urandom(150000)
+        TaskAnswer.objects.get_or_create(task=media_task, question=media_task.module.questions.get(key="q_file"))[0]\
+            .save_answer(None, [], ContentFile(file_content, name="file.bin"), self.user, "web")
+
+        for include_metadata in (True, False):
+            # The streamed JSON is the same as the JSON of the non-streamed export.
+            text = "".join(self.project.export_json_stream(include_metadata=include_metadata))
+            self.assertEqual(text, json.dumps(self.project.export_json(include_metadata=include_metadata), indent=2, cls=DjangoJSONEncoder))
+            data = json.loads(text)
+            answers = data["project"]["answers"] if include_metadata else data["project"]
+            if include_metadata:
+                self.assertEqual(answers["simple_module_two"]["value"], { "__reference__": answers["simple_module"]["value"]["__referenceId__"] })
+
+            # The incremental parser gives the same data, with the file's
+            # content collected.
+            parsed = JSONStreamParser(io.BytesIO(text.encode("utf8")), chunk_size=100).parse()
+            file_value = (parsed["project"]["answers"]["question_types_media"]["value"]["answers"]["q_file"]["value"]
+                if include_metadata else parsed["project"]["question_types_media"]["q_file"])
+            self.assertEqual(file_value["content"].read(), "".join(
+                (answers["question_types_media"]["value"]["answers"]["q_file"]["value"] if include_metadata
+                else answers["question_types_media"]["q_file"])["content"]).encode("ascii"))
+            file_value["content"] = None
+            file_data = json.loads(text)
+            (file_data["project"]["answers"]["question_types_media"]["value"]["answers"]["q_file"]["value"]
+                if include_metadata else file_data["project"]["question_types_media"]["q_file"])["content"] = None
+            self.assertEqual(parsed, file_data)
+
+        # An array of a file's content that turns out not to be is parsed as usual.
+        text = json.dumps({ "type": "text/plain", "content": ["a", "b", "é", 1] })
+        self.assertEqual(JSONStreamParser(io.BytesIO(text.encode("utf8"))).parse()["content"], ["a", "b", "é", 1])
+
+        # Importing the parsed export into another project restores the file.
+        project = Project.objects.create(organization=self.organization)
+        project.root_task = Task.objects.create(module=root_task.module, project=project, editor=self.user)
+        project.save()
+        text = "".join(self.project.export_json_stream())
+        log = []
+        self.assertTrue(project.import_json(JSONStreamParser(io.BytesIO(text.encode("utf8"))).parse(), self.user, "imp", log.append))
+        media_task = project.root_task.get_or_create_subtask(self.user, "question_types_media", create=False)
+        self.assertEqual(media_task.answers.get(question__key="q_file").get_current_answer().answered_by_file.read(), file_content)
+
 class ComplianceAppTests(TestCaseWithFixtureData):
     ## COMPLIANCE APP VISIBILITY DATA TESTS ##
 
@@ -837,3 +1313,50 @@ class ComplianceAppTests(TestCaseWithFixtureData):
         self.add_perm_fetch()
         # Should return
         self.assertIsNotNone(ComplianceAppTests.app_filter(self, self.role_bool()).first())
+
+class AssembleTests(TestCase):
+
+    def write_driver(self, fn, answer):
+        import os, rtyaml
+        with open(fn, "w") as f:
+            f.write(rtyaml.dump({
+                "organization": { "name": "Assemble" },
+                "app": os.path.abspath("fixtures/modules/other/simple_project"),
+                "questions": [{ "id": "simple_module", "questions": [{ "id": "q1", "answer": answer }] }],
+            }))
+
+    def test_driver_files(self):
+        import os, tempfile
+        from django.core.management.base import CommandError
+        from .management.commands.assemble import Command
+        with tempfile.TemporaryDirectory() as path:
+            for dirname in ("a", "b"):
+                os.mkdir(os.path.join(path, dirname))
+                self.write_driver(os.path.join(path, dirname, "driver.yaml"), dirname)
+            a, b = (os.path.join(path, dirname) for dirname in ("a", "b"))
+
+            # A single driver file may be followed by the output directory.
+            self.assertEqual(Command().get_driver_files([a + "/driver.yaml", "out"], None), ([a + "/driver.yaml"], ["out"]))
+
+            # Otherwise it must be given with --outdir, and each file gets a subdirectory.
+            with self.assertRaises(CommandError):
+                Command().get_driver_files([a, b], None)
+            with self.assertRaises(CommandError):
+                Command().get_driver_files([a + "/driver.yaml", b + "/driver.yaml"], None)
+            self.assertEqual(Command().get_driver_files([a, b], "out"),
+                ([a + "/driver.yaml", b + "/driver.yaml"], ["out/a/driver", "out/b/driver"]))
+
+    def test_assemble_in_workers(self):
+        import os, subprocess, sys, tempfile
+        with tempfile.TemporaryDirectory() as path:
+            os.mkdir(os.path.join(path, "drivers"))
+            for name in ("a", "b"):
+                self.write_driver(os.path.join(path, "drivers", name + ".yaml"), "answer " + name)
+            subprocess.run([sys.executable, "manage.py", "assemble", "--workers", "2",
+                            os.path.join(path, "drivers"), "--outdir", os.path.join(path, "out")],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+            # Each file's documents are written to its own directory.
+            for name in ("a", "b"):
+                with open(os.path.join(path, "out", name, "simple_module", "00000.html")) as f:
+                    self.assertIn("answer " + name, f.read())
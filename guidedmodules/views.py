@@ -10,6 +10,7 @@ import re
 from .models import Module, ModuleQuestion, Task, TaskAnswer, TaskAnswerHistory, InstrumentationEvent
 
 import guidedmodules.module_logic as module_logic
+import guidedmodules.instrumentation as instrumentation
 import guidedmodules.answer_validation as answer_validation
 from discussion.models import Discussion
 from siteapp.models import User, Invitation, Project, ProjectMembership
@@ -399,14 +400,14 @@ def save_answer(request, task, answered, context, __):
     # --------------------------
     # How long was it since the question was initially viewed? That gives us
     # how long it took to answer the question.
-    i_task_question_view = InstrumentationEvent.objects\
+    from django.db.models import Min
+    i_task_question_view_time = InstrumentationEvent.objects\
         .filter(user=request.user, event_type="task-question-show", task=task, question=q)\
-        .order_by('event_time')\
-        .first()
-    i_event_value = (timezone.now() - i_task_question_view.event_time).total_seconds() \
-        if i_task_question_view else None
+        .aggregate(Min("event_time"))["event_time__min"]
+    i_event_value = (timezone.now() - i_task_question_view_time).total_seconds() \
+        if i_task_question_view_time else None
     # Save.
-    InstrumentationEvent.objects.create(
+    instrumentation.record(
         user=request.user,
         event_type="task-question-" + instrumentation_event_type,
         event_value=i_event_value,
@@ -516,17 +517,12 @@ def show_question(request, task, answered, context, q):
             now-t.updated,
             ))
 
-    # Add instrumentation event.
-    # How many times has this question been shown?
-    i_prev_view = InstrumentationEvent.objects\
-        .filter(user=request.user, event_type="task-question-show", task=task, question=q)\
-        .order_by('-event_time')\
-        .first()
-    # Save.
-    InstrumentationEvent.objects.create(
+    # Add instrumentation event. Each view counts one; the number of views
+    # is the sum of the event values (see the analytics view).
+    instrumentation.record(
         user=request.user,
         event_type="task-question-show",
-        event_value=(i_prev_view.event_value+1) if i_prev_view else 1,
+        event_value=1,
         module=task.module,
         question=q,
         project=task.project,
@@ -845,7 +841,7 @@ def task_finished(request, task, answered, context, *unused_args):
     i_event_value = (timezone.now() - i_task_create.event_time).total_seconds() \
         if i_task_create else None
     # Save.
-    InstrumentationEvent.objects.create(
+    instrumentation.record(
         user=request.user,
         event_type="task-done" if not i_task_done else "task-review",
         event_value=i_event_value,
@@ -1119,27 +1115,28 @@ def instrumentation_record_interaction(request):
 
     answer = TaskAnswer.objects.filter(task=task, question=question).first()
 
-    # We're recording the *first* interaction, so we'll
-    # stop if an interaction has already been recorded.
-
-    if InstrumentationEvent.objects.filter(
-        user=request.user, event_type="task-question-interact-first",
-        task=task, question=question).exists():
+    # We're recording the *first* interaction, so we'll stop if an
+    # interaction has already been recorded. We also need to know when
+    # the question was first viewed to compute the time to first
+    # interaction. Get both in one query.
+
+    from django.db.models import Min
+    first_events = dict(InstrumentationEvent.objects
+        .filter(user=request.user, task=task, question=question,
+                event_type__in=("task-question-show", "task-question-interact-first"))
+        .order_by()
+        .values_list("event_type")
+        .annotate(Min("event_time")))
+    if "task-question-interact-first" in first_events:
         return HttpResponse("ok")
 
-    # When was the question first viewed? We'll use that
-    # to compute the time to first interaction.
-
-    i_task_question_view = InstrumentationEvent.objects\
-        .filter(user=request.user, event_type="task-question-show", task=task, question=question)\
-        .order_by('event_time')\
-        .first()
-    event_value = (timezone.now() - i_task_question_view.event_time).total_seconds() \
-        if i_task_question_view else None
+    i_task_question_view_time = first_events.get("task-question-show")
+    event_value = (timezone.now() - i_task_question_view_time).total_seconds() \
+        if i_task_question_view_time else None
 
     # Save.
 
-    InstrumentationEvent.objects.create(
+    instrumentation.record(
         user=request.user,
         event_type="task-question-interact-first",
         event_value=event_value,
@@ -1793,44 +1790,72 @@ def start_a_discussion(request):
 
 @login_required
 def analytics(request):
-    from django.db.models import Avg, Count
+    from django.db.models import ExpressionWrapper, F, FloatField, Sum
 
-    from guidedmodules.models import ModuleQuestion
+    from guidedmodules.models import ModuleQuestion, InstrumentationRollup
+    from guidedmodules.analytics import summarize
 
     if not request.user.is_staff:
         return HttpResponseForbidden()
 
+    # Read the daily rollups maintained by the rollup_instrumentation
+    # management command rather than the raw InstrumentationEvents.
     def compute_table(opt):
-        qs = InstrumentationEvent.objects\
-            .filter(event_type=opt["event_type"])\
-            .values(opt["field"])
+        qs = InstrumentationRollup.objects\
+            .filter(event_type=opt["event_type"])
 
         overall = qs.aggregate(
-                avg_value=Avg('event_value'),
-                count=Count('event_value'),
+                count=Sum('count'),
+                value_sum=Sum('value_sum'),
             )
-        
+
         rows = qs\
             .exclude(**{opt["field"]: None})\
-            .annotate(
-                avg_value=Avg('event_value'),
-                count=Count('event_value'),
-            )\
-            .exclude(avg_value=None)\
-            .order_by('-avg_value')\
+            .values(opt["field"])\
+            .annotate(count=Sum('count'))\
+            .filter(count__gt=0)\
+            .annotate(avg_value=ExpressionWrapper(Sum('value_sum') / F('count'), output_field=FloatField()))\
+            .annotate(total_value=Sum('value_sum'))\
+            .order_by('-total_value' if opt.get("total") else '-avg_value')\
             [0:10]
+        rows = list(rows)
 
         bulk_objs = opt['model'].objects.in_bulk(r[opt['field']] for r in rows)
 
+        # Tables of totals (e.g. view counts) show the sum of the event values
+        # instead of their mean and percentiles.
+        if opt.get("total"):
+            opt.update({
+                "overall": round(overall['value_sum'] or 0),
+                "n": overall['count'] or 0,
+                "rows": [{
+                        "obj": str(bulk_objs[v[opt['field']]]),
+                        "label": opt['label']( bulk_objs[v[opt['field']]] ),
+                        "detail": opt['detail']( bulk_objs[v[opt['field']]] ),
+                        "n": v['count'],
+                        "value": round(v['total_value']),
+                        "p90": None,
+                    }
+                    for v in rows ],
+            })
+            return opt
+
+        # Estimate percentiles from the sketches of the rows shown.
+        row_rollups = { }
+        for rollup in qs.filter(**{opt["field"] + "__in": bulk_objs}):
+            row_rollups.setdefault(getattr(rollup, opt["field"] + "_id"), []).append(rollup)
+        summaries = { key: summarize(rollups) for key, rollups in row_rollups.items() }
+
         opt.update({
-            "overall": round(overall['avg_value']) if overall['avg_value'] is not None else "No Data",
-            "n": overall['count'],
+            "overall": round(overall['value_sum'] / overall['count']) if overall['count'] else "No Data",
+            "n": overall['count'] or 0,
             "rows": [{
                     "obj": str(bulk_objs[v[opt['field']]]),
                     "label": opt['label']( bulk_objs[v[opt['field']]] ),
                     "detail": opt['detail']( bulk_objs[v[opt['field']]] ),
                     "n": v['count'],
                     "value": round(v['avg_value']),
+                    "p90": round(summaries[v[opt['field']]]['p90']),
                 }
                 for v in rows ],
         })
@@ -1886,5 +1911,18 @@ def analytics(request):
                 "detail": lambda m : "version id %d" % m.id,
             }),
 
+            compute_table({
+                "event_type": "task-question-show",
+                "title": "Most Viewed Questions",
+
+                "model": ModuleQuestion,
+                "field": "question",
+
+                "quantity": "Views",
+                "total": True,
+                "label": lambda q : q.spec['title'],
+                "detail": lambda q : "%s, version id %d" % (q.module.title, q.module.id),
+            }),
+
         ]
     })
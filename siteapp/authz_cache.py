@@ -0,0 +1,90 @@
+# Request-scoped authorization cache
+#
+# Privilege checks on Tasks and Projects are made many times while handling
+# a single request -- task_view checks read privileges twice and write
+# privileges once, show_question checks write privileges on every candidate
+# answer task, templates check them again -- and each check runs several
+# queries. AuthorizationCacheMiddleware opens a scope for each request in
+# which the results of those checks are memoized, so each distinct check
+# runs at most once per request.
+#
+# If the "authz-cache-ttl" environment setting is a positive number of
+# seconds, results are additionally kept in the Django cache for that long
+# so they can be reused across requests. Changes to permissions may then
+# take up to that long to take effect, so it is off by default.
+#
+# The scope is cleared whenever a model that affects authorization is
+# saved (see the signals connected at the bottom of siteapp/models.py and
+# guidedmodules/models.py). Outside of a scope (e.g. in management
+# commands) nothing is cached.
+
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import profiling
+
+_local = threading.local()
+
+# Marks a cached None so it can be told apart from a cache miss.
+_NONE = "__none__"
+
+
+@contextmanager
+def scope():
+    """Memoize authorization checks made inside this block."""
+    previous = getattr(_local, "cache", None)
+    _local.cache = {}
+    try:
+        yield
+    finally:
+        _local.cache = previous
+
+
+def clear():
+    """Forget the authorization checks memoized in the current scope, e.g.
+    after changing a user's privileges in the middle of a request."""
+    if getattr(_local, "cache", None) is not None:
+        _local.cache.clear()
+
+
+def cached(key, compute):
+    """Return compute(), memoized under key (a tuple of strings and
+    numbers identifying the check) in the current scope."""
+    cache = getattr(_local, "cache", None)
+    if cache is None:
+        with profiling.timer("permission_check"):
+            return compute()
+    if key in cache:
+        profiling.count("authz_cache.hit")
+        return cache[key]
+    profiling.count("authz_cache.miss")
+
+    ttl = getattr(settings, "AUTHZ_CACHE_TTL", 0)
+    if ttl:
+        from django.core.cache import cache as shared_cache
+        shared_key = "authz:" + ":".join(str(k) for k in key)
+        value = shared_cache.get(shared_key)
+        if value is None:
+            with profiling.timer("permission_check"):
+                value = compute()
+            shared_cache.set(shared_key, _NONE if value is None else value, ttl)
+        elif value == _NONE:
+            value = None
+    else:
+        with profiling.timer("permission_check"):
+            value = compute()
+
+    cache[key] = value
+    return value
+
+
+def clear_on_change(sender, **kwargs):
+    # Signal receiver for models whose changes affect authorization.
+    clear()
+
+
+def user_key(user):
+    # Anonymous users have no id.
+    return getattr(user, "id", None)
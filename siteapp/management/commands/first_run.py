@@ -60,7 +60,7 @@ class Command(BaseCommand):
             for appname in ["System-Description-Demo", "PTA-Demo", "rules-of-behavior"]:
                 print("Adding appname '{}' from AppSource '{}' to catalog.".format(appname, created_appsource))
                 try:
-                    appver = created_appsource.add_app_to_catalog(appname)
+                    appver = created_appsource.add_app_to_catalog(appname, workers=None)
                 except Exception as e:
                     raise
 
@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction, models
+from django.db import connection, transaction, models
 from django.conf import settings
 from django.utils import timezone
 
@@ -9,27 +9,50 @@ from exclusiveprocess import Lock
 
 from notifications.models import Notification
 
+import structlog
+from structlog import get_logger
+from structlog.stdlib import LoggerFactory
+structlog.configure(logger_factory=LoggerFactory())
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = get_logger()
+
 class Command(BaseCommand):
     help = 'Sends emails for notifications.'
 
     def add_arguments(self, parser):
         parser.add_argument('forever', nargs='?', type=bool)
+        parser.add_argument('--batch-size', type=int, default=100, help="The number of notifications to claim and send at a time.")
+        parser.add_argument('--digest', action="store_true", help="Combine the notifications in a batch for the same user into one email.")
+        parser.add_argument('--min-interval', type=float, default=1, help="In forever mode, the seconds to wait before checking for notifications after sending some.")
+        parser.add_argument('--max-interval', type=float, default=20, help="In forever mode, the most seconds to wait between checks when there are no notifications to send.")
 
     def handle(self, *args, **options):
-        # Ensure this process doesn't run multiple times concurrently.
-        Lock(die=True).forever()
+        # Notifications are claimed by locking them with SKIP LOCKED so that
+        # several processes can send emails at the same time. If the database
+        # can't do that, ensure this process doesn't run multiple times
+        # concurrently.
+        if not connection.features.has_select_for_update_skip_locked:
+            Lock(die=True).forever()
+
+        self.batch_size = options["batch_size"]
+        self.digest = options["digest"]
 
         if options["forever"]:
-            # Loop forever.
+            # Loop forever. Check again soon after sending emails, since
+            # more activity is likely, and back off while there is none.
+            interval = options["min_interval"]
             while True:
-                self.send_new_emails()
-                time.sleep(20)
+                if self.send_new_emails():
+                    interval = options["min_interval"]
+                else:
+                    interval = min(interval * 2, options["max_interval"])
+                time.sleep(interval)
 
         else:
             # Run on-off job.
             self.send_new_emails()
 
-    def send_new_emails(self):
+    def get_new_notifications(self):
         # Find notifications that have not been emailed but should be emailed.
         #  * The user has notifications enabled as per notifemails_enabled value
         #    [(0, "As They Happen"), (1, "Don't Email")] in User model.
@@ -39,7 +62,7 @@ class Command(BaseCommand):
         #    to the site.
         # And go in order because once we mark a notification as emailed, we imply
         # that all earlier notifications have been sent to the user too.
-        notifs = Notification.objects\
+        return Notification.objects\
             .filter(
                 recipient__notifemails_enabled=0,
                 id__gt=models.F('recipient__notifemails_last_notif_id'),
@@ -48,78 +71,160 @@ class Command(BaseCommand):
             .exclude(target_object_id=None)\
             .order_by('id')
 
-        for notif in notifs:
-            self.send_it_out(notif)
-
-    def send_it_out(self, notif):
+    def send_new_emails(self):
+        # Send emails for new notifications a batch at a time and return the
+        # number of notifications emailed. Notifications that can't be emailed
+        # are skipped over but left in place, so go through the notifications
+        # in id order until there are no more.
+        after_id = 0
+        count = 0
+        while True:
+            batch_count, after_id = self.send_batch(after_id)
+            if after_id is None:
+                return count
+            count += batch_count
+
+    def send_batch(self, after_id):
+        # Claim a batch of notifications by locking them, skipping over any
+        # that another process has locked. Returns the number of notifications
+        # emailed and the id of the last notification in the batch, or None
+        # if there were no notifications to claim.
+        with transaction.atomic():
+            lock_args = { "skip_locked": connection.features.has_select_for_update_skip_locked }
+            if connection.features.has_select_for_update_of:
+                lock_args["of"] = ('self',) # don't lock the recipients
+            notifs = list(self.get_new_notifications()
+                .filter(id__gt=after_id)
+                .select_for_update(**lock_args)
+                .select_related('recipient')
+                .prefetch_related('actor', 'target')
+                [:self.batch_size])
+            if not notifs:
+                return 0, None
+
+            # Let the actors render appropriately.
+            from siteapp.models import User
+            actors = list({ notif.actor for notif in notifs if isinstance(notif.actor, User) })
+            User.preload_profiles(actors)
+
+            # Group the notifications that can be emailed by recipient.
+            by_recipient = { }
+            for notif in notifs:
+                email = self.prepare(notif)
+                if email:
+                    by_recipient.setdefault(notif.recipient, []).append(email)
+
+            # Store the reply secrets (see prepare).
+            Notification.objects.bulk_update(
+                [notif for emails in by_recipient.values() for notif, url, what_reply_does, organization in emails
+                 if what_reply_does],
+                ['data'])
+
+            # Send the emails over one connection to the mail server. The
+            # emails to each recipient are in notification id order. If one
+            # can't be sent, don't send the recipient's later ones, since
+            # the recipient's last sent notification id must not move past
+            # it. It and the later ones are tried again next time.
+            sent = []
+            from django.core.mail import get_connection
+            with get_connection() as mail_connection:
+                for recipient, emails in by_recipient.items():
+                    groups = [emails] if self.digest and len(emails) > 1 else [[email] for email in emails]
+                    for group in groups:
+                        try:
+                            self.send_it_out(recipient, group, mail_connection)
+                        except Exception as e:
+                            logger.error(
+                                event="send notification email",
+                                object={"status": "error", "notifications": [notif.id for notif, url, what_reply_does, organization in group],
+                                        "message": str(e)},
+                                user={"id": recipient.id, "username": recipient.username}
+                            )
+                            break
+                        sent.extend(notif for notif, url, what_reply_does, organization in group)
+
+            # Mark the notifications as sent, and update the id of the last
+            # notification sent to each user (but never move it backwards,
+            # since another process may have sent a later one).
+            Notification.objects.filter(id__in=[notif.id for notif in sent]).update(emailed=True)
+            last_notif_ids = { }
+            for notif in sent:
+                last_notif_ids[notif.recipient_id] = max(notif.id, last_notif_ids.get(notif.recipient_id, 0))
+            now = timezone.now()
+            for recipient_id, notif_id in last_notif_ids.items():
+                User.objects\
+                    .filter(id=recipient_id, notifemails_last_notif_id__lt=notif_id)\
+                    .update(notifemails_last_notif_id=notif_id, notifemails_last_at=now)
+
+        return len(sent), notifs[-1].id
+
+    def prepare(self, notif):
         # If the Notification's target does not have an 'organization' attribute
         # and a 'get_absolute_url' attribute, then we can't generate a link back
         # to the site, so skip it.
         target = notif.target
-        if not hasattr(target, 'get_absolute_url'): return
+        if not hasattr(target, 'get_absolute_url'): return None
         organization = getattr(notif.target, 'organization', None)
-        if not organization: return
+        if not organization: return None
 
-        # Let the actor render appropriately.
-        notif.actor.preload_profile()
+        from siteapp.templatetags.notification_helpers import get_notification_link
+        url = get_notification_link(target, notif)
+        if url is None:
+            # Some notifications go stale and can't generate links,
+            # and then we can't email notifications.
+            return None
 
         # If the target supports receiving email replies (like replying to an email
         # about a discussion), then store a secret in the notif.data dictionary so
         # that we can tell that a user has replied to something we sent them (and
-        # can't reply to something we didn't notify them about).
+        # can't reply to something we didn't notify them about). Digests can't be
+        # replied to.
         what_reply_does = None
-        if hasattr(target, "post_notification_reply"):
+        if hasattr(target, "post_notification_reply") and not self.digest:
             notif.data = notif.data or { }
             notif.data["secret_key"] = uuid.uuid4()
-            notif.save(update_fields=['data'])
             what_reply_does = "You can reply to this email to post a comment to the discussion. Do not forward this email to others."
 
-        # Send the email.
+        return (notif, url, what_reply_does, organization)
+
+    def send_it_out(self, recipient, emails, mail_connection):
+        # Send one email for a notification, or a digest email for several.
         from htmlemailer import send_mail
         from email.utils import format_datetime
-        from siteapp.templatetags.notification_helpers import get_notification_link
-        url = get_notification_link(target, notif)
-        if url is None:
-            # Some notifications go stale and can't generate links,
-            # and then we can't email notifications.
-            return
 
-        # Prevent multiple notifications emailed from multiple instances/containers of GovReady-Q
-        # Make this transaction atomic
-        # Re-check the database to make sure the individual notification is still unsent
-        # Lock the notification record in the database while sending the email
-        with transaction.atomic():
-            notif_latest = (
-                Notification.objects.select_for_update().get(id=notif.id)
+        if len(emails) > 1:
+            send_mail(
+                "email/notification_digest",
+                settings.DEFAULT_FROM_EMAIL,
+                [recipient.email],
+                {
+                    "notifications": [
+                        { "notification": notif, "url": settings.SITE_ROOT_URL + url }
+                        for notif, url, what_reply_does, organization in emails
+                    ],
+                },
+                headers={
+                    "Date": format_datetime(emails[-1][0].timestamp),
+                },
+                connection=mail_connection,
             )
+            return
 
-            if not notif_latest.emailed:
-                send_mail(
-                    "email/notification",
-                    settings.DEFAULT_FROM_EMAIL,
-                    [notif_latest.recipient.email],
-                    {
-                        "notification": notif,
-                        "url": settings.SITE_ROOT_URL + url,
-                        "whatreplydoes": what_reply_does,
-                    },
-                    headers={
-                        "From": settings.NOTIFICATION_FROM_EMAIL_PATTERN % (str(notif.actor),),
-                        "Reply-To": (settings.NOTIFICATION_REPLY_TO_EMAIL_PATTERN % (organization.name, notif.id, notif.data["secret_key"]))
-                        if what_reply_does else "",
-                        "Date": format_datetime(notif.timestamp),
-                    }
-                )
-
-                # Mark notification as sent.
-                notif_latest.emailed = True
-                notif_latest.save(update_fields=['emailed'])
-                # Update id of last notification sent to user
-                notif.recipient.notifemails_last_notif_id = notif.id
-                notif.recipient.notifemails_last_at = timezone.now()
-                notif.recipient.save(update_fields=['notifemails_last_notif_id', 'notifemails_last_at'])
-            else:
-                # Save record with nothing changed to close transaction
-                notif_latest.save()
-
-        # Release row level database lock on notification
+        notif, url, what_reply_does, organization = emails[0]
+        send_mail(
+            "email/notification",
+            settings.DEFAULT_FROM_EMAIL,
+            [recipient.email],
+            {
+                "notification": notif,
+                "url": settings.SITE_ROOT_URL + url,
+                "whatreplydoes": what_reply_does,
+            },
+            headers={
+                "From": settings.NOTIFICATION_FROM_EMAIL_PATTERN % (str(notif.actor),),
+                "Reply-To": (settings.NOTIFICATION_REPLY_TO_EMAIL_PATTERN % (organization.name, notif.id, notif.data["secret_key"]))
+                if what_reply_does else "",
+                "Date": format_datetime(notif.timestamp),
+            },
+            connection=mail_connection,
+        )
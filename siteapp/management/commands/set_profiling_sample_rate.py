@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from siteapp import profiling
+
+class Command(BaseCommand):
+    help = 'Changes the fraction of requests that are profiled while the site is running. Requires a cache shared by all processes, e.g. memcached.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('rate', nargs="?", type=float, help="The fraction of requests to profile, from 0 (none) to 1 (all). Shows the current rate if omitted.")
+        parser.add_argument('--reset', action="store_true", help="Revert to the profiling-sample-rate environment setting.")
+
+    def handle(self, *args, **options):
+        if options["reset"]:
+            profiling.set_sample_rate(None)
+        elif options["rate"] is not None:
+            if not (0 <= options["rate"] <= 1):
+                raise CommandError("The rate must be between 0 and 1.")
+            profiling.set_sample_rate(options["rate"])
+        print("Profiling {:.0%} of requests (configured: {:.0%}).".format(profiling.get_sample_rate(), settings.PROFILING_SAMPLE_RATE))
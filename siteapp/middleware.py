@@ -9,12 +9,45 @@ import django.contrib.auth.middleware
 import re
 from urllib.parse import urlsplit, urlencode
 
+from structlog import get_logger
+logger = get_logger()
+
 from .models import Organization
 from .models import Portfolio
 
 allowed_paths = None
 account_login_url = None
 
+class AuthorizationCacheMiddleware:
+    # Memoize Task and Project privilege checks for the duration of each
+    # request. See siteapp/authz_cache.py.
+    def __init__(self, next_middleware):
+        self.next_middleware = next_middleware
+    def __call__(self, request):
+        from . import authz_cache
+        with authz_cache.scope():
+            return self.next_middleware(request)
+
+class ProfilingMiddleware:
+    # Profile a sample of requests. See siteapp/profiling.py.
+    def __init__(self, next_middleware):
+        self.next_middleware = next_middleware
+    def __call__(self, request):
+        from . import profiling
+        if not profiling.should_sample():
+            return self.next_middleware(request)
+        with profiling.profile() as p:
+            response = self.next_middleware(request)
+        profiling.add_to_totals(p)
+        logger.info(
+            event="request_profile",
+            object={"method": request.method, "path": request.path, "status": response.status_code, **p.as_dict()},
+            user={"id": getattr(request.user, "id", None)} if hasattr(request, "user") else None,
+        )
+        if settings.PROFILING_SERVER_TIMING:
+            response['Server-Timing'] = p.server_timing()
+        return response
+
 class ContentSecurityPolicyMiddleware:
     # Set the CSP header on all responses.
     def __init__(self, next_middleware):
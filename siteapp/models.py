@@ -14,6 +14,7 @@ from guardian.shortcuts import (assign_perm, get_objects_for_user,
                                 get_users_with_perms, remove_perm)
 from controls.models import System, Element
 from jsonfield import JSONField
+from . import authz_cache
 
 import logging
 logging.basicConfig()
@@ -73,7 +74,7 @@ class User(AbstractUser):
             user__in=users,
             project__is_account_project=True)\
             .select_related("project", "project__root_task", "project__root_task__module"):
-            account_project_root_tasks[pm.user] = pm.project.root_task
+            account_project_root_tasks[pm.user_id] = pm.project.root_task
 
         # Get the account_settings answer object for all of the account projects in batch.
         # Load all TaskAnswerHistory objects that answer the "account_settings" question
@@ -91,19 +92,25 @@ class User(AbstractUser):
             .order_by('-id'):
             account_project_settings.setdefault(
                 ansh.taskanswer.task,
-                ansh.answered_by_task.first()
+                next(iter(ansh.answered_by_task.all()), None) # use the prefetched tasks
             )
 
-        # Get all of the current answers for the settings tasks.
+        # Get all of the current answers for the settings tasks. Profile
+        # pictures are never decoded here: avatars are served by URL, and
+        # the picture's TaskAnswerHistory is kept to fingerprint that URL.
         from guidedmodules.models import Task
         settings = { }
+        pictures = { }
         for task, question, answer in Task.get_all_current_answer_records(account_project_settings.values()):
-            settings.setdefault(task, {})[question.key] = (answer.get_value() if answer else None)
+            settings.setdefault(task, {})[question.key] = (answer.get_value(file_dataurls=False) if answer else None)
+            if question.key == "picture" and answer:
+                pictures[task] = answer
 
         # Set attributes on each user instance.
         for user in users:
-            user.user_settings_task = account_project_settings.get(account_project_root_tasks.get(user))
+            user.user_settings_task = account_project_settings.get(account_project_root_tasks.get(user.id))
             user.user_settings_task_answers = settings.get(user.user_settings_task, None)
+            user.user_settings_picture_answer = pictures.get(user.user_settings_task)
 
         # Apply a standard sort.
         if sort:
@@ -169,35 +176,25 @@ class User(AbstractUser):
     def get_profile_picture_absolute_url(self):
         # Because of invitations, profile photos are not protected by
         # authorization. But to prevent user enumeration and to bust
-        # caches when photos change, we include in the URL some
-        # information about the internal data of the profile photo,
-        # which is checked in views_landing.py's user_profile_photo().
-
-        # Get the current profile photo.
-        try:
-            pic = self._get_setting("picture")
-            if pic is None:
-                return
-        except:
+        # caches when photos change, we include in the URL a fingerprint
+        # of the profile photo answer, which is checked in views_landing.py's
+        # user_profile_photo().
+        if not hasattr(self, 'user_settings_task'):
+            self.preload_profile()
+        pic = getattr(self, 'user_settings_picture_answer', None)
+        if pic is None or not pic.answered_by_file.name:
             return None
-
-        # We've got the content. Make a fingerprint.
-        import xxhash, base64
-        payload = pic['content_dataurl']
-        fingerprint = base64.urlsafe_b64encode(
-                        xxhash.xxh64(payload).digest()
-                       ).decode('ascii').rstrip("=")
         return settings.SITE_ROOT_URL + "/media/users/%d/photo/%s" % (
             self.id,
-            fingerprint
+            pic.get_file_fingerprint()
         )
 
     def render_context_dict(self):
-        # Get the user's account settings task's answers as a dict.
-        if getattr(self, 'user_settings_task', None):
-            profile = dict(self.user_settings_task_answers)
-        else:
-            profile = self.get_settings_task().get_answers().as_dict()
+        # Get the user's account settings task's answers as a dict. Use
+        # User.preload_profiles to load the profiles of many users at once.
+        if not hasattr(self, 'user_settings_task'):
+            self.preload_profile()
+        profile = dict(self.user_settings_task_answers or {})
 
         # Add some information.
         profile.update({
@@ -637,6 +634,10 @@ class Project(models.Model):
         return ", ".join(sorted(m.user.email.split("@", 1)[1] for m in ProjectMembership.objects.filter(project=self, is_admin=True) if m.user.email and "@" in m.user.email))
 
     def has_read_priv(self, user):
+        return authz_cache.cached(("project_read", self.id, authz_cache.user_key(user)),
+                                  lambda : self._has_read_priv(user))
+
+    def _has_read_priv(self, user):
         # Who can see this project?
         # Team members + anyone with read privs to a task within this project
         # + anyone that's a guest in discussion within this project
@@ -655,6 +656,10 @@ class Project(models.Model):
         return False
 
     def has_write_priv(self, user):
+        return authz_cache.cached(("project_write", self.id, authz_cache.user_key(user)),
+                                  lambda : self._has_write_priv(user))
+
+    def _has_write_priv(self, user):
         # TODO: Create interfaces for managing separate has_write_priv
         # Meanwhile, during transition from 0.8.6 to 0.9.0 allow users who had access
         # to continue access and be able to edit
@@ -698,6 +703,7 @@ class Project(models.Model):
                 participants[user]["discussion_guest_in"].append(d)
 
         # Add text labels to describe user and authz.
+        User.preload_profiles(list(participants))
         for user, info in participants.items():
             info["user_details"] = user.render_context_dict()
             descr = []
@@ -898,53 +904,21 @@ class Project(models.Model):
         # Exports all project data to a JSON-serializable Python data structure.
         # The caller should have administrative permissions because no authorization
         # is performed within this.
-
-        from collections import OrderedDict
-
-        # The Serializer class is a helper that lets us avoid serializing
-        # things redundantly. Objects can asked to be serialzied once. On
-        # later times, a reference to the first serialized instance is returned.
-        #
-        # I meant this to also prevent infinite recursion during serialization
-        # but I don't think that actually works. If that's needed the logic here
-        # needs to be changed.
-        class Serializer:
-            def __init__(self):
-                self.objects = { }
-                self.keys = { }
-                self.include_file_content = include_file_content
-                self.include_metadata = include_metadata
-            def get_schema(self):
-                if self.include_metadata:
-                    return "GovReady Q Project Export Data 1.0"
-                else:
-                    return "GovReady Q Project API 1.0"
-            def serializeOnce(self, object, preferred_key, serialize_func):
-                if object not in self.objects:
-                    # This is the first use of this object instance.
-                    # Save the dict that we return for when we assign
-                    # its actual key later.
-                    ret = serialize_func()
-                    self.objects[object] = ret
-                    return ret
-                else:
-                    # We've already serialized this object instance once.
-                    # Just refer to it on second use.
-                    if object not in self.keys:
-                        # This is the first re-use. Generate a key.
-                        key = preferred_key
-                        i = 0
-                        while key in self.keys:
-                            key = preferred_key + ":" + str(i)
-                            i += 1
-                        self.keys[object] = key
-                        self.objects[object]["__referenceId__"] = key
-                    return OrderedDict([
-                        ("__reference__", self.keys[object]),
-                    ])
-
-        serializer = Serializer()
-
+        from .project_json import Serializer
+        serializer = Serializer(include_file_content=include_file_content, include_metadata=include_metadata)
+        serializer.load(self.root_task)
+        return self._export_json(serializer, self.root_task.export_json(serializer))
+
+    def export_json_stream(self, include_file_content=True, include_metadata=True):
+        # Like export_json, but returns a generator over pieces of the JSON text
+        # of the data, which is serialized as it is written. File content is
+        # read a chunk at a time.
+        from .project_json import StreamingSerializer
+        serializer = StreamingSerializer(include_file_content=include_file_content, include_metadata=include_metadata)
+        serializer.load(self.root_task)
+        return serializer.stream(self._export_json(serializer, serializer.expand(self.root_task.export_json(serializer))))
+
+    def _export_json(self, serializer, root_task_data):
         # Serialize this Project metadata.
         from collections import OrderedDict
         ret = OrderedDict([
@@ -959,7 +933,7 @@ class Project(models.Model):
 
         # Add metadata from the root task but don't overwrite existing fields
         # that have project metadata.
-        for key, value in self.root_task.export_json(serializer).items():
+        for key, value in root_task_data.items():
             if key in ("id", "created", "modified"): continue
             ret["project"][key] = value
 
@@ -1037,8 +1011,11 @@ class Project(models.Model):
             # missing or empty fields, which will preserve the existing metadata we have.
             pass
 
-        # Update root task.
-        self.root_task.import_json_update(data, deserializer)
+        # Update root task. Clear the state of the project's Tasks once at the
+        # end rather than after every answer.
+        from guidedmodules.models import Task
+        with Task.deferred_clear_state():
+            self.root_task.import_json_update(data, deserializer)
 
         return True
 
@@ -1070,156 +1047,23 @@ class Project(models.Model):
     def is_safe_upgrade(self, new_app):
         # A Project can be upgraded to a new app if every Module that has been started
         # in the Project corresponds to a Module in the new app *and* the new Module
-        # has not changed in an incompatible way.
+        # has not changed in an incompatible way. Returns True or a string saying
+        # why not.
+        from guidedmodules.app_upgrade import ProjectUpgrader
+        return ProjectUpgrader().check(self, new_app)
 
-        # Import needed guidedmodules objects
-        from guidedmodules.models import AppSource, AppVersion, Module
-        from guidedmodules.app_loading import is_module_changed
-
-        old_app = self.root_task.module.app
-
-        # Get the Modules in use by this Project, and make a mapping from name to module,
-        # Only need to test upgrading upgrades for modules that are actually in use.
-        old_modules = Module.objects.filter(task__project=self).distinct()
-        old_modules = {
-            m.module_name: m
-            for m in old_modules
-        }
-
-        # Get the corresponding Modules in the new app, and make a mapping.
-        new_modules = new_app.modules.filter(module_name__in=old_modules.keys())
-        new_modules = {
-            m.module_name: m
-            for m in new_modules
-        }
-
-        # Make a mapping of modules in the existing compliance app to their corresponding
-        # modules in the new compliance app (for modules that exist in both the old and new
-        # app with the same name) so that when checking module-type questions, we can know
-        # to expect certain ID changes. Here we need all of the modules in the app regardless
-        # of whether they are in use.
-        old_modules_all = { m.module_name: m for m in old_app.modules.all() }
-        new_modules_all = { m.module_name: m for m in new_app.modules.all() }
-        module_id_map = {
-            old_modules_all[m].id: new_modules_all[m].id
-            for m in set(old_modules_all) & set(new_modules_all)
-        }
-
-        # Check each module in use.
-        for module_name, old_module in old_modules.items():
-            if module_name not in new_modules:
-                # Module must exist in the new app version to be compatible.
-                return "The module {} does not exist in the new app.".format(module_name)
-            else:
-                new_module = new_modules[module_name]
-
-                # Get the 'spec' which is the Python representation of the
-                # YAML module data. Clone it (dict(...)).
-                spec = dict(new_module.spec)
-
-                # Put back information that we move out when we load it into the database
-                # that is_module_changed expects to be there.
-                spec["questions"] = [q.spec for q in new_module.questions.all()]
-
-                changed = is_module_changed(old_module, new_app.source, spec, module_id_map=module_id_map)
-                if changed in (None, False):
-                # if changed in (None, False, 'The module version number changed, forcing a reload.'):
-                    # 'None' signals no changes.
-                    # 'False' means no incompatible changes.
-                    # 'The module version number changed, forcing a reload.' means only the version number has changed
-                    pass
-                else:
-                    # There is an incompatible change. 'changed' holds a string describing
-                    # the issue.
-                    return changed
-
-        # The upgrade is safe.
-        return True
-
-    @transaction.atomic
     def upgrade_root_task_app(self, new_app):
-
-        # Import needed guidedmodules objects
-        from guidedmodules.models import AppSource, AppVersion, Module, ModuleQuestion, Task, TaskAnswer
-        from guidedmodules.app_loading import is_module_changed
-
-        # Get the current AppVersion.
-        old_app = self.root_task.module.app
-
-        # Get the target AppVersion.
-        # new_app = AppVersion.objects.get(
-        #     source__slug=options["app_source"],
-        #     appname=options["app_name"],
-        #     version_number=options["app_version"])
-
-        # Check that it is safe to upgrade to it.
-        changed = self.is_safe_upgrade(new_app)
+        # Every task in the Project is updated to point to the corresponding Module
+        # in the new app, and each TaskAnswer to the corresponding ModuleQuestion,
+        # if it is safe to upgrade (see is_safe_upgrade). Returns True or a string
+        # saying why the Project could not be upgraded.
+        from guidedmodules.app_upgrade import ProjectUpgrader
+        changed = ProjectUpgrader().upgrade([self], new_app)[self.id]
         if changed is not True:
             print("The compliance app has incompatible changes with the current app.")
             print(changed)
             return changed
 
-        # Do the upgrade.
-
-        # Get the Modules in use by this Project, and make a mapping from name to module,
-        old_modules = Module.objects.filter(task__project=self).distinct()
-        old_modules = {
-            m.module_name: m
-            for m in old_modules
-        }
-
-        # Get the corresponding Modules in the new app, and make a mapping.
-        new_modules = new_app.modules.filter(module_name__in=old_modules.keys())
-        new_modules = {
-            m.module_name: m
-            for m in new_modules
-        }
-
-        # Every task in the Project is updated to point to the corresponding Module
-        # in the new app. This is optmized to do one database statement per Module
-        # in use by the Task, which is slightly better than doing one statement per
-        # Task, since multiple Tasks within the Project might use the same Module.
-        # It would be even faster to use bulk_update added in Django 2.2 (https://docs.djangoproject.com/en/3.1/ref/models/querysets/#bulk-update).
-        for m in old_modules.keys():
-            Task.objects\
-                .filter(project=self,
-                        module=old_modules[m])\
-                .update(module=new_modules[m])
-
-        # Additionally, each TaskAnswer is updated to point to the corresponding
-        # ModuleQuestion in the new app.
-
-        # Get the ModuleQuestions in use by this Project, and make a mapping from
-        # (module name, question key) to ModuleQuestion,
-        old_module_questions = ModuleQuestion.objects\
-            .select_related('module')\
-            .filter(taskanswer__task__project=self).distinct()
-        old_module_questions = {
-            (q.module.module_name, q.key): q
-            for q in old_module_questions
-        }
-
-        # Get the corresponding ModuleQuestionss in the new app, and make a similar mapping.
-        new_module_questions = ModuleQuestion.objects\
-            .select_related('module')\
-            .filter(module__app=new_app)
-        new_module_questions = {
-            (q.module.module_name, q.key): q
-            for q in new_module_questions
-        }
-
-        # Do the replacements. This is optmized to do one database statement per
-        # ModuleQuestion that has been answered in the Task, which is slightly
-        # better than doing one statement per TaskAnswer, since a ModuleQuestion
-        # might be answered multiple times within a Project if the Project contains
-        # multiple Tasks for the same Module. See the comment about using bulk_update
-        # above.
-        for key in old_module_questions.keys():
-            TaskAnswer.objects\
-                .filter(task__project=self,
-                        question=old_module_questions[key])\
-                .update(question=new_module_questions[key])
-            print("Updating {}".format(new_module_questions[key]))
         print("Update complete.")
         return True
 
@@ -1383,3 +1227,10 @@ class Support(models.Model):
 
   def __str__(self):
     return "Support information"
+
+# Forget memoized authorization checks when memberships or object permissions
+# change. See siteapp/authz_cache.py.
+from guardian.models import UserObjectPermission, GroupObjectPermission
+for model in (ProjectMembership, UserObjectPermission, GroupObjectPermission):
+    models.signals.post_save.connect(authz_cache.clear_on_change, sender=model)
+    models.signals.post_delete.connect(authz_cache.clear_on_change, sender=model)
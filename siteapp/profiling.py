@@ -0,0 +1,230 @@
+# Request profiling
+#
+# ProfilingMiddleware profiles a random sample of requests. For each
+# sampled request it records the number of SQL queries and the time spent
+# in them, the time spent in hot paths wrapped with timed() or timer() --
+# module state evaluation, content rendering, impute conditions, catalog
+# loading and privilege checks -- and the hit and miss counts passed to
+# count(). Each profile is logged through structlog as a "request_profile"
+# event and added to the process's running totals, which /health/metrics
+# serves in the Prometheus text format. If the "profiling-server-timing"
+# environment setting is true, profiles are also returned to the browser
+# in a Server-Timing header.
+#
+# The fraction of requests sampled defaults to the "profiling-sample-rate"
+# environment setting (0 if not set) and can be changed while the site is
+# running with the set_profiling_sample_rate management command, which
+# stores it in the Django cache. (With the default per-process cache, that
+# only affects the process running the command, so use memcached to change
+# it at runtime.) Outside of a sampled request, timed() and count() do
+# nothing but check for a profile.
+
+import functools
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_local = threading.local()
+
+SAMPLE_RATE_CACHE_KEY = "profiling:sample-rate"
+SAMPLE_RATE_CHECK_INTERVAL = 10 # seconds
+
+
+class Profile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.timers = defaultdict(lambda : [0, 0.0]) # name => [calls, seconds]
+        self.counters = defaultdict(int)
+        self.active = set()
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        # A database execute_wrapper that times queries.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_time += time.perf_counter() - start
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+
+    def as_dict(self):
+        return {
+            "duration_ms": round(self.duration * 1000, 1),
+            "sql_count": self.sql_count,
+            "sql_ms": round(self.sql_time * 1000, 1),
+            "timers": { name: { "calls": calls, "ms": round(seconds * 1000, 1) }
+                        for name, (calls, seconds) in self.timers.items() },
+            "counters": dict(self.counters),
+        }
+
+    def server_timing(self):
+        # The value of a Server-Timing header.
+        metrics = ["total;dur={:.1f}".format(self.duration * 1000),
+                   "sql;dur={:.1f};desc=\"{} queries\"".format(self.sql_time * 1000, self.sql_count)]
+        for name, (calls, seconds) in sorted(self.timers.items()):
+            metrics.append("{};dur={:.1f};desc=\"{} calls\"".format(name.replace(".", "-"), seconds * 1000, calls))
+        return ", ".join(metrics)
+
+
+@contextmanager
+def profile():
+    """Profile the code inside this block, yielding the Profile."""
+    from django.db import connection
+    previous = getattr(_local, "profile", None)
+    p = _local.profile = Profile()
+    try:
+        with connection.execute_wrapper(p.execute_wrapper):
+            yield p
+    finally:
+        p.finish()
+        _local.profile = previous
+
+
+def current():
+    return getattr(_local, "profile", None)
+
+
+@contextmanager
+def timer(name):
+    """Add the time spent in this block to the current profile's timer."""
+    p = getattr(_local, "profile", None)
+    if p is None or name in p.active:
+        # Not profiling, or nested inside a block with the same timer, whose
+        # time already includes this one.
+        if p is not None:
+            p.timers[name][0] += 1
+        yield
+        return
+    p.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        p.active.discard(name)
+        t = p.timers[name]
+        t[0] += 1
+        t[1] += time.perf_counter() - start
+
+
+def timed(name):
+    """Decorate a function to add the time spent in it to the current
+    profile's timer."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "profile", None) is None:
+                return func(*args, **kwargs)
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """Add n to the current profile's counter, e.g. for cache hits."""
+    p = getattr(_local, "profile", None)
+    if p is not None:
+        p.counters[name] += n
+
+
+# Sampling.
+
+_sample_rate = None
+_sample_rate_checked = 0
+
+def get_sample_rate():
+    global _sample_rate, _sample_rate_checked
+    now = time.monotonic()
+    if _sample_rate is None or now - _sample_rate_checked > SAMPLE_RATE_CHECK_INTERVAL:
+        from django.core.cache import cache
+        rate = cache.get(SAMPLE_RATE_CACHE_KEY)
+        _sample_rate = rate if rate is not None else settings.PROFILING_SAMPLE_RATE
+        _sample_rate_checked = now
+    return _sample_rate
+
+def set_sample_rate(rate):
+    """Change the sample rate at runtime, or revert to the configured rate
+    if rate is None."""
+    global _sample_rate
+    from django.core.cache import cache
+    if rate is None:
+        cache.delete(SAMPLE_RATE_CACHE_KEY)
+    else:
+        cache.set(SAMPLE_RATE_CACHE_KEY, rate, None)
+    _sample_rate = None
+
+def should_sample():
+    rate = get_sample_rate()
+    return rate > 0 and (rate >= 1 or random.random() < rate) #nosec
+
+
+# Running totals for /health/metrics.
+
+_totals_lock = threading.Lock()
+_totals = {
+    "requests": 0,
+    "seconds": 0.0,
+    "sql_queries": 0,
+    "sql_seconds": 0.0,
+    "timers": defaultdict(lambda : [0, 0.0]),
+    "counters": defaultdict(int),
+}
+
+def add_to_totals(p):
+    with _totals_lock:
+        _totals["requests"] += 1
+        _totals["seconds"] += p.duration
+        _totals["sql_queries"] += p.sql_count
+        _totals["sql_seconds"] += p.sql_time
+        for name, (calls, seconds) in p.timers.items():
+            t = _totals["timers"][name]
+            t[0] += calls
+            t[1] += seconds
+        for name, n in p.counters.items():
+            _totals["counters"][name] += n
+
+def prometheus_metrics():
+    """Return the running totals in the Prometheus text exposition format."""
+    def label(name):
+        return name.replace("\\", "\\\\").replace("\"", "\\\"")
+    with _totals_lock:
+        lines = [
+            "# HELP govready_profiled_requests_total Requests profiled by this process.",
+            "# TYPE govready_profiled_requests_total counter",
+            "govready_profiled_requests_total {}".format(_totals["requests"]),
+            "# HELP govready_profiled_request_seconds_total Time spent in profiled requests.",
+            "# TYPE govready_profiled_request_seconds_total counter",
+            "govready_profiled_request_seconds_total {:.6f}".format(_totals["seconds"]),
+            "# HELP govready_profiled_sql_queries_total SQL queries run by profiled requests.",
+            "# TYPE govready_profiled_sql_queries_total counter",
+            "govready_profiled_sql_queries_total {}".format(_totals["sql_queries"]),
+            "# HELP govready_profiled_sql_seconds_total Time spent in SQL queries by profiled requests.",
+            "# TYPE govready_profiled_sql_seconds_total counter",
+            "govready_profiled_sql_seconds_total {:.6f}".format(_totals["sql_seconds"]),
+            "# HELP govready_profiled_calls_total Calls to timed code paths in profiled requests.",
+            "# TYPE govready_profiled_calls_total counter",
+        ]
+        for name, (calls, seconds) in sorted(_totals["timers"].items()):
+            lines.append("govready_profiled_calls_total{{path=\"{}\"}} {}".format(label(name), calls))
+        lines += [
+            "# HELP govready_profiled_seconds_total Time spent in timed code paths in profiled requests.",
+            "# TYPE govready_profiled_seconds_total counter",
+        ]
+        for name, (calls, seconds) in sorted(_totals["timers"].items()):
+            lines.append("govready_profiled_seconds_total{{path=\"{}\"}} {:.6f}".format(label(name), seconds))
+        lines += [
+            "# HELP govready_profiled_events_total Counted events, such as cache hits and misses, in profiled requests.",
+            "# TYPE govready_profiled_events_total counter",
+        ]
+        for name, n in sorted(_totals["counters"].items()):
+            lines.append("govready_profiled_events_total{{event=\"{}\"}} {}".format(label(name), n))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,406 @@
+# Project export and import JSON
+#
+# Project.export_json builds the project's data as nested dicts, using a
+# Serializer, which Task.export_json, Module.export_json and
+# TaskAnswerHistory.export_json call back into. A StreamingSerializer
+# instead defers serializing each Task and Module until it is written, so
+# that Project.export_json_stream can write a large project, including the
+# content of uploaded files, to a StreamingHttpResponse a piece at a time
+# without ever holding all of it in memory. Both kinds of serializer first
+# load the current answers of the whole task tree a level at a time with
+# Task.get_all_current_answer_records, which also tells the
+# StreamingSerializer in advance which Tasks and Modules are used more than
+# once and need a "__referenceId__" when they are first written.
+#
+# load_json is the matching incremental parser for imports. It reads JSON
+# from a file a chunk at a time and, instead of building a list of short
+# Base64 strings for each file in the data, collects the file's content
+# into a SpooledBase64Content, which is kept on disk if it is large.
+
+import codecs
+import collections.abc
+import json
+import re
+import tempfile
+from collections import Counter, OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+# File content is read and Base64-encoded in chunks of this many bytes,
+# which is a multiple of 48 so that the encoded chunks split evenly into
+# the 64-character lines of the export format.
+FILE_CHUNK_SIZE = 48 * 1024
+
+# The size of the pieces of text that are written and read at a time.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# File content larger than this is spooled to disk during imports.
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class Serializer:
+    # Lets us avoid serializing things redundantly. Objects can be asked to
+    # be serialized once. On later times, a reference to the first
+    # serialized instance is returned.
+
+    def __init__(self, include_file_content=True, include_metadata=True):
+        self.objects = { }
+        self.keys = { }
+        self.include_file_content = include_file_content
+        self.include_metadata = include_metadata
+        self.answer_records = { } # Task => [(ModuleQuestion, TaskAnswerHistory)]
+        self.uses = Counter() # Task/Module => number of times it is serialized
+
+    def get_schema(self):
+        if self.include_metadata:
+            return "GovReady Q Project Export Data 1.0"
+        else:
+            return "GovReady Q Project API 1.0"
+
+    def load(self, root_task):
+        # Batch load the current answers of the tasks in the task tree
+        # starting at root_task, one level of sub-tasks at a time, and
+        # count the number of times each Task and Module will be serialized.
+        from guidedmodules.models import Task
+        self.uses[root_task] += 1
+        level = [root_task]
+        while level:
+            for task in level:
+                self.answer_records[task] = []
+                self.uses[task.module] += 1
+            next_level = []
+            for task, question, answer in Task.get_all_current_answer_records(level):
+                self.answer_records[task].append((question, answer))
+                if answer is not None and question.spec["type"] in ("module", "module-set"):
+                    for subtask in answer.answered_by_task.all():
+                        self.uses[subtask] += 1
+                        if subtask not in self.answer_records and subtask not in next_level:
+                            next_level.append(subtask)
+            level = next_level
+
+    def get_answer_records(self, task):
+        # Return the (ModuleQuestion, TaskAnswerHistory) pairs for the
+        # current answers of the task, as Task.get_current_answer_records does.
+        if task not in self.answer_records:
+            self.answer_records[task] = list(task.get_current_answer_records())
+        return self.answer_records[task]
+
+    def make_key(self, preferred_key):
+        key = preferred_key
+        i = 0
+        while key in self.keys.values():
+            key = preferred_key + ":" + str(i)
+            i += 1
+        return key
+
+    def serializeOnce(self, object, preferred_key, serialize_func):
+        if object not in self.objects:
+            # This is the first use of this object instance.
+            # Save the dict that we return for when we assign
+            # its actual key later.
+            ret = serialize_func()
+            self.objects[object] = ret
+            return ret
+        else:
+            # We've already serialized this object instance once.
+            # Just refer to it on second use.
+            if object not in self.keys:
+                # This is the first re-use. Generate a key.
+                self.keys[object] = self.make_key(preferred_key)
+                self.objects[object]["__referenceId__"] = self.keys[object]
+            return OrderedDict([
+                ("__reference__", self.keys[object]),
+            ])
+
+    def serialize_file(self, f):
+        # Return the content of a file as an array of (short) Base64 strings.
+        from base64 import b64encode
+        return re.findall(".{1,64}", b64encode(f.read()).decode("ascii"))
+
+
+class Deferred:
+    # An object that a StreamingSerializer will serialize when it is written.
+    def __init__(self, object, preferred_key, serialize_func):
+        self.object = object
+        self.preferred_key = preferred_key
+        self.serialize_func = serialize_func
+
+
+class StreamingSerializer(Serializer):
+    # A Serializer whose output is written with stream(). Call load() first
+    # so that objects that are serialized more than once are known in
+    # advance.
+
+    def __init__(self, include_file_content=True, include_metadata=True, indent=2):
+        super().__init__(include_file_content=include_file_content, include_metadata=include_metadata)
+        self.indent = indent
+        self.written = set()
+
+    def serializeOnce(self, object, preferred_key, serialize_func):
+        # Which use of the object is first is decided when the uses are
+        # written, in order.
+        return Deferred(object, preferred_key, serialize_func)
+
+    def expand(self, value):
+        # Serialize a Deferred object.
+        if value.object in self.written and value.object in self.keys:
+            return OrderedDict([
+                ("__reference__", self.keys[value.object]),
+            ])
+
+        # This is the first use of the object (or a re-use that load() didn't
+        # foresee, which can't refer to the first use, so write it again).
+        self.written.add(value.object)
+        if self.uses[value.object] > 1:
+            self.keys[value.object] = self.make_key(value.preferred_key)
+        ret = value.serialize_func()
+        if value.object in self.keys:
+            ret["__referenceId__"] = self.keys[value.object]
+        return ret
+
+    def serialize_file(self, f):
+        # Return a generator over the file's content as (short) Base64
+        # strings, reading the file a chunk at a time.
+        from base64 import b64encode
+        def generate():
+            f.open("rb")
+            try:
+                for chunk in f.chunks(FILE_CHUNK_SIZE):
+                    chunk = b64encode(chunk).decode("ascii")
+                    for i in range(0, len(chunk), 64):
+                        yield chunk[i:i+64]
+            finally:
+                f.close()
+        return generate()
+
+    def stream(self, value):
+        # Return a generator over the JSON text of value, formatted as
+        # json.dumps(value, indent=self.indent) would, in pieces of at least
+        # STREAM_CHUNK_SIZE characters.
+        buf = []
+        size = 0
+        for text in self.iterencode(value, 0):
+            buf.append(text)
+            size += len(text)
+            if size >= STREAM_CHUNK_SIZE:
+                yield "".join(buf)
+                buf = []
+                size = 0
+        if buf:
+            yield "".join(buf)
+
+    def iterencode(self, value, level):
+        if isinstance(value, Deferred):
+            value = self.expand(value)
+
+        if isinstance(value, dict):
+            members = ((json.dumps(key) + ": ", v) for key, v in value.items())
+            brackets = "{}"
+        elif isinstance(value, (list, tuple, collections.abc.Iterator)):
+            members = (("", v) for v in value)
+            brackets = "[]"
+        else:
+            yield json.dumps(value, cls=DjangoJSONEncoder)
+            return
+
+        # Lists that are generated can't be checked for being empty before
+        # they are written, so write the opening bracket with the first item.
+        newline = "\n" + " " * (self.indent * (level + 1))
+        separator = brackets[0] + newline
+        empty = True
+        for prefix, v in members:
+            yield separator + prefix
+            yield from self.iterencode(v, level + 1)
+            separator = "," + newline
+            empty = False
+        if empty:
+            yield brackets
+        else:
+            yield "\n" + " " * (self.indent * level) + brackets[1]
+
+
+# Incremental import parser.
+
+class SpooledBase64Content:
+    # The content of a file in import data, as Base64 text.
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self.size = 0
+        self.lengths = [] # of each string written, so they can be split again
+
+    def write(self, text):
+        data = text.encode("utf8")
+        self.file.write(data)
+        self.size += len(text)
+        self.lengths.append(len(data))
+
+    def strings(self):
+        # Return the strings that were written, separately.
+        self.file.seek(0)
+        return [self.file.read(length).decode("utf8") for length in self.lengths]
+
+    def read(self):
+        # Return the Base64 text, as bytes.
+        self.file.seek(0)
+        return self.file.read()
+
+    def __len__(self):
+        return self.size
+
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?")
+LITERALS = { "true": True, "false": False, "null": None }
+MIME_TYPE = re.compile(r"[^/\s]+/[^/\s]+$")
+
+class JSONStreamParser:
+    def __init__(self, f, chunk_size=STREAM_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf8")("replace")
+        self.buf = ""
+        self.pos = 0
+        self.offset = 0 # characters dropped from the start of buf
+        self.eof = False
+
+    def fill(self, size=None):
+        # Read more text, dropping the text that has been parsed.
+        if self.pos > 0:
+            self.offset += self.pos
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        data = self.f.read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data, final=self.eof)
+        self.buf += data
+
+    def error(self, message):
+        raise ValueError("{} at character {}.".format(message, self.offset + self.pos))
+
+    def peek(self):
+        # Skip whitespace and return the next character, or "" at the end.
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos+1]
+            self.fill()
+
+    def expect(self, c):
+        if self.peek() != c:
+            self.error("Expecting '{}'".format(c))
+        self.pos += 1
+
+    def parse(self):
+        value = self.parse_value()
+        if self.peek() != "":
+            self.error("Extra data")
+        return value
+
+    def parse_value(self):
+        c = self.peek()
+        if c == "{":
+            return self.parse_object()
+        elif c == "[":
+            return self.parse_array()
+        elif c == '"':
+            return self.parse_string()
+        else:
+            return self.parse_scalar()
+
+    def parse_object(self):
+        ret = OrderedDict()
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return ret
+        while True:
+            if self.peek() != '"':
+                self.error("Expecting property name enclosed in double quotes")
+            key = self.parse_string()
+            self.expect(":")
+            if key == "content" and self.peek() == "[" and MIME_TYPE.match(str(ret.get("type"))):
+                # This looks like a file. Collect its content.
+                ret[key] = self.parse_file_content()
+            else:
+                ret[key] = self.parse_value()
+            c = self.peek()
+            self.pos += 1
+            if c == "}":
+                return ret
+            if c != ",":
+                self.pos -= 1
+                self.error("Expecting ',' delimiter")
+
+    def parse_array(self, content=None):
+        # If content is given, string items are written to it until the
+        # first non-string item, and then the rest are returned in a list.
+        ret = []
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return content if content is not None else ret
+        while True:
+            if content is not None and self.peek() == '"':
+                content.write(self.parse_string())
+            else:
+                if content is not None:
+                    # Not a file after all.
+                    ret = content.strings()
+                    content = None
+                ret.append(self.parse_value())
+            c = self.peek()
+            self.pos += 1
+            if c == "]":
+                return content if content is not None else ret
+            if c != ",":
+                self.pos -= 1
+                self.error("Expecting ',' delimiter")
+
+    def parse_file_content(self):
+        return self.parse_array(content=SpooledBase64Content())
+
+    def parse_string(self):
+        # Use the json module's string scanner, reading more text until the
+        # string is complete. Read more each time so that a long string
+        # isn't rescanned many times.
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = json.decoder.scanstring(self.buf, self.pos + 1)
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    self.error(e.msg.replace(" starting at", ""))
+                self.fill(size)
+                size = max(size, len(self.buf))
+                continue
+            self.pos = end
+            return value
+
+    def parse_scalar(self):
+        # Numbers and literals must not run up to the end of the buffer.
+        while not self.eof and len(self.buf) - self.pos < 32:
+            self.fill()
+        for literal, value in LITERALS.items():
+            if self.buf.startswith(literal, self.pos):
+                self.pos += len(literal)
+                return value
+        m = NUMBER.match(self.buf, self.pos)
+        if not m:
+            self.error("Expecting value")
+        while m.end() == len(self.buf) and not self.eof:
+            self.fill()
+            m = NUMBER.match(self.buf, self.pos)
+        self.pos = m.end()
+        if "." in m.group(0) or "e" in m.group(0) or "E" in m.group(0):
+            return float(m.group(0))
+        return int(m.group(0))
+
+
+def load_json(f):
+    # Parse JSON from a file-like object (such as an uploaded file or a
+    # request) that returns bytes or text, with file content collected in
+    # SpooledBase64Contents. Raises ValueError if the JSON is invalid.
+    return JSONStreamParser(f).parse()
@@ -251,6 +251,11 @@ if environment.get('memcached'):
 	CACHES['default']['BACKEND'] = 'django.core.cache.backends.memcached.MemcachedCache'
 	SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 
+# Authorization checks are memoized per request. Setting 'authz-cache-ttl'
+# to a number of seconds also shares them across requests through the cache
+# for that long. See siteapp/authz_cache.py.
+AUTHZ_CACHE_TTL = int(environment.get('authz-cache-ttl') or 0)
+
 # Logging.
 # Django disables console logging when DEBUG is false but console logging
 # is handy, especially in simple Docker deployments. Unhandled exception
@@ -66,9 +66,27 @@ if GR_IMG_GENERATOR not in GR_IMG_GENERATOR_SUPPORTED:
 else:
     print("INFO: GR_IMG_GENERATOR set to {}".format(GR_IMG_GENERATOR))
 
+# Instrumentation events are queued and written in batches by a background
+# worker. See guidedmodules/instrumentation.py. A buffer size of 0 writes
+# each event synchronously.
+INSTRUMENTATION_BUFFER_SIZE = int(environment.get("instrumentation-buffer-size", 10000))
+INSTRUMENTATION_FLUSH_INTERVAL = float(environment.get("instrumentation-flush-interval", 2))
+
+# Git AppSources are fetched into bare repositories under this directory,
+# which are fetched again when older than 'git-cache-ttl' seconds or when the
+# AppSource changes. See guidedmodules/app_source_connections.py.
+GIT_CACHE_DIR = environment.get("git-cache-dir") or local("git-cache")
+GIT_CACHE_TTL = int(environment.get("git-cache-ttl", 300))
+
+# A fraction of requests are profiled and logged. See siteapp/profiling.py.
+PROFILING_SAMPLE_RATE = float(environment.get("profiling-sample-rate", 0))
+PROFILING_SERVER_TIMING = bool(environment.get("profiling-server-timing", False))
+MIDDLEWARE.insert(0, 'siteapp.middleware.ProfilingMiddleware') # first, so it includes the other middleware
+
 MIDDLEWARE += [
     #'debug_toolbar.middleware.DebugToolbarMiddleware',
     'siteapp.middleware.ContentSecurityPolicyMiddleware',
+    'siteapp.middleware.AuthorizationCacheMiddleware',
     'guidedmodules.middleware.InstrumentQuestionPageLoadTimes',
 ]
 
@@ -838,7 +838,8 @@ class QuestionsTests(OrganizationSiteFunctionalTests):
         resp = self.client_get(
                 "/api/v1/projects/" + str(self.current_project.id) + "/answers",
                 HTTP_AUTHORIZATION=self.user.api_key_rw)
-        resp = resp.json()
+        import json
+        resp = json.loads(b"".join(resp.streaming_content))
         self.assertTrue(isinstance(resp, dict))
         self.assertEqual(resp.get("schema"), "GovReady Q Project API 1.0")
         for p in ["project"]+path:
@@ -1337,3 +1338,168 @@ class OrganizationSettingsTests(OrganizationSiteFunctionalTests):
         # # email-address
         # self.assertRegex(self.browser.title, "Next Question: email-address")
 
+
+from django.test import TestCase
+
+class ProfilePhotoTests(TestCase):
+
+    def setUp(self):
+        # Load the system modules, which define the account settings picture question.
+        from guidedmodules.models import AppSource
+        from guidedmodules.management.commands.load_modules import Command as load_modules
+        AppSource.objects.all().delete()
+        AppSource.objects.create(
+            slug="system",
+            is_system_source=True,
+            spec={ "type": "local", "path": "modules/system" })
+        load_modules().handle()
+
+        self.user = User.objects.create(username="me", email="me@example.org")
+
+    def _upload_picture(self, user, color):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.base import ContentFile
+        from guidedmodules.models import TaskAnswer
+        buf = BytesIO()
+        Image.new("RGB", (32, 32), color).save(buf, "png")
+        task = user.get_settings_task()
+        ta, _ = TaskAnswer.objects.get_or_create(task=task, question=task.module.questions.get(key="picture"))
+        ta.save_answer(None, [], ContentFile(buf.getvalue(), name="photo.png"), user, "web")
+
+    def test_profile_photo(self):
+        self.assertIsNone(self.user.get_profile_picture_absolute_url())
+        self._upload_picture(self.user, "red")
+
+        # Profiles are loaded without decoding the picture.
+        user = User.objects.get(id=self.user.id)
+        with self.assertNumQueries(10):
+            user.preload_profile()
+            profile = user.render_context_dict()
+        self.assertIsNone(profile["picture"].get("content_dataurl"))
+        url = user.get_profile_picture_absolute_url()
+        path = "/media/users/%d/photo/" % user.id
+        self.assertIn(path, url)
+
+        # The photo is served with an ETag and is not re-sent if unchanged.
+        path += url.split("/")[-1]
+        self.client.force_login(self.user)
+        resp = self.client.get(path)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "image/png")
+        resp = self.client.get(path, HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(resp.status_code, 304)
+
+        # A stale or wrong fingerprint is not found, and fingerprints can't
+        # be computed without the SECRET_KEY.
+        self.assertEqual(self.client.get(path + "x").status_code, 404)
+        from django.test import override_settings
+        with override_settings(SECRET_KEY="another secret key"):
+            self.assertNotEqual(User.objects.get(id=self.user.id).get_profile_picture_absolute_url(), url)
+        self._upload_picture(self.user, "blue")
+        self.assertEqual(self.client.get(path).status_code, 404)
+        user = User.objects.get(id=self.user.id)
+        self.assertNotEqual(user.get_profile_picture_absolute_url(), url)
+
+class ProfilingTests(TestCase):
+
+    def test_timers(self):
+        from siteapp import profiling
+
+        # Nothing is recorded outside of a profile.
+        with profiling.timer("outer"):
+            profiling.count("hit")
+        self.assertIsNone(profiling.current())
+
+        # Nested timers with the same name are only timed once.
+        with profiling.profile() as p:
+            with profiling.timer("outer"):
+                with profiling.timer("outer"):
+                    profiling.count("hit", 2)
+                User.objects.count()
+        self.assertEqual(p.timers["outer"][0], 2)
+        self.assertLessEqual(p.timers["outer"][1], p.duration)
+        self.assertEqual(p.counters["hit"], 2)
+        self.assertEqual(p.sql_count, 1)
+
+    def test_sampled_requests(self):
+        from siteapp import profiling
+
+        with self.settings(PROFILING_SAMPLE_RATE=0, PROFILING_SERVER_TIMING=True):
+            profiling.set_sample_rate(None)
+            self.assertNotIn("Server-Timing", self.client.get("/health/metrics"))
+
+            # The rate can be changed at runtime.
+            profiling.set_sample_rate(1)
+            try:
+                response = self.client.get("/login")
+                self.assertIn("sql;dur=", response["Server-Timing"])
+                metrics = self.client.get("/health/metrics").content.decode("utf8")
+                self.assertIn("govready_profiled_requests_total", metrics)
+                self.assertIn("# TYPE govready_profiled_sql_queries_total counter", metrics)
+            finally:
+                profiling.set_sample_rate(None)
+
+class NotificationEmailTests(TestCase):
+
+    def setUp(self):
+        from .models import Folder
+        self.actor = User.objects.create(username="actor", email="actor@example.org")
+        self.users = [User.objects.create(username="user%d" % i, email="user%d@example.org" % i) for i in range(3)]
+        organization = Organization.objects.create(name="Notification Organization", slug="notif")
+        self.folder = Folder.objects.create(organization=organization, title="Shared Folder")
+
+    def _notify(self, users):
+        from .notifications_helpers import issue_notification
+        issue_notification(self.actor, "shared", self.folder, recipients=users)
+
+    def test_send_notification_emails(self):
+        import django.core.mail
+        from notifications.models import Notification
+        from siteapp.management.commands.send_notification_emails import Command as send_notification_emails
+
+        # Notifications are sent in batches, one email per notification.
+        self._notify(self.users)
+        self._notify(self.users[:1])
+        command = send_notification_emails()
+        command.batch_size = 2
+        command.digest = False
+        self.assertEqual(command.send_new_emails(), 4)
+        self.assertEqual(len(django.core.mail.outbox), 4)
+        self.assertIn("actor shared", django.core.mail.outbox[0].body)
+        self.assertFalse(Notification.objects.filter(emailed=False).exists())
+        self.users[0].refresh_from_db()
+        self.assertEqual(self.users[0].notifemails_last_notif_id, Notification.objects.order_by('-id').first().id)
+
+        # Nothing is sent twice.
+        self.assertEqual(command.send_new_emails(), 0)
+
+        # In digest mode, a user's notifications in a batch are combined.
+        django.core.mail.outbox.clear()
+        self._notify(self.users[1:2])
+        self._notify(self.users[1:2])
+        command.digest = True
+        self.assertEqual(command.send_new_emails(), 2)
+        self.assertEqual(len(django.core.mail.outbox), 1)
+        self.assertEqual(django.core.mail.outbox[0].to, ["user1@example.org"])
+        self.assertIn("2 new notifications", django.core.mail.outbox[0].subject)
+
+        # If an email can't be sent, the recipient's later notifications
+        # wait so that it is tried again.
+        django.core.mail.outbox.clear()
+        self._notify(self.users[2:3])
+        self._notify(self.users[2:3])
+        command.digest = False
+        send_it_out = command.send_it_out
+        calls = []
+        def fail_first(recipient, group, mail_connection):
+            calls.append(group)
+            if len(calls) == 1:
+                raise IOError("mail server is down")
+            send_it_out(recipient, group, mail_connection)
+        from unittest import mock
+        with mock.patch.object(command, "send_it_out", fail_first):
+            self.assertEqual(command.send_new_emails(), 0)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(command.send_new_emails(), 2)
+        self.assertEqual(len(django.core.mail.outbox), 2)
@@ -92,6 +92,7 @@ urlpatterns = [
     url(r'^health/load-base/(?P<args>.*)$', views_health.load_base),
     url(r'^health/request-headers$', views_health.request_headers),
     url(r'^health/request$', views_health.request),
+    url(r'^health/metrics$', views_health.metrics),
     url(r'^health/debug$', views.debug, name="debug"),
 ]
 
@@ -846,13 +846,13 @@ def project_settings(request, project):
             "appname": av.appname,
             "version_number": av.version_number
         }
-        # print("project.is_safe_upgrade(av)", project.is_safe_upgrade(av))
-        if project.is_safe_upgrade(av) == True:
+        is_safe_upgrade = project.is_safe_upgrade(av)
+        if is_safe_upgrade == True:
             av_info["is_safe_upgrade"] = True
             av_info["reason"] = "Compatible"
         else:
             av_info["is_safe_upgrade"] = "Incompatible"
-            av_info["reason"] = project.is_safe_upgrade(av)
+            av_info["reason"] = is_safe_upgrade
         available_versions.append(av_info)
 
     # Render.
@@ -877,46 +877,83 @@ def project_settings(request, project):
         "project_form": ProjectForm(request.user, initial={'portfolio': project.portfolio.id}),
     })
 
-@project_read_required
-def project_list_all_answers(request, project):
+def get_project_answer_sections(project):
+    # Return the sections of the project's answers review page: the root
+    # task and, recursively, the tasks that answer its module-type questions,
+    # in question order. Rather than computing each task's answers, follow
+    # the current answers that have sub-tasks a level of tasks at a time.
+    from django.db.models import Max
+    from guidedmodules.models import ModuleQuestion, Task, TaskAnswer, TaskAnswerHistory
+    tasks = { project.root_task.id: project.root_task }
+    subtasks = { } # task id => [(question, sub-task)]
+    level = [project.root_task]
+    while level:
+        current_answers = TaskAnswer.objects.filter(task__in=level)\
+            .annotate(current_answer_id=Max('answer_history__id'))\
+            .values('current_answer_id')
+        edges = list(TaskAnswerHistory.answered_by_task.through.objects
+            .filter(taskanswerhistory__in=current_answers)
+            .order_by('taskanswerhistory__taskanswer__question__definition_order', 'id')
+            .values_list('taskanswerhistory__taskanswer__task_id', 'taskanswerhistory__taskanswer__question_id', 'task_id'))
+        questions = ModuleQuestion.objects.in_bulk({ question_id for task_id, question_id, subtask_id in edges })
+        new_tasks = Task.objects.select_related('module').in_bulk({ subtask_id for task_id, question_id, subtask_id in edges } - set(tasks))
+        tasks.update(new_tasks)
+        for task_id, question_id, subtask_id in edges:
+            subtasks.setdefault(task_id, []).append((questions[question_id], tasks[subtask_id]))
+        level = list(new_tasks.values())
+
     sections = []
+    def add_sections(path, task, ancestors):
+        sections.append({
+            "task": task,
+            "path": path,
+        })
+        if len(path) == 0:
+            path = path + [task.title]
+        for q, t in subtasks.get(task.id, []):
+            if t.id not in ancestors: # don't loop forever
+                add_sections(path + [q.spec["title"]], t, ancestors | { t.id })
+    add_sections([], project.root_task, { project.root_task.id })
+    return sections
 
-    def recursively_find_answers(path, task):
-        # Get the answers + imputed answers for the task.
+@project_read_required
+def project_list_all_answers(request, project):
+    # The page lists the sections of the review, and then the page loads
+    # each section's answers from this view, passing the task's ID, as the
+    # section scrolls into view.
+    from guidedmodules.models import Task, TaskAnswerHistory
+    if "task" in request.GET:
+        # Look up the task. Tasks in other projects can be sections too,
+        # if the project's tasks refer to them through current answers.
+        try:
+            task = Task.objects.select_related('module').get(id=request.GET["task"], deleted_at=None)
+        except (Task.DoesNotExist, ValueError):
+            raise Http404()
+        if task.project_id != project.id and not Task.objects.filter(id=task.id,
+                id__in=Task.get_referenced_task_closure(Task.objects.filter(id=project.root_task_id))).exists():
+            raise Http404()
+
+        # Get the answers + imputed answers for the task and render the
+        # questions and answers.
         answers = task.get_answers().with_extended_info()
-
-        # Create row in the output table for the answers.
         section = {
             "task": task,
-            "path": path,
             "can_review": task.has_review_priv(request.user),
-            "answers": [],
+            "answers": list(answers.render_answers(show_unanswered=False, show_imputed=False)),
         }
-        sections.append(section)
-
-        # Append all of the questions and answers.
-        for q, a, value_display in answers.render_answers(show_unanswered=False, show_imputed=False):
-            section["answers"].append((q, a, value_display))
-
-        if len(path) == 0:
-            path = path + [task.title]
-
-        for q, is_answered, a, value in answers.answertuples.values():
-            # Recursively go into submodules.
-            if q.spec["type"] in ("module", "module-set"):
-                if a and a.answered_by_task.exists():
-                    for t in a.answered_by_task.all():
-                        recursively_find_answers(path + [q.spec["title"]], t)
-
-    # Start at the root task and compute a table of all answers, recursively.
-    recursively_find_answers([], project.root_task)
+        return render(request, "project-list-answers-section.html", {
+            "project": project,
+            "section": section,
+            "review_choices": TaskAnswerHistory.REVIEW_CHOICES,
+        })
 
-    from guidedmodules.models import TaskAnswerHistory
+    sections = get_project_answer_sections(project)
+    for section in sections:
+        section["answers_url"] = request.path + "?task=" + str(section["task"].id)
     return render(request, "project-list-answers.html", {
         "page_title": "Review Answers",
         "project": project,
-        "answers": sections,
-        "review_choices": TaskAnswerHistory.REVIEW_CHOICES,
+        "sections": sections,
     })
 
 @project_read_required
@@ -1241,26 +1278,25 @@ def make_revoke_project_admin(request, project):
 @project_admin_login_post_required
 def export_project(request, project):
     from urllib.parse import quote
-    data = project.export_json(include_metadata=True, include_file_content=True)
-    resp = JsonResponse(data, json_dumps_params={"indent": 2})
+    from django.http import StreamingHttpResponse
+    resp = StreamingHttpResponse(
+        project.export_json_stream(include_metadata=True, include_file_content=True),
+        content_type="application/json")
     filename = project.title.replace(" ","_") + "-" + datetime.now().strftime("%Y-%m-%d-%H-%M")
     resp["content-disposition"] = "attachment; filename=%s.json" % quote(filename)
     return resp
 
 @project_admin_login_post_required
 def import_project_data(request, project):
-    # Deserialize the JSON from request.FILES. Assume the JSON data is
-    # UTF-8 encoded and ensure dicts are parsed as OrderedDict so that
-    # key order is preserved, since key order matters because deserialization
-    # has to see the file in the same order it was serialized in so that
-    # serializeOnce works correctly.
+    # Deserialize the JSON from request.FILES a chunk at a time. Assume the
+    # JSON data is UTF-8 encoded. load_json parses dicts as OrderedDict so
+    # that key order is preserved, since key order matters because
+    # deserialization has to see the file in the same order it was serialized
+    # in so that serializeOnce works correctly.
     log_output = []
     try:
-        import json
-        from collections import OrderedDict
-        data = json.loads(
-            request.FILES["value"].read().decode("utf8", "replace"),
-            object_pairs_hook=OrderedDict)
+        from .project_json import load_json
+        data = load_json(request.FILES["value"])
     except Exception as e:
         log_output.append("There was an error reading the export file.")
     else:
@@ -1911,6 +1947,7 @@ def organization_settings_save(request):
             if request.POST.get("query", "").lower().strip() in user.username.lower()
         ]
         users = users[:20] # limit
+        User.preload_profiles(users)
         return JsonResponse({ "users": [user.render_context_dict() for user in users] })
 
     return JsonResponse({ "status": "error", "message": str(request.POST) })
@@ -13,6 +13,7 @@ def index(request):
         '<li><a href="/health/load-base">load-base</a> - Load base page template with toggleable libraries. Use "all" or "none" link at bottom of page, or edit URL to change which libraries are loaded.</li>'
         '<li><a href="/health/request-headers">request-headers</a> - View HTTP headers present in request sent by web browser.</li>'
         '<li><a href="/health/request">request</a> - View entire request (must have DEBUG set).</li>'
+        '<li><a href="/health/metrics">metrics</a> - Request profiling totals for this process in the Prometheus text format.</li>'
         '</body></html>' )
     return HttpResponse(html)
 
@@ -63,3 +64,7 @@ def request(request):
     else:
         html = "<html><body><p>Please set DEBUG and try again.</p></body></html>"
     return HttpResponse(html)
+
+def metrics(request):
+    from .profiling import prometheus_metrics
+    return HttpResponse(prometheus_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
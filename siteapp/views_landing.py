@@ -12,6 +12,7 @@ from django.http import (Http404, HttpResponse, HttpResponseForbidden,
                          JsonResponse)
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
@@ -31,6 +32,10 @@ structlog.configure(processors=[structlog.processors.JSONRenderer()])
 logger = get_logger()
 # logger = logging.getLogger(__name__)
 
+# Profile photo URLs include a fingerprint of the photo, so browsers
+# can keep them for a long time.
+PROFILE_PHOTO_MAX_AGE = 60*60*24*30 # 30 days
+
 LOGIN = "login"
 SIGNUP = "signup"
 
@@ -133,21 +138,24 @@ def user_profile_photo(request, user_id, hash):
     # Raises 404 on any request that doesn't work out to prevent
     # enumeration of Organization subdomains too.
     user = get_object_or_404(User, id=user_id)
-    prj = user.get_account_project()
-    try:
-        account_settings = prj.root_task.get_or_create_subtask(user, "account_settings", create=False)
-        photo = account_settings.get_answers().get("picture")
-    except:
-        raise Http404()
+    user.preload_profile()
+    photo = getattr(user, 'user_settings_picture_answer', None)
     if not photo: raise Http404()
     if not photo.answered_by_file.name: raise Http404()
 
     # Check that the fingerprint in the URL matches. See User.get_profile_picture_absolute_url.
-    user.preload_profile()
-    path_with_fingerprint = user.get_profile_picture_absolute_url()
-    if not path_with_fingerprint.endswith(request.path):
+    fingerprint = photo.get_file_fingerprint()
+    if hash != fingerprint:
         raise Http404()
 
+    # The URL changes whenever the photo changes, so the fingerprint is
+    # also a strong ETag and the response can be cached for a long time.
+    etag = '"%s"' % fingerprint
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        patch_cache_control(not_modified, private=True, max_age=PROFILE_PHOTO_MAX_AGE)
+        return not_modified
+
     # Get the dbstorage.models.StoredFile instance which holds
     # an auto-detected mime type.
     from dbstorage.models import StoredFile
@@ -159,6 +167,8 @@ def user_profile_photo(request, user_id, hash):
     import os.path
     resp = HttpResponse(photo.answered_by_file, content_type=mime_type)
     resp['Content-Disposition'] = 'inline; filename=' + user.username + "_" + os.path.basename(photo.answered_by_file.name)
+    resp['ETag'] = etag
+    patch_cache_control(resp, private=True, max_age=PROFILE_PHOTO_MAX_AGE)
     return resp
 
 # TODO: Make groups available to all after managing group membership
@@ -246,11 +256,11 @@ def project_api(request, project_id):
         return JsonResponse(OrderedDict([("status", "error"), ("error", "The user associated with the API key does not have read perission on the project.")]), json_dumps_params={ "indent": 2 }, status=403)
 
     if request.method == "GET":
-        # Export data.
-        value = project.export_json(include_file_content=False, include_metadata=False)
-
-        # Return the value as JSON.
-        return JsonResponse(value, json_dumps_params={ "indent": 2 })
+        # Export data, writing the JSON as it is serialized.
+        from django.http import StreamingHttpResponse
+        return StreamingHttpResponse(
+            project.export_json_stream(include_file_content=False, include_metadata=False),
+            content_type="application/json")
 
     elif request.method == "POST":
         # Update the value.
@@ -263,11 +273,12 @@ def project_api(request, project_id):
 
         # Parse the new project body.
         if request.META.get("CONTENT_TYPE") == "application/json":
-            # A JSON object is given in the import/export format. Parse it.
-            import json
+            # A JSON object is given in the import/export format. Parse it
+            # from the request a chunk at a time.
+            from .project_json import load_json
             try:
-                value = json.loads(request.body.decode("utf-8"))
-            except json.decoder.JSONDecodeError as e:
+                value = load_json(request)
+            except ValueError as e:
                 return JsonResponse(OrderedDict([("status", "error"), ("error", "Invalid JSON in request body. " + str(e))]), json_dumps_params={ "indent": 2 }, status=400)
 
             # Update.
@@ -285,6 +296,8 @@ def project_api(request, project_id):
             log = []
             ok = True
             subtasks = { }
+            questions = { } # Module ID => { question key => ModuleQuestion }
+            answers = [] # (index into log, Task, ModuleQuestion, value, answered_by_file)
             for key, v in list(request.POST.lists()) + list(request.FILES.items()):
                 try:
                     # The item is a dotted path of project + question IDs to the
@@ -336,8 +349,11 @@ def project_api(request, project_id):
                                 subtasks[(task, question)] = subtask
                                 task = subtask
 
-                        # Get the question this corresponds to within the task
-                        question = task.module.questions.filter(key=pathitem).first()
+                        # Get the question this corresponds to within the task,
+                        # loading each module's questions just once.
+                        if task.module_id not in questions:
+                            questions[task.module_id] = { q.key: q for q in task.module.questions.all() }
+                        question = questions[task.module_id].get(pathitem)
                         if not question:
                             raise ValueError("Invalid question ID: {}. '{}' is not a question in {}.".format(
                                 key,
@@ -348,22 +364,25 @@ def project_api(request, project_id):
                     v = question_input_parser.parse(question, v)
                     v = validator.validate(question, v)
 
-                    # Save.
+                    # Queue it to be saved. Its log entry is filled in below.
                     v_file = None
                     if question.spec["type"] == "file":
                         v_file = v
                         v = None
-                    ta, _ = TaskAnswer.objects.get_or_create(task=task, question=question)
-                    saved = ta.save_answer(v, [], v_file, user, "api")
-                    if saved:
-                        log.append(key + " updated")
-                    else:
-                        log.append(key + " unchanged")
-                
+                    answers.append((len(log), task, question, v, v_file))
+                    log.append(key)
+
                 except ValueError as e:
                     log.append(key + ": " + str(e))
                     ok = False
 
+            # Save all of the answers at once.
+            results = TaskAnswer.save_answers(
+                [(task, question, v, [], v_file) for i, task, question, v, v_file in answers],
+                user, "api")
+            for (i, *_), saved in zip(answers, results):
+                log[i] += " updated" if saved else " unchanged"
+
 
         return JsonResponse(OrderedDict([
             ("status", "ok" if ok else "error"),
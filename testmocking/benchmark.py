@@ -0,0 +1,275 @@
+# Benchmarks of core compliance app workflows
+#
+# The benchmark management command creates a throwaway database (the same
+# way the test runner does), fills it with a scalable set of fixtures --
+# users, projects started from the simple_project fixture app with answered
+# questions, and systems with selected controls, implementation statements
+# and POA&Ms -- and then times each scenario below through the Django test
+# client, recording the latency and number of SQL queries of every run.
+#
+# Results are printed as a table and can be saved as JSON and compared
+# against a previous run's JSON.
+
+import contextlib
+import datetime
+import io
+import platform
+import random
+import statistics
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+
+from siteapp import profiling
+
+BENCHMARK_PASSWORD = "GovReadyBenchmark2021"
+
+# The modules of the simple_project fixture app whose questions are answered.
+ANSWERED_MODULES = ("simple_module", "question_types_text", "question_types_choice", "question_types_numeric")
+
+
+class Fixtures:
+    """Creates the benchmark fixtures and holds the objects the scenarios
+    act on."""
+
+    def __init__(self, users=10, projects=10, controls=50, poams=10, catalog_key=None, seed=0, log=print):
+        from controls.oscal import Catalogs
+        self.counts = { "users": users, "projects": projects, "controls": controls, "poams": poams }
+        self.catalog_key = catalog_key or Catalogs.NIST_SP_800_53_rev4
+        self.random = random.Random(seed)
+        self.log = log
+
+    def create(self):
+        from guidedmodules.models import AppSource
+        from guidedmodules.management.commands.load_modules import Command as load_modules
+        from siteapp.models import Organization, Portfolio, User
+        from testmocking.data_management import create_user, create_portfolio
+
+        # Load the system modules and the fixture compliance app.
+        AppSource.objects.update_or_create(slug="system", defaults={
+            "is_system_source": True,
+            "spec": { "type": "local", "path": "modules/system" }})
+        load_modules().handle()
+        self.appver = AppSource.objects.create(
+            slug="benchmark",
+            spec={ "type": "local", "path": "fixtures/modules/other" },
+            trust_assets=True,
+        ).add_app_to_catalog("simple_project")
+
+        # The user the scenarios run as, who owns everything.
+        self.user = User.objects.create(username="benchmark", email="benchmark@example.com", is_staff=True)
+        self.user.set_password(BENCHMARK_PASSWORD)
+        self.user.save()
+        self.user.reset_api_keys()
+        self.portfolio = Portfolio.objects.create(title=self.user.username)
+        self.portfolio.assign_owner_permissions(self.user)
+        self.org = Organization.create(name="Benchmark Organization", slug="benchmark", admin_user=self.user)
+
+        # Other users, created as the populate command does.
+        self.users = []
+        pw_hash = None
+        for i in range(self.counts["users"]):
+            u = create_user(username="benchmark_user_%d" % i, password=BENCHMARK_PASSWORD, pw_hash=pw_hash)
+            pw_hash = u.password
+            create_portfolio(u)
+            self.users.append(u)
+        self.log("Created {} users.".format(len(self.users) + 1))
+
+        self.projects = [self.create_project(i) for i in range(self.counts["projects"])]
+        self.log("Created {} projects.".format(len(self.projects)))
+
+        # Pick the objects the scenarios use.
+        self.project = self.projects[0]
+        self.simple_task = self.project.root_task.get_or_create_subtask(self.user,
+            self.project.root_task.module.questions.get(key="simple_module"))
+        self.simple_question = self.simple_task.module.questions.get(key="q1")
+        self.system = self.project.system
+
+    def create_project(self, i):
+        from siteapp.models import ProjectMembership
+        from siteapp.views import start_app
+
+        # Start the app as the compliance apps catalog does.
+        project = start_app(self.appver, self.org, self.user, None, None, None, self.portfolio)
+        for u in self.random.sample(self.users, min(3, len(self.users))):
+            ProjectMembership.objects.create(project=project, user=u)
+
+        # Answer questions as the answer_all_tasks command does.
+        from guidedmodules.models import Task
+        from testmocking.data_management import answer_randomly
+        root_task = project.root_task
+        with Task.deferred_clear_state():
+            for question in root_task.module.questions.filter(key__in=ANSWERED_MODULES):
+                task = root_task.get_or_create_subtask(self.user, question)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for _ in range(task.module.questions.count()):
+                        if not answer_randomly(task, skip_impute=True, halt_impute=False, quiet=True):
+                            break
+
+        self.create_controls(project.system)
+        return project
+
+    def create_controls(self, system):
+        from controls.models import Element, ElementControl, Poam, Statement
+        from controls.oscal import Catalog
+        from testmocking.data_management import get_random_paragraph, get_random_sentence
+
+        catalog = Catalog.GetInstance(catalog_key=self.catalog_key)
+        control_ids = list(catalog.flattened_controls_all_as_dict)[:self.counts["controls"]]
+
+        # Select controls and add a component with an implementation statement for each.
+        ElementControl.objects.bulk_create([
+            ElementControl(element=system.root_element, oscal_ctl_id=control_id, oscal_catalog_key=catalog.catalog_key)
+            for control_id in control_ids
+        ])
+        component = Element.objects.create(name="Component of " + system.root_element.name, element_type="system_element")
+        for control_id in control_ids:
+            Statement.objects.create(
+                sid=control_id, sid_class=catalog.catalog_key, statement_type="control_implementation",
+                body=get_random_paragraph(), producer_element=component, consumer_element=system.root_element)
+
+        # Add POA&Ms.
+        for poam_id in range(self.counts["poams"]):
+            smt = Statement.objects.create(
+                sid=self.random.choice(control_ids) if control_ids else None, sid_class=catalog.catalog_key,
+                statement_type="POAM", body=get_random_paragraph(), consumer_element=system.root_element)
+            Poam.objects.create(statement=smt, poam_id=poam_id + 1, controls=smt.sid,
+                weakness_name=get_random_sentence(), remediation_plan=get_random_paragraph())
+
+
+# Scenarios. Each returns a function that takes the run number and makes
+# a request with the given Client.
+
+def question_page(f, client):
+    url = f.simple_task.get_absolute_url_to_question(f.simple_question)
+    return lambda i : client.get(url)
+
+def save_answer(f, client):
+    url = f.simple_task.get_absolute_url() + "/_save"
+    return lambda i : client.post(url, { "question": f.simple_question.id, "method": "save", "value": "answer %d" % i })
+
+def project_page(f, client):
+    url = f.project.get_absolute_url()
+    return lambda i : client.get(url)
+
+def project_list(f, client):
+    return lambda i : client.get("/projects")
+
+def output_document(f, client):
+    url = f.simple_task.get_absolute_url() + "/finished"
+    return lambda i : client.get(url)
+
+def catalog(f, client):
+    url = "/controls/catalogs/{}/".format(f.catalog_key)
+    return lambda i : client.get(url)
+
+def selected_controls(f, client):
+    url = "/systems/{}/controls/selected".format(f.system.id)
+    return lambda i : client.get(url)
+
+def poam_export(f, client):
+    url = "/systems/{}/poams/export/xlsx".format(f.system.id)
+    def run(i):
+        response = client.get(url)
+        b"".join(response.streaming_content) if response.streaming else response.content
+        return response
+    return run
+
+def api_get(f, client):
+    url = "/api/v1/projects/{}/answers".format(f.project.id)
+    return lambda i : client.get(url, HTTP_AUTHORIZATION=f.user.api_key_rw)
+
+def api_post(f, client):
+    url = "/api/v1/projects/{}/answers".format(f.project.id)
+    return lambda i : client.post(url, { "project.simple_module.q1": "api answer %d" % i }, HTTP_AUTHORIZATION=f.user.api_key_rw)
+
+SCENARIOS = [
+    ("question_page", question_page),
+    ("save_answer", save_answer),
+    ("project_page", project_page),
+    ("project_list", project_list),
+    ("output_document", output_document),
+    ("catalog", catalog),
+    ("selected_controls", selected_controls),
+    ("poam_export", poam_export),
+    ("api_get", api_get),
+    ("api_post", api_post),
+]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def run_scenario(fixtures, scenario, iterations, warmup):
+    client = Client()
+    client.force_login(fixtures.user)
+    run = scenario(fixtures, client)
+    for i in range(warmup):
+        run(-1 - i)
+
+    latencies = []
+    queries = []
+    statuses = set()
+    for i in range(iterations):
+        with profiling.profile() as p:
+            response = run(i)
+        latencies.append(p.duration * 1000)
+        queries.append(p.sql_count)
+        statuses.add(response.status_code)
+
+    return {
+        "iterations": iterations,
+        "status_codes": sorted(statuses),
+        "latency_ms": {
+            "mean": statistics.mean(latencies),
+            "min": min(latencies),
+            "p50": percentile(latencies, .5),
+            "p90": percentile(latencies, .9),
+            "p99": percentile(latencies, .99),
+            "max": max(latencies),
+        },
+        "queries": {
+            "mean": statistics.mean(queries),
+            "max": max(queries),
+        },
+    }
+
+def run(fixtures, scenarios, iterations, warmup, log=print):
+    results = {
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "version": settings.APP_VERSION_STRING,
+        "database": connection.vendor,
+        "python": platform.python_version(),
+        "fixtures": fixtures.counts,
+        "catalog": fixtures.catalog_key,
+        "iterations": iterations,
+        "scenarios": { },
+    }
+    for name, scenario in SCENARIOS:
+        if scenarios and name not in scenarios:
+            continue
+        log("Running {}...".format(name))
+        try:
+            results["scenarios"][name] = run_scenario(fixtures, scenario, iterations, warmup)
+        except Exception as e:
+            # Report the failure and go on to the other scenarios.
+            log("{} failed: {}".format(name, e))
+            results["scenarios"][name] = { "error": str(e) }
+    return results
+
+def format_results(results, baseline=None):
+    lines = ["{:<20} {:>8} {:>8} {:>8} {:>8} {:>8}  {}".format("scenario", "p50 ms", "p90 ms", "max ms", "queries", "status", "vs. baseline p50" if baseline else "")]
+    for name, r in results["scenarios"].items():
+        if "error" in r:
+            lines.append("{:<20} {}".format(name, "error: " + r["error"]))
+            continue
+        compare = ""
+        b = baseline["scenarios"].get(name) if baseline else None
+        if b and "error" not in b:
+            compare = "{:+.0%}".format(r["latency_ms"]["p50"] / b["latency_ms"]["p50"] - 1)
+        lines.append("{:<20} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8}  {}".format(
+            name, r["latency_ms"]["p50"], r["latency_ms"]["p90"], r["latency_ms"]["max"],
+            r["queries"]["mean"], ",".join(str(s) for s in r["status_codes"]), compare))
+    return "\n".join(lines)
@@ -0,0 +1,304 @@
+# Bulk synthetic data for load testing
+#
+# generate() creates users, projects with answered tasks and systems with
+# selected controls, implementation statements and POA&Ms using bulk_create
+# rather than the ordinary one-object-at-a-time code paths, so that a
+# dataset of thousands of projects can be built in minutes.
+#
+# Projects are generated in chunks of CHUNK_SIZE. Each chunk has its own
+# random number generator seeded from the seed and the chunk number, so the
+# same seed produces the same data however many worker processes are used.
+# Chunks are generated in parallel worker processes except on databases
+# that allow only one writer at a time (SQLite) or that don't return the
+# primary keys of bulk-inserted rows (MySQL), where bulk_create below reads
+# the new keys back and so can't share tables with other writers.
+#
+# The data is shaped to look like a real site: the fraction of each module
+# that is answered, the number of times each answer was changed, the number
+# of project members and the number of controls selected for each system
+# are drawn from skewed distributions rather than being uniform.
+#
+# bulk_create skips model signals, so the search index is updated
+# explicitly, and statement body hashes are computed here.
+
+import datetime
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from guardian.models import UserObjectPermission
+from guardian.shortcuts import get_perms_for_model
+
+from testmocking.data_management import get_wordlist
+
+CHUNK_SIZE = 50
+BATCH_SIZE = 500
+
+# Typical sizes of control baselines (low, moderate, high) relative to the
+# largest, and how often each is used.
+BASELINE_FRACTIONS = (0.4, 0.8, 1.0)
+BASELINE_WEIGHTS = (3, 5, 2)
+
+
+def bulk_create(model, objs):
+    """bulk_create objs and make sure they have their primary keys set,
+    even on databases that don't return them from bulk inserts. There must
+    not be other writers to the table at the same time on such databases."""
+    if not objs:
+        return objs
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    last_id = model.objects.aggregate(id=Max('id'))['id'] or 0
+    model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    ids = model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)
+    for obj, id in zip(objs, ids):
+        obj.id = id
+        obj._state.adding = False
+    return objs
+
+def owner_permissions(model, pairs):
+    # Return UserObjectPermissions that give each user owner permissions on
+    # each object, as assign_owner_permissions does, in (user, object) pairs.
+    content_type = ContentType.objects.get_for_model(model)
+    perms = get_perms_for_model(model)
+    return [
+        UserObjectPermission(permission=perm, user=user, content_type=content_type, object_pk=str(obj.pk))
+        for user, obj in pairs
+        for perm in perms
+    ]
+
+
+# Answers.
+
+def random_text(rng, min_words, max_words):
+    return " ".join(rng.sample(get_wordlist(), rng.randint(min_words, max_words)))
+
+def random_answer(rng, question):
+    """Return a random valid value for a question, or None if answers to
+    questions of its type aren't generated."""
+    spec = question.spec
+    qtype = spec["type"]
+    if qtype in ("text", "password"):
+        return random_text(rng, 2, 8)
+    if qtype == "longtext":
+        return "\n\n".join(random_text(rng, 5, 10).capitalize() + "." for _ in range(rng.randint(1, 4)))
+    if qtype == "email-address":
+        return "{}@example.com".format(rng.choice(get_wordlist()))
+    if qtype == "url":
+        return "https://example.com/{}".format(rng.choice(get_wordlist()))
+    if qtype == "yesno":
+        return rng.choice(["yes", "no"])
+    if qtype == "choice" and spec.get("choices"):
+        return rng.choice(spec["choices"])["key"]
+    if qtype == "multiple-choice" and spec.get("choices"):
+        choices = [c["key"] for c in spec["choices"]]
+        return rng.sample(choices, rng.randint(min(spec.get("min", 0), len(choices)), min(spec.get("max") or len(choices), len(choices))))
+    if qtype == "integer":
+        return rng.randint(spec.get("min", 0), spec.get("max", 1000))
+    if qtype == "real":
+        return round(rng.uniform(spec.get("min", 0), spec.get("max", 1000)), 2)
+    if qtype == "date":
+        return (datetime.date(2018, 1, 1) + datetime.timedelta(days=rng.randint(0, 1000))).isoformat()
+    return None
+
+def revision_count(rng):
+    # Most answers are given once; some are changed a few times.
+    n = 1
+    while n < 5 and rng.random() < 0.3:
+        n += 1
+    return n
+
+
+# Generation.
+
+def generate(organization, appversion, users=100, projects=1000, max_controls=300, poams=5,
+             seed=0, prefix="load", workers=4, catalog_key=None, log=print):
+    """Generate users and projects and return a dict of the number of rows
+    created of each kind."""
+    from controls.oscal import Catalog, Catalogs
+
+    # Users and their portfolios are few, so they are created up front.
+    user_list = create_users(users, prefix)
+    log("Created {} users.".format(len(user_list)))
+
+    # Load the catalog in the parent so its control list can be shared.
+    catalog = Catalog.GetInstance(catalog_key=catalog_key or Catalogs.NIST_SP_800_53_rev4)
+    control_ids = list(catalog.flattened_controls_all_as_dict)[:max_controls]
+
+    chunks = [
+        dict(seed=seed, chunk=i, prefix=prefix, projects=min(CHUNK_SIZE, projects - i*CHUNK_SIZE),
+             organization_id=organization.id, appversion_id=appversion.id,
+             user_ids=[u.id for u in user_list],
+             catalog_key=catalog.catalog_key, control_ids=control_ids, poams=poams)
+        for i in range((projects + CHUNK_SIZE - 1) // CHUNK_SIZE)
+    ]
+
+    totals = { "users": len(user_list) }
+    def add(counts):
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+        log("Created {} projects.".format(totals["projects"]))
+
+    if workers <= 1 or connection.vendor == "sqlite" or not connection.features.can_return_rows_from_bulk_insert:
+        for chunk in chunks:
+            add(generate_chunk(chunk))
+    else:
+        # Don't share the parent's database connection with the workers.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            for counts in pool.map(generate_chunk, chunks):
+                add(counts)
+    return totals
+
+def _init_worker():
+    import django
+    django.setup()
+    connections.close_all()
+
+def create_users(count, prefix):
+    from siteapp.models import User, Portfolio
+
+    password = make_password(prefix) # one hash for all users
+    with transaction.atomic():
+        users = bulk_create(User, [
+            User(username="{}_{}".format(prefix, i), email="{}_{}@example.com".format(prefix, i),
+                 first_name=prefix, last_name=str(i), password=password)
+            for i in range(count)
+        ])
+        portfolios = bulk_create(Portfolio, [Portfolio(title=u.username) for u in users])
+        UserObjectPermission.objects.bulk_create(owner_permissions(Portfolio, zip(users, portfolios)), batch_size=BATCH_SIZE)
+    return users
+
+def generate_chunk(chunk):
+    from guidedmodules.models import AppVersion, Task, TaskAnswer, TaskAnswerHistory
+    from siteapp.models import Organization, Portfolio, Project, ProjectMembership, User
+    from controls.models import Element, ElementControl, Poam, Statement, System, statement_body_hash
+    from controls import search
+
+    rng = random.Random("{}:{}".format(chunk["seed"], chunk["chunk"]))
+    organization = Organization.objects.get(id=chunk["organization_id"])
+    appversion = AppVersion.objects.get(id=chunk["appversion_id"])
+    app_module = appversion.modules.get(module_name="app")
+    users = list(User.objects.filter(id__in=chunk["user_ids"]).order_by('id'))
+    portfolios = { p.title: p for p in Portfolio.objects.filter(title__in=[u.username for u in users]) }
+
+    # The module-type questions of the app, whose answers are subtasks, and
+    # the questions of each of their modules.
+    subtask_questions = [q for q in app_module.questions.select_related('answer_type_module').order_by('definition_order')
+                         if q.spec["type"] == "module" and q.answer_type_module]
+    module_questions = { }
+    for q in subtask_questions:
+        module_questions.setdefault(q.answer_type_module.id, list(q.answer_type_module.questions.order_by('definition_order')))
+
+    counts = { }
+    with transaction.atomic():
+        # Systems and projects.
+        names = ["{} {} {}".format(chunk["prefix"], chunk["chunk"], i) for i in range(chunk["projects"])]
+        owners = [rng.choice(users) for _ in names]
+        elements = bulk_create(Element, [
+            Element(name=name, description="", element_type="system") for name in names ])
+        systems = bulk_create(System, [System(root_element=e) for e in elements])
+        projects = bulk_create(Project, [
+            Project(organization=organization, portfolio=portfolios[owner.username], system=system)
+            for owner, system in zip(owners, systems) ])
+        root_tasks = bulk_create(Task, [
+            Task(project=project, editor=owner, module=app_module, title_override=name)
+            for project, owner, name in zip(projects, owners, names) ])
+        for project, task in zip(projects, root_tasks):
+            project.root_task = task
+        Project.objects.bulk_update(projects, ['root_task'], batch_size=BATCH_SIZE)
+
+        # Members and permissions. Most projects have a few members.
+        memberships = []
+        for project, owner in zip(projects, owners):
+            memberships.append(ProjectMembership(project=project, user=owner, is_admin=True))
+            for u in rng.sample(users, min(len(users), int(rng.expovariate(0.5)))):
+                if u != owner:
+                    memberships.append(ProjectMembership(project=project, user=u, is_admin=rng.random() < 0.2))
+        ProjectMembership.objects.bulk_create(memberships, batch_size=BATCH_SIZE)
+        UserObjectPermission.objects.bulk_create(
+            owner_permissions(Element, zip(owners, elements)) + owner_permissions(System, zip(owners, systems)),
+            batch_size=BATCH_SIZE)
+
+        # Subtasks for most of the app's modules, answered to varying degrees.
+        subtasks = []
+        for project, task, owner in zip(projects, root_tasks, owners):
+            for q in subtask_questions:
+                if rng.random() < 0.85:
+                    subtasks.append((task, q, Task(project=project, editor=owner, module=q.answer_type_module)))
+        bulk_create(Task, [t for _, _, t in subtasks])
+
+        answers = [] # (TaskAnswer, user, [values], answered_by_task)
+        for task, q, subtask in subtasks:
+            answers.append((TaskAnswer(task=task, question=q), subtask.editor, [None], subtask))
+            completion = rng.betavariate(2, 1.2)
+            for mq in module_questions[q.answer_type_module.id]:
+                if rng.random() > completion:
+                    continue
+                values = [random_answer(rng, mq) for _ in range(revision_count(rng))]
+                if values[0] is not None:
+                    answers.append((TaskAnswer(task=subtask, question=mq), subtask.editor, values, None))
+        bulk_create(TaskAnswer, [a[0] for a in answers])
+        histories = []
+        subtask_links = [] # (current TaskAnswerHistory, answered_by_task)
+        for taskanswer, user, values, answered_by_task in answers:
+            for value in values:
+                histories.append(TaskAnswerHistory(taskanswer=taskanswer, answered_by=user, answered_by_method="web",
+                                                   stored_value=value, extra={}))
+            if answered_by_task is not None:
+                subtask_links.append((histories[-1], answered_by_task))
+        bulk_create(TaskAnswerHistory, histories)
+        Through = TaskAnswerHistory.answered_by_task.through
+        Through.objects.bulk_create([
+            Through(taskanswerhistory_id=h.id, task_id=answered_by_task.id)
+            for h, answered_by_task in subtask_links
+        ], batch_size=BATCH_SIZE)
+
+        # Selected controls, each implemented by one of the system's components.
+        control_ids = chunk["control_ids"]
+        components = bulk_create(Element, [
+            Element(name="{} component {}".format(name, j), description="A component of " + name, element_type="system_element")
+            for name in names
+            for j in range(rng.randint(1, 4)) ])
+        components_by_system = { }
+        for c in components:
+            components_by_system.setdefault(c.name.rsplit(" component ", 1)[0], []).append(c)
+        element_controls = []
+        statements = []
+        poam_statements = []
+        for name, element in zip(names, elements):
+            size = int(len(control_ids) * rng.choices(BASELINE_FRACTIONS, BASELINE_WEIGHTS)[0])
+            for control_id in control_ids[:size]:
+                element_controls.append(ElementControl(element=element, oscal_ctl_id=control_id, oscal_catalog_key=chunk["catalog_key"]))
+                body = random_text(rng, 10, 40)
+                statements.append(Statement(sid=control_id, sid_class=chunk["catalog_key"], body=body, body_hash=statement_body_hash(body),
+                    statement_type="control_implementation", status=rng.choice(["Implemented", "Planned", "Partially Implemented"]),
+                    producer_element=rng.choice(components_by_system[name]), consumer_element=element))
+            for _ in range(rng.randint(0, chunk["poams"] * 2)):
+                body = random_text(rng, 10, 40)
+                poam_statements.append(Statement(sid=rng.choice(control_ids) if control_ids else None, sid_class=chunk["catalog_key"],
+                    body=body, body_hash=statement_body_hash(body), statement_type="POAM", consumer_element=element))
+        ElementControl.objects.bulk_create(element_controls, batch_size=BATCH_SIZE)
+        bulk_create(Statement, statements + poam_statements)
+        poam_counters = { }
+        poams = []
+        for smt in poam_statements:
+            poam_counters[smt.consumer_element.id] = poam_counters.get(smt.consumer_element.id, 0) + 1
+            poams.append(Poam(statement=smt, poam_id=poam_counters[smt.consumer_element.id], controls=smt.sid,
+                              weakness_name=random_text(rng, 2, 5), risk_rating_original=rng.choice(["Low", "Moderate", "High"])))
+        Poam.objects.bulk_create(poams, batch_size=BATCH_SIZE)
+
+        search.index_elements(elements + components)
+        search.index_statements(statements + poam_statements)
+
+    counts["projects"] = len(projects)
+    counts["tasks"] = len(root_tasks) + len(subtasks)
+    counts["answers"] = len(answers)
+    counts["answer histories"] = len(histories)
+    counts["elements"] = len(elements) + len(components)
+    counts["controls"] = len(element_controls)
+    counts["statements"] = len(statements) + len(poam_statements)
+    return counts
@@ -1,3 +1,4 @@
+import contextlib
 import sys
 import os.path
 
@@ -30,16 +31,21 @@ class Command(BaseCommand):
                 print("pausing for {} seconds -- at {}".format(options['delay'], ctime()))
                 sleep(options['delay'])
 
-        tasks = [task for task in Task.objects.all() if task.project.organization and  task.project.organization.slug == options['org']] 
-        for task in tasks:
-            print("Handling task {}".format(task.id))
+        # Unless we're pacing the answers to look like user activity, clear
+        # the cached state of the tasks once at the end.
+        batch = Task.deferred_clear_state() if options['delay'] <= 0 else contextlib.nullcontext()
 
-            halt_impute = (options['impute'] == 'halt')
-            skip_impute = (options['impute'] == 'skip')
-            did_anything = answer_randomly(task, halt_impute=halt_impute, skip_impute=skip_impute, quiet=options['quiet'])
-            if did_anything:
-                delay()
-            else:
-                print("Fully skipped")
+        tasks = Task.objects.filter(project__organization__slug=options['org']).select_related('project__organization', 'module')
+        with batch:
+            for task in tasks:
+                print("Handling task {}".format(task.id))
 
-            print("")
+                halt_impute = (options['impute'] == 'halt')
+                skip_impute = (options['impute'] == 'skip')
+                did_anything = answer_randomly(task, halt_impute=halt_impute, skip_impute=skip_impute, quiet=options['quiet'])
+                if did_anything:
+                    delay()
+                else:
+                    print("Fully skipped")
+
+                print("")
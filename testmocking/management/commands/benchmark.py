@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from testmocking import benchmark
+
+class Command(BaseCommand):
+    help = 'Times core workflows against a throwaway database filled with generated data and reports latency and query counts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs="*", choices=[[]] + [name for name, _ in benchmark.SCENARIOS], help="The scenarios to run. Defaults to all.")
+        parser.add_argument('--users', type=int, default=10, help="How many users to create.")
+        parser.add_argument('--projects', type=int, default=10, help="How many projects to create.")
+        parser.add_argument('--controls', type=int, default=50, help="How many controls to select, with an implementation statement each, in each project's system.")
+        parser.add_argument('--poams', type=int, default=10, help="How many POA&Ms to add to each project's system.")
+        parser.add_argument('--catalog', help="The key of the catalog to select controls from. Defaults to NIST SP 800-53 rev4.")
+        parser.add_argument('--iterations', type=int, default=20, help="How many times to time each scenario.")
+        parser.add_argument('--warmup', type=int, default=2, help="How many untimed runs of each scenario to make first.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the random choices made when generating data.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument('--compare', help="Compare the results with a JSON file written by a previous run.")
+        parser.add_argument('--keepdb', action="store_true", help="Keep the benchmark database rather than destroying it at the end.")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)
+
+        # Create the throwaway database the same way the test runner does.
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            fixtures = benchmark.Fixtures(
+                users=options["users"], projects=options["projects"],
+                controls=options["controls"], poams=options["poams"],
+                catalog_key=options["catalog"], seed=options["seed"])
+            fixtures.create()
+            results = benchmark.run(fixtures, options["scenarios"], options["iterations"], options["warmup"])
+        finally:
+            if not options["keepdb"]:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        print(benchmark.format_results(results, baseline))
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            print("Wrote", options["output"])
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from guidedmodules.models import AppVersion
+from siteapp.models import Organization
+
+from testmocking.bulk_data import generate
+
+class Command(BaseCommand):
+    help = 'Quickly creates a large set of users, projects with answered tasks, and systems with controls and statements for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--org', default='main', help="The slug of the organization to create projects in.")
+        parser.add_argument('--app', required=True, help="The compliance app to start projects from, as SOURCE_SLUG/APP_NAME. The latest version in the catalog is used.")
+        parser.add_argument('--users', type=int, default=100, help="How many users to create.")
+        parser.add_argument('--projects', type=int, default=1000, help="How many projects to create.")
+        parser.add_argument('--max-controls', type=int, default=300, help="The most controls to select in a system. Systems select different fractions of this many controls.")
+        parser.add_argument('--poams', type=int, default=5, help="The average number of POA&Ms per system.")
+        parser.add_argument('--catalog', help="The key of the catalog to select controls from. Defaults to NIST SP 800-53 rev4.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the random data. The same seed generates the same data.")
+        parser.add_argument('--prefix', default='load', help="Prefix for the names of generated users and systems, which must be unique, so use a different prefix for each run. It is also the users' password.")
+        parser.add_argument('--workers', type=int, default=4, help="How many worker processes to use. SQLite and MySQL always use one.")
+
+    def handle(self, *args, **options):
+        organization = Organization.objects.filter(slug=options["org"]).first()
+        if not organization:
+            raise CommandError("There is no organization {}.".format(options["org"]))
+        try:
+            source_slug, app_name = options["app"].split("/", 1)
+        except ValueError:
+            raise CommandError("--app must be given as SOURCE_SLUG/APP_NAME.")
+        appversion = AppVersion.objects.filter(source__slug=source_slug, appname=app_name, show_in_catalog=True).order_by('-id').first()
+        if not appversion:
+            raise CommandError("There is no app {} in the catalog.".format(options["app"]))
+
+        start = time.time()
+        counts = generate(organization, appversion,
+            users=options["users"], projects=options["projects"],
+            max_controls=options["max_controls"], poams=options["poams"],
+            seed=options["seed"], prefix=options["prefix"], workers=options["workers"],
+            catalog_key=options["catalog"])
+        print("Created {} in {:.0f} seconds.".format(
+            ", ".join("{} {}".format(n, key) for key, n in counts.items()),
+            time.time() - start))
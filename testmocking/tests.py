@@ -0,0 +1,72 @@
+from django.db import transaction
+
+from guidedmodules.tests import TestCaseWithFixtureData
+
+
+class BulkDataTests(TestCaseWithFixtureData):
+
+    def generate(self):
+        # Generate a small dataset and return the counts generate() reported,
+        # the row counts in the database and the generated data itself,
+        # without database IDs so that runs can be compared.
+        from guidedmodules.models import Task, TaskAnswerHistory
+        from siteapp.models import Project, User
+        from controls.models import ElementControl, Statement
+        from controls.oscal import Catalogs
+        from .bulk_data import generate
+
+        counts = generate(self.organization, self.fixture_app, users=2, projects=2, max_controls=5,
+                          poams=1, seed=1, prefix="bulktest", workers=1, catalog_key=Catalogs.NIST_SP_800_53_rev5,
+                          log=lambda message : None)
+
+        projects = Project.objects.filter(root_task__title_override__startswith="bulktest ")
+        histories = TaskAnswerHistory.objects.filter(taskanswer__task__project__in=projects)
+        statements = Statement.objects.filter(consumer_element__name__startswith="bulktest ")
+        rows = {
+            "users": User.objects.filter(username__startswith="bulktest_").count(),
+            "projects": projects.count(),
+            "tasks": Task.objects.filter(project__in=projects).count(),
+            "answer histories": histories.count(),
+            "controls": ElementControl.objects.filter(element__name__startswith="bulktest ").count(),
+            "statements": statements.count(),
+        }
+
+        # Every answer to a module-type question is a subtask in the same project.
+        module_answers = 0
+        for h in histories.select_related('taskanswer__task', 'taskanswer__question').prefetch_related('answered_by_task'):
+            if h.taskanswer.question.spec["type"] == "module":
+                subtasks = list(h.answered_by_task.all())
+                self.assertEqual(len(subtasks), 1)
+                self.assertEqual(subtasks[0].project_id, h.taskanswer.task.project_id)
+                self.assertEqual(subtasks[0].module, h.taskanswer.question.answer_type_module)
+                module_answers += 1
+        self.assertGreater(module_answers, 0)
+
+        data = {
+            "projects": list(projects.order_by('root_task__title_override')
+                .values_list('root_task__title_override', 'portfolio__title')),
+            "answers": list(histories.order_by('id')
+                .values_list('taskanswer__task__project__root_task__title_override',
+                             'taskanswer__question__key', 'answered_by__username', 'stored_value')),
+            "statements": list(statements.order_by('id')
+                .values_list('consumer_element__name', 'producer_element__name', 'statement_type', 'sid', 'body', 'status')),
+        }
+        return counts, rows, data
+
+    def test_generate(self):
+        # The same seed generates the same data.
+        runs = []
+        for _ in range(2):
+            with transaction.atomic():
+                runs.append(self.generate())
+                transaction.set_rollback(True)
+        (counts, rows, data), (counts2, rows2, data2) = runs
+
+        self.assertEqual(counts["users"], 2)
+        self.assertEqual(counts["projects"], 2)
+        self.assertLessEqual(counts["controls"], 2 * 5)
+        for key, value in rows.items():
+            self.assertEqual(counts[key], value, key)
+        self.assertEqual(counts, counts2)
+        self.assertEqual(rows, rows2)
+        self.assertEqual(data, data2)